@@ -0,0 +1,213 @@
+# 生成确定性的模拟数据写入 config.json 中配置的 MySQL, 寻访记录按 PoolInfo 的卡池日历生成
+# 会清空并重写所有表, 数据库名需要以 bench 结尾(或者加 --force)
+# 用法(在项目根目录): python -m benchmark.dataset --users 200 --accounts 500 --seed 0
+import random
+import asyncio
+import argparse
+
+from dataclasses import dataclass
+
+from peewee import chunked
+
+from src.config import conf
+from src.api.datas import PoolInfo
+from src.api.models import UserConfig, UsernameDisplayStatus
+from src.api.databases import database, DBUser, Account, AccountChannel, OperatorSearchRecord, OSROperator, PayRecord, DiamondRecord, GiftRecord, Platform, AccountJob, operator_names, pool_names
+
+INSERT_CHUNK_SIZE = 1000
+HASHED_PASSWORD = '$2b$12$KIXQJ6Qn1s6b8m1Jf0b5UuC1m1o6m7s2r9Zp8y0Kx7y1o0Q6f3e7W'  # 不需要能登录
+OPERATOR_NAMES = [f'干员{i:03d}' for i in range(300)]
+DIAMOND_GET = ['充值', '兑换码', '活动奖励', '月卡']
+DIAMOND_USE = ['兑换合成玉', '购买家具', '恢复理智', '购买时装']
+PAY_PRODUCTS = [('月卡', 3000), ('6源石', 600), ('21源石', 1800), ('42源石', 3000), ('85源石', 6800), ('175源石', 12800)]
+GIFT_CODES = [f'BENCH{i:04d}' for i in range(40)]
+
+
+@dataclass
+class Scale:
+    users: int
+    accounts: int
+    seed: int
+
+
+def make_user_config(rng: random.Random, index: int) -> UserConfig:
+    return UserConfig(
+        nickname=f'bench{index}',
+        is_statistics=rng.random() < 0.9,
+        is_lucky_rank=rng.random() < 0.6,
+        is_auto_gift=rng.random() < 0.3,
+        name_display=rng.choice(list(UsernameDisplayStatus)),
+        nickname_display=rng.random() < 0.5
+    )
+
+
+def pull_rarity(rng: random.Random, since_six: int) -> int:
+    six_rate = 0.02 + max(0, since_six - 49) * 0.02
+    roll = rng.random()
+    if roll < six_rate:
+        return 6
+    if roll < six_rate + 0.08:
+        return 5
+    if roll < six_rate + 0.58:
+        return 4
+    return 3
+
+
+def generate_osr(rng: random.Random, pools: list[dict], activity: float) -> list[tuple[int, dict, list[tuple[str, int, bool, bool | None]]]]:
+    """
+    :return: [(时间, 卡池, [(干员, 星级, 是否新干员, 是否UP)])]
+    """
+    records = []
+    since_six = 0
+    used_times: set[int] = set()
+    for pool in pools:
+        if rng.random() > activity:
+            continue
+        up_chars: list[str] = pool.get('up_char_info') or []
+        for _ in range(rng.randint(1, 30)):
+            time = rng.randint(pool['start'], pool['end'])
+            while time in used_times:
+                time += 1
+            used_times.add(time)
+
+            chars = []
+            for _ in range(10 if rng.random() < 0.7 else 1):
+                rarity = pull_rarity(rng, since_six)
+                since_six = 0 if rarity == 6 else since_six + 1
+                is_up = rng.random() < 0.5 if up_chars and rarity == 6 else False
+                name = rng.choice(up_chars) if is_up else rng.choice(OPERATOR_NAMES)
+                chars.append((name, rarity, rng.random() < 0.1, (name in up_chars) if up_chars else None))
+            records.append((time, pool, chars))
+    return records
+
+
+async def reset_tables() -> None:
+    for model in (AccountJob, GiftRecord, DiamondRecord, PayRecord, OSROperator, OperatorSearchRecord, Account, DBUser):
+        await model.delete().aio_execute()
+
+
+async def insert_chunked(model, rows: list[dict]) -> None:
+    for chunk in chunked(rows, INSERT_CHUNK_SIZE):
+        await model.insert_many(chunk).aio_execute()
+
+
+async def insert_osr(account: Account, osr: list[tuple[int, dict, list[tuple[str, int, bool, bool | None]]]]) -> int:
+    """
+    :return: 干员数
+    """
+    if conf.storage.packed_operators:
+        await insert_chunked(OperatorSearchRecord, [
+            {'account': account, 'time': time, 'real_pool': pool['real_name'], 'pool_id': pool['id'], 'packed_operators': OperatorSearchRecord.pack_operators(chars)}
+            for time, pool, chars in osr
+        ])
+        return sum(len(chars) for _, _, chars in osr)
+
+    await insert_chunked(OperatorSearchRecord, [
+        {'account': account, 'time': time, 'real_pool': pool['real_name'], 'pool_id': pool['id']} for time, pool, _ in osr
+    ])
+    record_ids: dict[int, int] = {
+        record.time: record.id for record in await (OperatorSearchRecord
+                                                    .select(OperatorSearchRecord.id, OperatorSearchRecord.time)
+                                                    .where(OperatorSearchRecord.account == account)
+                                                    .aio_execute())
+    }
+    operators = [
+        {'record': record_ids[time], 'index': index, 'name': name, 'rarity': rarity, 'is_new': is_new, 'is_up': is_up}
+        for time, _, chars in osr
+        for index, (name, rarity, is_new, is_up) in enumerate(chars)
+    ]
+    await insert_chunked(OSROperator, operators)
+    return len(operators)
+
+
+async def generate(scale: Scale) -> dict[str, int]:
+    rng = random.Random(scale.seed)
+    pools = sorted((pool for pool in PoolInfo.get_all_pools().values() if pool['type'] != 'UNKNOWN'), key=lambda pool: pool['start'])
+    counts = dict.fromkeys(('users', 'accounts', 'osr', 'operators', 'diamond', 'pay', 'gift'), 0)
+
+    await reset_tables()
+
+    users: list[dict] = []
+    for i in range(scale.users):
+        config = make_user_config(rng, i)
+        users.append({
+            'username': f'bench{i}',
+            'email': f'bench{i}@example.com',
+            'hashed_password': HASHED_PASSWORD,
+            'user_config': config,
+            'disabled': rng.random() < 0.05,
+            **DBUser.config_columns(config)
+        })
+    await insert_chunked(DBUser, users)
+    user_ids = [user.id for user in await DBUser.select(DBUser.id).order_by(DBUser.id).aio_execute()]
+    counts['users'] = len(user_ids)
+
+    order_id = 0
+    for i in range(scale.accounts):
+        account = await Account.aio_create(
+            uid=f'{10000000 + i}',
+            owner=rng.choice(user_ids) if rng.random() < 0.95 else None,
+            nickname=f'博士{i}',
+            token='bench',
+            channel=rng.choice(list(AccountChannel)),
+            available=rng.random() < 0.9
+        )
+        counts['accounts'] += 1
+
+        activity = rng.choice([0.05, 0.2, 0.5, 0.9])
+        osr = generate_osr(rng, pools, activity)
+        await pool_names.aio_register({value: {} for _, pool, _ in osr for value in (pool['real_name'], pool['id'])})
+        await operator_names.aio_register({name: {'rarity': rarity} for _, _, chars in osr for name, rarity, _, _ in chars})
+        counts['operators'] += await insert_osr(account, osr)
+        counts['osr'] += len(osr)
+
+        diamond = []
+        now_diamond = 0
+        start = pools[0]['start'] if pools else 1556668800
+        times = sorted(rng.sample(range(start, start + 5 * 365 * 86400, 60), rng.randint(5, int(200 * activity) + 5)))
+        for time in times:
+            before = now_diamond
+            if now_diamond and rng.random() < 0.5:
+                operation = rng.choice(DIAMOND_USE)
+                now_diamond -= rng.randint(1, now_diamond)
+            else:
+                operation = rng.choice(DIAMOND_GET)
+                now_diamond += rng.randint(1, 180)
+            diamond.append({'account': account, 'operation': operation, 'platform': rng.choice([Platform.ANDROID, Platform.IOS]), 'operate_time': time, 'before': before, 'after': now_diamond})
+        await insert_chunked(DiamondRecord, diamond)
+        counts['diamond'] += len(diamond)
+
+        pay = []
+        for time in rng.sample(times, min(len(times), rng.randint(0, 10))):
+            name, amount = rng.choice(PAY_PRODUCTS)
+            order_id += 1
+            pay.append({'order_id': f'BENCH{scale.seed}-{order_id}', 'name': name, 'account': account, 'pay_time': time, 'platform': rng.choice([Platform.ANDROID, Platform.IOS]), 'amount': amount})
+        await insert_chunked(PayRecord, pay)
+        counts['pay'] += len(pay)
+
+        gift = [{'account': account, 'name': f'礼包{code}', 'gift_time': start + index, 'code': code} for index, code in enumerate(rng.sample(GIFT_CODES, rng.randint(0, 10)))]
+        await insert_chunked(GiftRecord, gift)
+        counts['gift'] += len(gift)
+
+    return counts
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--accounts', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true', help='数据库名不以 bench 结尾时也写入')
+    args = parser.parse_args()
+
+    if not conf.mysql.database.endswith('bench') and not args.force:
+        raise SystemExit(f'Refusing to overwrite database {conf.mysql.database!r}, use a *bench database or --force')
+
+    try:
+        print(await generate(Scale(args.users, args.accounts, args.seed)))
+    finally:
+        await database.aio_close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+# 测量并发导入时的事件循环延迟: 在事件循环中直接校验 vs 放到进程池中校验
+# 用法(在项目根目录): python -m benchmark.import_lag --records 20000 --concurrency 4
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from src.api.arkgacha_export import check_export_file
+
+
+def generate_export(path: Path, records: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    data = {
+        str(1600000000 + i * 60): {
+            'p': '常驻标准寻访',
+            'c': [[f'干员{rng.randint(0, 300)}', rng.choice([2, 2, 2, 3, 3, 4, 5]), rng.randint(0, 1)] for _ in range(10)]
+        } for i in range(records)
+    }
+    export = {'info': {'uid': '00000000', 'export_type': 'gacha', 'verify': 'AAAA'}, 'data': data}
+    path.write_text(json.dumps(export, ensure_ascii=False), encoding='utf-8')
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.005) -> list[float]:
+    lags: list[float] = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def run(mode: str, path: Path, concurrency: int, executor: ProcessPoolExecutor) -> dict[str, object]:
+    async def inline() -> None:
+        check_export_file(str(path))
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    if mode == 'inline':
+        await asyncio.gather(*(inline() for _ in range(concurrency)))
+    else:
+        await asyncio.gather(*(loop.run_in_executor(executor, check_export_file, str(path)) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = sorted(await lag_task)
+    return {
+        'mode': mode,
+        'elapsed_s': round(elapsed, 3),
+        'max_lag_ms': round(lags[-1] * 1000, 2),
+        'p99_lag_ms': round(lags[int(len(lags) * 0.99)] * 1000, 2)
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'export.json'
+        generate_export(path, args.records)
+        print(f'export size: {path.stat().st_size / 1024 / 1024:.1f} MiB')
+
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            await asyncio.get_running_loop().run_in_executor(executor, int)  # 预热进程
+            for mode in ('inline', 'executor'):
+                print(json.dumps(await run(mode, path, args.concurrency, executor)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+# 测量刷新全站统计时的事件循环延迟: 在事件循环中直接聚合 vs 放到进程池中聚合
+# 用法(在项目根目录): python -m benchmark.statistics_lag --records 1000000
+import json
+import time
+import random
+import asyncio
+import argparse
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src.api.statistics_compute import OSRColumns, DiamondColumns, summarize_site_statistics
+
+POOL_TYPES = ('LIMITED', 'NORMAL', 'SINGLE', 'CLASSIC', 'UNKNOWN')
+
+
+def generate_columns(records: int, accounts: int, seed: int = 0) -> tuple[OSRColumns, dict[str, tuple[str, bool]], DiamondColumns]:
+    rng = random.Random(seed)
+    pool_types = {f'POOL_{i}': (rng.choice(POOL_TYPES), rng.random() < 0.5) for i in range(200)}
+
+    osr = OSRColumns(pool_ids=list(pool_types))
+    time_now = 1600000000
+    for _ in range(records):
+        time_now += rng.randint(0, 120)
+        rarity = rng.choice((3, 3, 3, 3, 4, 4, 5, 6))
+        osr.time.append(time_now)
+        osr.pool.append(rng.randrange(len(osr.pool_ids)))
+        osr.rarity.append(rarity)
+        osr.is_up.append(rng.randint(0, 1) if rarity == 6 else -1)
+
+    diamond = DiamondColumns(operations=['充值', '购买物资', '兑换', '寻访'])
+    for account in range(accounts):
+        for _ in range(records // accounts // 10):
+            before = rng.randint(0, 1000)
+            diamond.account.append(account)
+            diamond.operation.append(rng.randrange(len(diamond.operations)))
+            diamond.before.append(before)
+            diamond.after.append(max(0, before + rng.randint(-50, 50)))
+    return osr, pool_types, diamond
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.005) -> list[float]:
+    lags: list[float] = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def run(mode: str, args: tuple, executor: ProcessPoolExecutor) -> dict[str, object]:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    if mode == 'inline':
+        summarize_site_statistics(*args)
+    else:
+        await loop.run_in_executor(executor, summarize_site_statistics, *args)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = sorted(await lag_task)
+    return {
+        'mode': mode,
+        'elapsed_s': round(elapsed, 3),
+        'max_lag_ms': round(lags[-1] * 1000, 2),
+        'p99_lag_ms': round(lags[int(len(lags) * 0.99)] * 1000, 2)
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=1000000, help='干员记录数')
+    parser.add_argument('--accounts', type=int, default=1000)
+    args = parser.parse_args()
+
+    columns = generate_columns(args.records, args.accounts)
+    print(f'osr rows: {len(columns[0])}, diamond rows: {len(columns[2])}')
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        await asyncio.get_running_loop().run_in_executor(executor, int)  # 预热进程
+        for mode in ('inline', 'executor'):
+            print(json.dumps(await run(mode, columns, executor)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
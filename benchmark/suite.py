@@ -0,0 +1,193 @@
+# 在 benchmark.dataset 生成的数据上测量各个接口的耗时, SQL 数量和峰值内存, 并与 JSON 基线比较
+# 用法(在项目根目录):
+#   python -m benchmark.suite --save              # 记录基线
+#   python -m benchmark.suite                     # 与基线比较, 有退化时返回非 0
+import sys
+import json
+import time
+import random
+import asyncio
+import platform
+import argparse
+import tracemalloc
+
+from pathlib import Path
+from statistics import median
+from typing import Awaitable, Callable
+
+from src.config import conf
+from src.api.accounts import AccountInDB
+from src.api.account_datas import get_osr_info, get_osr_pool_info, get_diamond_info, get_pay_record_info
+from src.api.arkgacha_data_import import gacha_data_import, pay_data_import
+from src.api.databases import database, Account, AccountChannel, OperatorSearchRecord, OSROperator, PayRecord
+from src.api.query_counter import track_queries
+from src.api import statistics
+
+from benchmark.dataset import OPERATOR_NAMES
+
+BASELINE_PATH = Path(__file__).parent / 'baseline.json'
+INGEST_UID = 'bench-ingest'
+
+type Case = Callable[[], Awaitable[object]]
+
+
+async def measure(case: Case, repeat: int, setup: Case | None = None) -> dict[str, float]:
+    # 第一次运行同时作为预热, 单独统计 SQL 数量和峰值内存, 避免 tracemalloc 影响计时
+    if setup is not None:
+        await setup()
+    tracemalloc.start()
+    with track_queries() as stats:
+        await case()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings: list[float] = []
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        start = time.perf_counter()
+        await case()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    return {
+        'median_ms': round(median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'min_ms': round(timings[0], 3),
+        'queries': stats.count,
+        'query_ms': round(stats.total_time * 1000, 3),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+async def sample_accounts(count: int) -> list[AccountInDB]:
+    # 按 id 均匀取样, 结果是确定的
+    accounts = list(await Account.select().where(Account.uid != INGEST_UID).order_by(Account.id).aio_execute())
+    if not accounts:
+        raise SystemExit('No accounts, run python -m benchmark.dataset first')
+    step = max(1, len(accounts) // count)
+    return [AccountInDB.model_validate(account) for account in accounts[::step][:count]]
+
+
+async def most_used_pool(account: AccountInDB) -> str | None:
+    records = await (OperatorSearchRecord
+                     .select(OperatorSearchRecord.pool_id)
+                     .where((OperatorSearchRecord.account == account.id) & OperatorSearchRecord.pool_id.is_null(False))
+                     .aio_execute())
+    pools = [record.pool_id for record in records]
+    return max(set(pools), key=pools.count) if pools else None
+
+
+async def reset_ingest_account() -> Account:
+    account, _ = await Account.aio_get_or_create(uid=INGEST_UID, defaults={'nickname': INGEST_UID, 'token': 'bench', 'channel': AccountChannel.OFFICIAL, 'available': False})
+    record_ids = OperatorSearchRecord.select(OperatorSearchRecord.id).where(OperatorSearchRecord.account == account)
+    await OSROperator.delete().where(OSROperator.record.in_(record_ids)).aio_execute()
+    await OperatorSearchRecord.delete().where(OperatorSearchRecord.account == account).aio_execute()
+    await PayRecord.delete().where(PayRecord.account == account).aio_execute()
+    return account
+
+
+def make_ingest_cases(records: int) -> dict[str, Case]:
+    rng = random.Random(0)
+    gacha_batch = [
+        (str(1600000000 + i * 60), {'p': '常驻标准寻访', 'c': [[rng.choice(OPERATOR_NAMES), rng.randint(2, 5), rng.randint(0, 1)] for _ in range(10)]})
+        for i in range(records)
+    ]
+    pay_batch = [
+        (str(1600000000 + i * 60), {'orderId': f'{INGEST_UID}-{i}', 'productName': '6源石', 'platform': 1, 'amount': 600})
+        for i in range(records)
+    ]
+
+    async def gacha() -> None:
+        await gacha_data_import(gacha_batch, await Account.aio_get(Account.uid == INGEST_UID))
+
+    async def pay() -> None:
+        await pay_data_import(pay_batch, await Account.aio_get(Account.uid == INGEST_UID))
+
+    return {'ingest.gacha_data_import': gacha, 'ingest.pay_data_import': pay}
+
+
+async def collect_cases(accounts: int, ingest_records: int) -> dict[str, Case]:
+    cases: dict[str, Case] = {}
+    for account in await sample_accounts(accounts):
+        cases[f'account_datas.get_osr_info[{account.uid}]'] = lambda account=account: get_osr_info(account)
+        if pool_id := await most_used_pool(account):
+            cases[f'account_datas.get_osr_pool_info[{account.uid}]'] = lambda account=account, pool_id=pool_id: get_osr_pool_info(account, pool_id)
+        cases[f'account_datas.get_diamond_info[{account.uid}]'] = lambda account=account: get_diamond_info(account)
+        cases[f'account_datas.get_pay_record_info[{account.uid}]'] = lambda account=account: get_pay_record_info(account)
+
+    # 绕过 cached_with_refresh, 测量实际的计算
+    for name in ('compute_lucky_rank', 'compute_pool_lucky_rank', 'compute_six_up_rank', 'compute_site_statistics'):
+        cases[f'statistics.{name}'] = getattr(statistics, name).__wrapped__
+
+    cases.update(make_ingest_cases(ingest_records))
+    return cases
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> list[str]:
+    regressions: list[str] = []
+    print(f'{"case":<60} {"median_ms":>20} {"queries":>14} {"peak_kb":>20}')
+    for name, now in result['cases'].items():
+        if (old := baseline['cases'].get(name)) is None:
+            print(f'{name:<60} {now["median_ms"]:>20} {now["queries"]:>14} {now["peak_kb"]:>20}  (new)')
+            continue
+
+        def delta(key: str) -> str:
+            change = (now[key] - old[key]) / old[key] if old[key] else 0
+            return f'{now[key]} ({change:+.0%})'
+
+        print(f'{name:<60} {delta("median_ms"):>20} {delta("queries"):>14} {delta("peak_kb"):>20}')
+        if now['queries'] > old['queries']:
+            regressions.append(f'{name}: queries {old["queries"]} -> {now["queries"]}')
+        if now['median_ms'] > old['median_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: median {old["median_ms"]}ms -> {now["median_ms"]}ms')
+    return regressions
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=5, help='测试多少个账号的个人数据接口')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--ingest-records', type=int, default=500)
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='把结果保存为新的基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='耗时超过基线这么多比例视为退化')
+    args = parser.parse_args()
+
+    if not conf.mysql.database.endswith('bench'):
+        raise SystemExit(f'Refusing to benchmark on database {conf.mysql.database!r}, use a *bench database')
+
+    try:
+        cases = await collect_cases(args.accounts, args.ingest_records)
+        result = {
+            'meta': {
+                'python': platform.python_version(),
+                'time': int(time.time()),
+                'repeat': args.repeat,
+                'accounts': await Account.select().aio_count(),
+                'records': await OperatorSearchRecord.select().aio_count()
+            },
+            'cases': {}
+        }
+        for name, case in cases.items():
+            result['cases'][name] = await measure(case, args.repeat, reset_ingest_account if name.startswith('ingest.') else None)
+        await reset_ingest_account()
+    finally:
+        await database.aio_close()
+
+    if args.save or not args.baseline.exists():
+        args.baseline.write_text(json.dumps(result, indent=4, ensure_ascii=False), encoding='utf-8')
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+    if baseline['meta']['records'] != result['meta']['records']:
+        print(f'Warning: baseline was recorded on {baseline["meta"]["records"]} records, now {result["meta"]["records"]}')
+    regressions = compare(baseline, result, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,43 @@
+# 输出 config.json 中配置的数据库里每张表的行数和占用空间, 用来比较存储格式修改前后的表大小
+# 用法(在项目根目录): python -m benchmark.table_sizes
+# 先执行 ANALYZE TABLE, 否则 information_schema 中的统计信息可能是过期的
+import json
+import asyncio
+
+from src.config import conf
+from src.api.databases import database
+
+MIB = 1 << 20
+
+
+async def fetch_all(cursor) -> list[tuple]:
+    return list(await cursor.fetchall())
+
+
+async def collect_sizes() -> dict[str, dict[str, float]]:
+    tables = [row[0] for row in await database.aio_execute_sql('SELECT table_name FROM information_schema.tables WHERE table_schema = %s', [conf.mysql.database], fetch_all)]
+    for table in tables:
+        await database.aio_execute_sql(f'ANALYZE TABLE `{table}`')
+
+    sizes: dict[str, dict[str, float]] = {}
+    for table, rows, data_length, index_length in await database.aio_execute_sql(
+            'SELECT table_name, table_rows, data_length, index_length FROM information_schema.tables WHERE table_schema = %s ORDER BY data_length DESC',
+            [conf.mysql.database], fetch_all):
+        sizes[table] = {
+            'rows': rows,
+            'data_mib': round(data_length / MIB, 2),
+            'index_mib': round(index_length / MIB, 2),
+            'bytes_per_row': round((data_length + index_length) / rows, 1) if rows else 0
+        }
+    return sizes
+
+
+async def main() -> None:
+    try:
+        print(json.dumps(await collect_sizes(), indent=4, ensure_ascii=False))
+    finally:
+        await database.aio_close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -84,6 +84,7 @@ async def get_osr_info(account: AccountInDB) -> OSRInfo:
     osr_pool: list[str] = []
 
     records = await OperatorSearchRecord.select().where(OperatorSearchRecord.account == db_account).order_by(OperatorSearchRecord.time).aio_execute()
+    record_operators = await OperatorSearchRecord.aio_get_operators_of(records)
 
     record: OperatorSearchRecord
     for record in records:
@@ -99,7 +100,7 @@ async def get_osr_info(account: AccountInDB) -> OSRInfo:
         if pool_id not in osr_pool:
             osr_pool.append(pool_id)
 
-        operators = await OSROperator.select().where(OSROperator.record == record).aio_execute()
+        operators = record_operators[record.id]
         operators_number = len(operators)
 
         osr_number_month[datetime.fromtimestamp(record.time).strftime('%Y-%m')] += operators_number
@@ -185,10 +186,11 @@ async def get_osr_pool_info(account: AccountInDB, pool_id: str) -> OSRPoolInfo:
     osr_five_record = []
 
     records = await OperatorSearchRecord.select().where((OperatorSearchRecord.account == db_account) & (OperatorSearchRecord.pool_id == pool_id)).order_by(OperatorSearchRecord.time).aio_execute()
+    record_operators = await OperatorSearchRecord.aio_get_operators_of(records)
 
     record: OperatorSearchRecord
     for record in records:
-        operators = await OSROperator.select().where(OSROperator.record == record).aio_execute()
+        operators = record_operators[record.id]
         operators_number = len(operators)
         record_time = datetime.fromtimestamp(record.time)
 
@@ -1,8 +1,7 @@
-import asyncio
-
-from src.api.databases import Account, AccountChannel, DBUser
+from src.api.databases import Account, AccountChannel, DBUser, JobType
 from src.api.users import UserBase, UserInDB, get_current_active_user
 from src.api.arknights_data_analysis import ArknightsDataAnalysis
+from src.api.jobs import enqueue_job
 
 from fastapi import HTTPException, status, Depends
 from pydantic import BaseModel, ConfigDict
@@ -25,7 +24,7 @@ class AccountInDB(AccountInfo):
     token: str
 
     async def get_db(self) -> Account:
-        return await Account.aio_get(Account.id == self.id)
+        return await Account.aio_get_by_id(self.id)
 
 
 class AccountRefresh(AccountBase):
@@ -51,7 +50,7 @@ async def get_account_by_token(account_create: AccountCreate) -> AccountInDB:
     analysis, created = await ArknightsDataAnalysis.get_or_create_analysis(account_create.token, account_create.channel)
     if analysis:
         if created:
-            _ = asyncio.create_task(analysis.fetch_data(True))
+            await enqueue_job(analysis.account, JobType.FETCH, force=True)
         return AccountInDB.model_validate(analysis.account)
     else:
         raise HTTPException(
@@ -87,6 +86,8 @@ async def get_account_by_uid(account: AccountBase, user: UserBase = Depends(get_
             detail="account.not_owner"
         )
 
+    db_account.remember()
+    db_account.owner.remember()
     return AccountInDB.model_validate(db_account)
 
 
@@ -109,7 +110,7 @@ async def refresh_account_data(account: AccountInDB, refresh_info: AccountRefres
 
     analysis: ArknightsDataAnalysis
     if refresh_info.token:
-        analysis = (await ArknightsDataAnalysis.get_or_create_analysis(refresh_info.token, db_account.channel))[0]
+        analysis = (await ArknightsDataAnalysis.get_or_create_analysis(refresh_info.token, db_account.channel, db_account))[0]
     else:
         analysis = await ArknightsDataAnalysis.get_analysis(db_account)
 
@@ -119,4 +120,4 @@ async def refresh_account_data(account: AccountInDB, refresh_info: AccountRefres
             detail="account.refresh.token_invalid"
         )
 
-    _ = asyncio.create_task(analysis.fetch_data(refresh_info.force))
+    await enqueue_job(analysis.account, JobType.FETCH, force=refresh_info.force)
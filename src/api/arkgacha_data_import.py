@@ -1,136 +1,229 @@
 import json
-import base64
+import time
 import asyncio
+import multiprocessing
 
-from cryptography.exceptions import InvalidSignature
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from fastapi import HTTPException, status
+from uuid import uuid4
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
+from fastapi import HTTPException, status, UploadFile
+from peewee import chunked
+
+from src.config import conf
 from src.api.accounts import AccountInDB
-from src.api.databases import database, OperatorSearchRecord, Account, OSROperator, Platform, PayRecord
+from src.api.arkgacha_export import check_export_file, iter_export_data
+from src.api.databases import database, OperatorSearchRecord, Account, OSROperator, Platform, PayRecord, JobType, AccountJob, operator_names, pool_names
 from src.api.datas import PoolInfo
-from src.logger import logger
-
-with open("data/arkgacha_public_key.pem", "rb") as key_file:
-    public_key = serialization.load_pem_public_key(key_file.read())
-
-
-def verify_signature(data: dict, signature: str) -> bool:
-    json_str = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
-    try:
-        public_key.verify(base64.b64decode(signature), json_str.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
-        return True
-    except InvalidSignature:
-        return False
-    except Exception as e:
-        logger.warning(f'verify signature error: {e}')
-        return False
+from src.api.jobs import enqueue_job
+from src.api.pull_snapshot import on_pulls_changed
+from src.data_store import get_res_path
+
+INSERT_CHUNK_SIZE = 1000
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# 解析和校验上传文件是 CPU 密集的, 放到独立进程中避免阻塞事件循环
+import_executor = ProcessPoolExecutor(max_workers=conf.arkgacha_import.verify_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+async def gacha_data_import(data: list[tuple[str, dict[str, str | list[list[str | int]]]]], db_account: Account) -> int:
+    """
+    :return: 新增的记录数
+    """
+    items: dict[int, tuple[str | None, str | None, list[list[str | int]]]] = {}
+    for time, item in data:
+        time: int = int(time)
+        chars: list[list[str | int]] = item.get('c')
+        real_pool: str | None = PoolInfo.pool_name_fix(item.get('p'))
+        pool_id: str | None
+        if real_pool == '未知卡池':
+            real_pool = None
+            pool_id = None
+        else:
+            pool_id = PoolInfo.get_pool_id_by_info(real_pool, time)
+        items[time] = (real_pool, pool_id, chars)
 
+    # 字典表的写入不能放在事务中
+    await pool_names.aio_register({value: {} for real_pool, pool_id, _ in items.values() for value in (real_pool, pool_id) if value})
+    await operator_names.aio_register({char_item[0]: {'rarity': char_item[1] + 1} for _, _, chars in items.values() for char_item in chars})
 
-async def __gacha_data_import(data: dict[str, dict[str, str | list[list[str | int]]]], account: AccountInDB):
-    db_account: Account = await account.get_db()
+    updated_records: list[int] = []
     async with database.aio_atomic():
-        for time, item in data.items():
-            time: int = int(time)
-            chars: list[list[str | int]] = item.get('c')
-            real_pool: str | None = PoolInfo.pool_name_fix(item.get('p'))
-            pool_id: str | None
-            if real_pool == '未知卡池':
-                real_pool = None
-                pool_id = None
-            else:
-                pool_id = PoolInfo.get_pool_id_by_info(real_pool, time)
-
-            osr: OperatorSearchRecord
-            osr, created = await OperatorSearchRecord.aio_get_or_create(account=db_account, time=time, defaults={'real_pool': real_pool, 'pool_id': pool_id})
-
-            pool_info = PoolInfo.get_pool_info(pool_id)
-            is_up_pool = 'up_char_info' in pool_info
-
-            if created:
+        records: dict[int, OperatorSearchRecord] = {
+            record.time: record for record in await (OperatorSearchRecord
+                                                     .select()
+                                                     .where((OperatorSearchRecord.account == db_account) & (OperatorSearchRecord.time.in_(list(items))))
+                                                     .aio_execute())
+        }
+        new_times: list[int] = [time for time in items if time not in records]
+
+        if new_times and conf.storage.packed_operators:
+            records_data: list[dict] = []
+            for time in new_times:
+                real_pool, pool_id, chars = items[time]
+                pool_info = PoolInfo.get_pool_info(pool_id)
+                is_up_pool = 'up_char_info' in pool_info
+                records_data.append({
+                    'account': db_account, 'time': time, 'real_pool': real_pool, 'pool_id': pool_id,
+                    'packed_operators': OperatorSearchRecord.pack_operators([
+                        (char_item[0], char_item[1] + 1, bool(char_item[2]), char_item[0] in pool_info['up_char_info'] if is_up_pool else None) for char_item in chars
+                    ])
+                })
+            for chunk in chunked(records_data, INSERT_CHUNK_SIZE):
+                await OperatorSearchRecord.insert_many(chunk).aio_execute()
+        elif new_times:
+            await OperatorSearchRecord.insert_many([
+                {'account': db_account, 'time': time, 'real_pool': items[time][0], 'pool_id': items[time][1]} for time in new_times
+            ]).aio_execute()
+
+            operators: list[dict] = []
+            created: OperatorSearchRecord
+            for created in await (OperatorSearchRecord
+                                  .select(OperatorSearchRecord.id, OperatorSearchRecord.time)
+                                  .where((OperatorSearchRecord.account == db_account) & (OperatorSearchRecord.time.in_(new_times)))
+                                  .aio_execute()):
+                _, pool_id, chars = items[created.time]
+                pool_info = PoolInfo.get_pool_info(pool_id)
+                is_up_pool = 'up_char_info' in pool_info
+
                 index: int
-                char_item: dict
+                char_item: list[str | int]
                 for index, char_item in enumerate(chars):
                     name: str = char_item[0]
-                    rarity: int = char_item[1] + 1
-                    is_new: bool = bool(char_item[2])
-                    is_up: bool | None = name in pool_info['up_char_info'] if is_up_pool else None
-                    await OSROperator.aio_create(name=name, rarity=rarity, is_new=is_new, index=index, record=osr, is_up=is_up)
-            elif pool_id and osr.real_pool != real_pool:
+                    operators.append({
+                        'record': created.id,
+                        'index': index,
+                        'name': name,
+                        'rarity': char_item[1] + 1,
+                        'is_new': bool(char_item[2]),
+                        'is_up': name in pool_info['up_char_info'] if is_up_pool else None
+                    })
+
+            for chunk in chunked(operators, INSERT_CHUNK_SIZE):
+                await OSROperator.insert_many(chunk).aio_execute()
+
+        osr: OperatorSearchRecord
+        for time, osr in records.items():
+            real_pool, pool_id, _ = items[time]
+            if pool_id and osr.real_pool != real_pool:
                 osr.real_pool = real_pool
                 osr.pool_id = pool_id
                 await osr.aio_save()
+                updated_records.append(osr.id)
+
+                pool_info = PoolInfo.get_pool_info(pool_id)
+                if 'up_char_info' in pool_info:
+                    await osr.aio_update_is_up(pool_info['up_char_info'])
+
+    if new_times or updated_records:
+        await on_pulls_changed(updated_records)
+    return len(new_times)
+
+
+async def pay_data_import(data: list[tuple[str, dict[str, str | int]]], account: Account) -> int:
+    """
+    :return: 新增的记录数
+    """
+    items: dict[str, dict] = {}
+    item: dict
+    for time, item in data:
+        items[item['orderId']] = {
+            'order_id': item['orderId'],
+            'name': item['productName'],
+            'pay_time': int(time),
+            'account': account,
+            'platform': Platform.get(item['platform']),
+            'amount': item['amount']
+        }
 
-                if is_up_pool:
-                    osr_operator: OSROperator
-                    for osr_operator in await OSROperator.select().where(OSROperator.record == osr).aio_execute():
-                        osr_operator.is_up = bool(osr_operator.name in pool_info['up_char_info'])
-                        await osr_operator.aio_save()
-
-
-async def __pay_data_import(data: dict[str, dict[str, str | int]], account: AccountInDB):
-    account: Account = await account.get_db()
     async with database.aio_atomic():
-        item: dict
-        for time, item in data.items():
-            order_id: str = item['orderId']
-            name: str = item['productName']
-            amount: int = item['amount']
-            pay_time: int = int(time)
-            platform: Platform = Platform.get(item['platform'])
-
-            await PayRecord.aio_get_or_create(
-                order_id=order_id,
-                defaults={
-                    'name': name,
-                    'pay_time': pay_time,
-                    'account': account,
-                    'platform': platform,
-                    'amount': amount
-                }
-            )
+        exists: set[str] = {
+            record.order_id for record in await PayRecord.select(PayRecord.order_id).where(PayRecord.order_id.in_(list(items))).aio_execute()
+        }
+        new_records = [value for order_id, value in items.items() if order_id not in exists]
+        if new_records:
+            await PayRecord.insert_many(new_records).aio_execute()
+
+    return len(new_records)
+
+
+async def import_file(job: AccountJob, account: Account):
+    progress: dict[str, int] = {'seen': 0, 'inserted': 0, 'skipped': 0}
+    batches = iter_export_data(Path(job.payload))
+    while batch := await asyncio.to_thread(next, batches, None):  # 解析在线程中进行
+        match job.type:
+            case JobType.IMPORT_GACHA:
+                inserted = await gacha_data_import(batch, account)
+            case JobType.IMPORT_PAY:
+                inserted = await pay_data_import(batch, account)
+            case _:
+                raise ValueError(f'Unsupported import job type {job.type}')
+
+        progress['seen'] += len(batch)
+        progress['inserted'] += inserted
+        progress['skipped'] += len(batch) - inserted
+        # 同时更新 updated_at, 让 job_maintenance 知道任务仍在运行
+        await AccountJob.update(progress=progress, updated_at=int(time.time())).where(AccountJob.id == job.id).aio_execute()
+
+
+async def save_upload(file: UploadFile) -> Path:
+    path: Path = get_res_path(['data', 'import']) / f'{uuid4().hex}.json'
+    size: int = 0
+    with path.open('wb') as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > conf.arkgacha_import.max_upload_size:
+                break
+            await asyncio.to_thread(f.write, chunk)
+
+    if size > conf.arkgacha_import.max_upload_size:
+        path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='arkgacha_import.file_too_large'
+        )
+    return path
 
 
-async def data_import(data: bytes, account: AccountInDB):
+async def data_import(path: Path, account: AccountInDB):
     try:
-        data: dict = json.loads(data)
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='arkgacha_import.file_not_json'
-        )
-    if info := data.get('info'):
-        if not isinstance(info, dict):
+        try:
+            info, signature, valid = await asyncio.get_running_loop().run_in_executor(import_executor, check_export_file, str(path))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='arkgacha_import.file_not_json'
+            )
+
+        if info is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='arkgacha_import.no_info'
             )
-        if verify := info.get('verify'):
-            del data['info']['verify']
-            if not verify_signature(data, verify):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail='arkgacha_import.invalid_signature'
-                )
-        else:
+        if not signature:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='arkgacha_import.miss_signature'
             )
+        if not valid:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='arkgacha_import.invalid_signature'
+            )
 
+        job_type: JobType
         match info.get('export_type'):
             case 'gacha':
-                _ = asyncio.create_task(__gacha_data_import(data.get('data'), account))
+                job_type = JobType.IMPORT_GACHA
             case 'pay':
-                _ = asyncio.create_task(__pay_data_import(data.get('data'), account))
+                job_type = JobType.IMPORT_PAY
             case _:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail='arkgacha_import.unsupported_export_type'
                 )
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='arkgacha_import.no_info'
-        )
+
+        await enqueue_job(await account.get_db(), job_type, payload=str(path))
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
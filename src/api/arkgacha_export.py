@@ -0,0 +1,95 @@
+# arkgacha 导出文件的解析与签名校验
+# 会在进程池中执行, 不要在这里导入数据库相关的模块
+import json
+import base64
+
+from pathlib import Path
+from typing import Any, Iterator
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, utils
+
+from src.api.json_stream import JsonStreamReader
+
+IMPORT_BATCH_SIZE = 500
+
+with open("data/arkgacha_public_key.pem", "rb") as key_file:
+    public_key = serialization.load_pem_public_key(key_file.read())
+
+
+def dump_json(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+
+
+def verify_signature(digest: bytes, signature: str) -> bool:
+    try:
+        public_key.verify(base64.b64decode(signature), digest, padding.PKCS1v15(), utils.Prehashed(hashes.SHA256()))
+        return True
+    except (InvalidSignature, ValueError):
+        return False
+
+
+def read_export_info(path: Path) -> tuple[dict | None, str | None, bytes]:
+    """
+    流式读取导出文件, 同时计算签名摘要
+    签名的内容是去掉 info.verify 后整个文件的紧凑 JSON, 这里按文件中的顺序逐段序列化计算
+    :param path: 导出文件
+    :return: info(不存在或不是对象时为 None), 签名, 摘要
+    """
+    hasher = hashes.Hash(hashes.SHA256())
+    info: dict | None = None
+    signature: str | None = None
+
+    with path.open('rb') as file:
+        reader = JsonStreamReader(file)
+        hasher.update(b'{')
+        for index, key in enumerate(reader.iter_object()):
+            hasher.update((b',' if index else b'') + dump_json(key) + b':')
+            if key == 'data' and reader.peek() == '{':
+                hasher.update(b'{')
+                for data_index, data_key in enumerate(reader.iter_object()):
+                    hasher.update((b',' if data_index else b'') + dump_json(data_key) + b':' + dump_json(reader.read_value()))
+                hasher.update(b'}')
+                continue
+
+            value = reader.read_value()
+            if key == 'info':
+                info = value if isinstance(value, dict) and value else None
+                if info is not None:
+                    signature = info.pop('verify', None)
+            hasher.update(dump_json(value))
+        hasher.update(b'}')
+
+        if not reader.at_end():
+            raise json.JSONDecodeError('Extra data', '', 0)
+
+    return info, signature, hasher.finalize()
+
+
+def check_export_file(path: str) -> tuple[dict | None, str | None, bool]:
+    """
+    读取并校验导出文件, 在进程池中执行
+    :param path: 导出文件
+    :return: info, 签名, 签名是否有效
+    """
+    info, signature, digest = read_export_info(Path(path))
+    return info, signature, info is not None and bool(signature) and verify_signature(digest, signature)
+
+
+def iter_export_data(path: Path, batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[list[tuple[str, Any]]]:
+    with path.open('rb') as file:
+        reader = JsonStreamReader(file)
+        for key in reader.iter_object():
+            if key != 'data':
+                reader.read_value()
+                continue
+
+            batch: list[tuple[str, Any]] = []
+            for item in reader.iter_items():
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
@@ -1,56 +1,65 @@
 import asyncio
 from typing import Self
 
+from src.config import conf
 from src.api.arknights_data_request import ArknightsDataRequest, create_request_by_token
-from src.api.databases import Account, AccountChannel, OperatorSearchRecord, OSROperator, DiamondRecord, Platform, PayRecord, GiftRecord, database
+from src.api.databases import Account, AccountChannel, OperatorSearchRecord, OSROperator, DiamondRecord, Platform, PayRecord, GiftRecord, database, operator_names, pool_names
 from src.api.datas import PoolInfo
+from src.api.pull_snapshot import on_pulls_changed
+from src.api.diamond_snapshot import on_diamonds_changed
 from src.logger import logger
 
 
 async def fix_osr_pool(account: Account) -> None:
-    async with database.aio_atomic():
-        records = await (OperatorSearchRecord
-                         .select()
-                         .where(OperatorSearchRecord.account == account)
-                         .where(OperatorSearchRecord.pool_id.is_null())
-                         .aio_execute())
-        record: OperatorSearchRecord
+    records = await (OperatorSearchRecord
+                     .select()
+                     .where(OperatorSearchRecord.account == account)
+                     .where(OperatorSearchRecord.pool_id.is_null())
+                     .aio_execute())
+    record: OperatorSearchRecord
+    pool_ids: dict[int, str | None] = {
+        record.id: PoolInfo.get_pool_id_by_info(record.real_pool, record.time) for record in records if record.real_pool is not None  # TODO 推测未知卡池
+    }
+    await pool_names.aio_register({pool_id: {} for pool_id in pool_ids.values() if pool_id})
 
+    async with database.aio_atomic():
         async def fix_record(record: OperatorSearchRecord) -> None:
-            if record.real_pool is None:
-                return  # TODO 推测未知卡池
-            pool_id = PoolInfo.get_pool_id_by_info(record.real_pool, record.time)
+            if record.id not in pool_ids:
+                return
+            pool_id = pool_ids[record.id]
             record.pool_id = pool_id
             await record.aio_save()
 
             pool_info = PoolInfo.get_pool_info(pool_id)
             if 'up_char_info' in pool_info:
-                osr_operator: OSROperator
-                for osr_operator in await OSROperator.select().where(OSROperator.record == record).aio_execute():
-                    osr_operator.is_up = bool(osr_operator.name in pool_info['up_char_info'])
-                    await osr_operator.aio_save()
+                await record.aio_update_is_up(pool_info['up_char_info'])
 
         await asyncio.gather(*(fix_record(record) for record in records))
+    if records:
+        await on_pulls_changed([record.id for record in records])
 
 
 class ArknightsDataAnalysis:
     def __init__(self, account: Account, request: ArknightsDataRequest) -> None:
         self.account: Account = account
         self.request: ArknightsDataRequest = request
+        self.new_records: int = 0  # 上次 fetch_data 新增的寻访 源石 充值记录数, 用于估计账号活跃度
 
     async def fetch_data(self, force: bool = False) -> bool:
         try:
-            await self.fetch_osr(force)
-            await self.fetch_diamond_record()
-            await self.fetch_pay_record()
+            self.new_records = await self.fetch_osr(force)
+            self.new_records += await self.fetch_diamond_record()
+            self.new_records += await self.fetch_pay_record()
             await self.fetch_gift_record()
         except ValueError as e:
             logger.warning(f'Fetch Data error::{e}')
             return False
         return True
 
-    async def fetch_osr(self, force: bool = False) -> None:
+    async def fetch_osr(self, force: bool = False) -> int:
         last_time: int = 0
+        new_records: int = 0
+        updated_records: list[int] = []
 
         if not force and await OperatorSearchRecord.select().where(OperatorSearchRecord.account == self.account).aio_count():
             record: OperatorSearchRecord = (await OperatorSearchRecord.select().where(OperatorSearchRecord.account == self.account).order_by(OperatorSearchRecord.time.desc()).limit(1).aio_execute())[0]
@@ -59,47 +68,59 @@ class ArknightsDataAnalysis:
         osr_datas: list = await self.request.get_cards_record(last_time)
         logger.debug(osr_datas)
 
-        async with database.aio_atomic():
-            item: dict
-            for item in osr_datas:
-                time: int = item['ts']
-                chars: list = item['chars']
-                real_pool: str | None = PoolInfo.pool_name_fix(item['pool'])
-                pool_id: str | None
-                if real_pool == '未知卡池':
-                    real_pool = None
-                    pool_id = None
-                else:
-                    pool_id = PoolInfo.get_pool_id_by_info(real_pool, time)
-
-                osr: OperatorSearchRecord
-                osr, created = await OperatorSearchRecord.aio_get_or_create(account=self.account, time=time, defaults={'real_pool': real_pool, 'pool_id': pool_id})
+        items: list[tuple[int, list, str | None, str | None]] = []
+        item: dict
+        for item in osr_datas:
+            time: int = item['ts']
+            real_pool: str | None = PoolInfo.pool_name_fix(item['pool'])
+            pool_id: str | None
+            if real_pool == '未知卡池':
+                real_pool = None
+                pool_id = None
+            else:
+                pool_id = PoolInfo.get_pool_id_by_info(real_pool, time)
+            items.append((time, item['chars'], real_pool, pool_id))
+
+        # 字典表的写入不能放在事务中
+        await pool_names.aio_register({value: {} for _, _, real_pool, pool_id in items for value in (real_pool, pool_id) if value})
+        await operator_names.aio_register({char_item['name']: {'rarity': char_item['rarity'] + 1} for _, chars, _, _ in items for char_item in chars})
 
+        async with database.aio_atomic():
+            for time, chars, real_pool, pool_id in items:
                 pool_info = PoolInfo.get_pool_info(pool_id)
                 is_up_pool = 'up_char_info' in pool_info
+                operators: list[tuple[str, int, bool, bool | None]] = [
+                    (char_item['name'], char_item['rarity'] + 1, char_item['isNew'], char_item['name'] in pool_info['up_char_info'] if is_up_pool else None) for char_item in chars
+                ]
+
+                defaults = {'real_pool': real_pool, 'pool_id': pool_id}
+                if conf.storage.packed_operators:
+                    defaults['packed_operators'] = OperatorSearchRecord.pack_operators(operators)
+                osr: OperatorSearchRecord
+                osr, created = await OperatorSearchRecord.aio_get_or_create(account=self.account, time=time, defaults=defaults)
 
                 if created:
-                    index: int
-                    char_item: dict
-                    for index, char_item in enumerate(chars):
-                        name: str = char_item['name']
-                        rarity: int = char_item['rarity'] + 1
-                        is_new: bool = char_item['isNew']
-                        is_up: bool | None = name in pool_info['up_char_info'] if is_up_pool else None
-                        await OSROperator.aio_create(name=name, rarity=rarity, is_new=is_new, index=index, record=osr, is_up=is_up)
+                    new_records += 1
+                    if not conf.storage.packed_operators:
+                        index: int
+                        for index, (name, rarity, is_new, is_up) in enumerate(operators):
+                            await OSROperator.aio_create(name=name, rarity=rarity, is_new=is_new, index=index, record=osr, is_up=is_up)
                 elif pool_id and osr.real_pool != real_pool:
                     osr.real_pool = real_pool
                     osr.pool_id = pool_id
                     await osr.aio_save()
+                    updated_records.append(osr.id)
 
                     if is_up_pool:
-                        osr_operator: OSROperator
-                        for osr_operator in await OSROperator.select().where(OSROperator.record == osr).aio_execute():
-                            osr_operator.is_up = bool(osr_operator.name in pool_info['up_char_info'])
-                            await osr_operator.aio_save()
+                        await osr.aio_update_is_up(pool_info['up_char_info'])
 
-    async def fetch_diamond_record(self) -> None:
+        if new_records or updated_records:
+            await on_pulls_changed(updated_records)
+        return new_records
+
+    async def fetch_diamond_record(self) -> int:
         last_time: int = 0
+        new_records: int = 0
         if await DiamondRecord.select().where(DiamondRecord.account == self.account).aio_count():
             record: DiamondRecord = (await DiamondRecord.select().where(DiamondRecord.account == self.account).order_by(DiamondRecord.operate_time.desc()).limit(1).aio_execute())[0]
             last_time = record.operate_time
@@ -120,7 +141,7 @@ class ArknightsDataAnalysis:
                     before: int = change_item['before']
                     after: int = change_item['after']
 
-                    await DiamondRecord.aio_get_or_create(
+                    _, created = await DiamondRecord.aio_get_or_create(
                         account=self.account,
                         operate_time=time,
                         defaults={
@@ -130,8 +151,14 @@ class ArknightsDataAnalysis:
                             'after': after
                         }
                     )
+                    new_records += created
+
+        if new_records:
+            await on_diamonds_changed()
+        return new_records
 
-    async def fetch_pay_record(self) -> None:
+    async def fetch_pay_record(self) -> int:
+        new_records: int = 0
         pay_datas: list = await self.request.get_pay_record()
         logger.debug(pay_datas)
 
@@ -144,7 +171,7 @@ class ArknightsDataAnalysis:
                 pay_time: int = int(item['payTime'])
                 platform: Platform = Platform.get(item['platform'])
 
-                await PayRecord.aio_get_or_create(
+                _, created = await PayRecord.aio_get_or_create(
                     order_id=order_id,
                     defaults={
                         'name': name,
@@ -154,6 +181,8 @@ class ArknightsDataAnalysis:
                         'amount': amount
                     }
                 )
+                new_records += created
+        return new_records
 
     async def fetch_gift_record(self) -> None:
         gift_datas: list = await self.request.get_gift_record()
@@ -176,7 +205,7 @@ class ArknightsDataAnalysis:
                 )
 
     @classmethod
-    async def get_or_create_analysis(cls, token: str, channel: AccountChannel) -> tuple[Self | None, bool]:
+    async def get_or_create_analysis(cls, token: str, channel: AccountChannel, known_account: Account | None = None) -> tuple[Self | None, bool]:
         request: ArknightsDataRequest = create_request_by_token(token, channel)
         try:
             user_info: dict = await request.get_user_info()
@@ -189,16 +218,21 @@ class ArknightsDataAnalysis:
             }
 
             async with database.aio_atomic():
-                account, created = await Account.aio_get_or_create(uid=uid, defaults=updates)
+                if known_account is not None and known_account.uid == uid:
+                    account, created = known_account, False  # 调用方已经加载过 不再查询
+                else:
+                    account, created = await Account.aio_get_or_create(uid=uid, defaults=updates)
                 if not created and any(getattr(account, key) != value for key, value in updates.items()):
                     await Account.update(**updates).where(Account.uid == uid).aio_execute()  # 更新数据
+                    for key, value in updates.items():
+                        setattr(account, key, value)
                 return cls(account, request), created
         except ValueError:
             return None, True
 
     @classmethod
     async def get_analysis(cls, account: Account) -> Self | None:
-        analyses: ArknightsDataAnalysis = (await cls.get_or_create_analysis(account.token, account.channel))[0]
+        analyses: ArknightsDataAnalysis = (await cls.get_or_create_analysis(account.token, account.channel, account))[0]
         if not analyses:
             account.available = False
             await account.aio_save()
@@ -6,6 +6,8 @@ from urllib.parse import quote
 from src.api.databases import AccountChannel
 from src.api.utils import AsyncRequest
 
+GIFT_SUCCESS = 200  # 兑换礼包码成功时上游返回的 code
+
 
 class ArknightsDataRequest(ABC):
 
@@ -33,7 +35,10 @@ class ArknightsDataRequest(ABC):
         ...
 
     @abstractmethod
-    async def try_get_gift(self, gift_code: str) -> bool:
+    async def try_get_gift(self, gift_code: str) -> int:
+        """
+        :return: 上游返回的 code, 成功时是 GIFT_SUCCESS
+        """
         ...
 
 
@@ -116,7 +121,7 @@ class OfficialArknightsDataRequest(ArknightsDataRequest):
                 raise ValueError('gift record getter error')
 
     @override
-    async def try_get_gift(self, gift_code: str) -> bool:
+    async def try_get_gift(self, gift_code: str) -> int:
         async with AsyncRequest() as request:
             payload: dict[str, object] = {
                 'giftCode': f'{gift_code}',
@@ -125,7 +130,7 @@ class OfficialArknightsDataRequest(ArknightsDataRequest):
             }
             try:
                 response = await request.post_json_with_csrf(self.url_gift_get, payload)
-                return cast(int, response.get('code', 9999)) == 200
+                return cast(int, response.get('code', 9999))
             except ValueError:
                 raise ValueError('gift get error')
 
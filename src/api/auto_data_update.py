@@ -1,60 +1,179 @@
-from asyncio import sleep
+import zlib
+import math
+import time
 
-from src.api.arknights_data_request import ArknightsDataRequest, create_request_by_token
-from src.api.arknights_data_analysis import ArknightsDataAnalysis
-from src.api.databases import Account, GiftRecord, DBUser
+from asyncio import sleep, gather, Semaphore
+from collections import Counter, defaultdict
+
+from peewee import fn, JOIN
+
+from src.config import conf
+from src.api.arknights_data_request import GIFT_SUCCESS, ArknightsDataRequest, create_request_by_token
+from src.api.cache import TTLCache
+from src.api.databases import Account, GiftRecord, DBUser, JobType, aio_iter_pages, use_pool
 from src.api.datas import GiftCodeInfo, PoolInfo
+from src.api.jobs import enqueue_job
+from src.api.metrics import task_items, task_run_seconds, timed_task
+from src.api.utils import AsyncRateLimiter
 from src.logger import logger
 
+GIFT_CONCURRENCY = 10  # 同时领取礼包的账号数
+GIFT_REQUEST_RATE = 5  # 每秒最多发起的领取请求
+DEAD_GIFT_CODE_THRESHOLD = 5  # 本次运行中因为兑换码无效或过期(analysis.gift_dead_codes)失败这么多次且从未成功的礼包码视为失效
+
+gift_limiter = AsyncRateLimiter(GIFT_REQUEST_RATE)
+dead_gift_codes: TTLCache[str, bool] = TTLCache(ttl=24 * 3600, max_size=1024)
+
+
+def get_update_interval(account: Account) -> int:
+    """
+    根据账号的活跃度计算更新间隔, 平均每次更新能拿到 update_target_records 条新记录
+    活跃度未知时使用 update_interval
+    """
+    if account.activity_rate is None:
+        return conf.analysis.update_interval
+    if account.activity_rate <= 0:
+        return conf.analysis.update_max_interval
+    interval = int(conf.analysis.update_target_records / account.activity_rate * 86400)
+    return min(max(interval, conf.analysis.update_min_interval), conf.analysis.update_max_interval)
 
-async def update_all_accounts_data():
-    logger.info('Start update_all_accounts_data')
-    account_n = 0
-    account: Account
-    for account in await Account.select().where(Account.available == True).aio_execute():
-        if analysis := await ArknightsDataAnalysis.get_analysis(account):
-            if await analysis.fetch_data():
-                account_n += 1
-                logger.debug(f'Update {account.uid} success')
-            await sleep(1)
-    logger.info(f'Stop update_all_accounts_data, success update {account_n} accounts')
 
+def get_next_update_at(account: Account, now: int) -> int:
+    """
+    计算账号下一次更新的时间
+    在 now + interval 的基础上按 uid 的哈希提前至多 1/4 个周期, 打散同时刷新的账号
+    两次更新之间至少间隔 update_min_interval
+    """
+    interval = get_update_interval(account)
+    jitter = zlib.crc32(account.uid.encode()) % (interval // 4 + 1)
+    return now + max(interval - jitter, conf.analysis.update_min_interval)
+
+
+async def record_account_activity(account: Account, new_records: int) -> None:
+    """
+    刷新成功后更新账号的活跃度, 并按新的活跃度重新安排下一次更新
+    活跃度是每天新增记录数的指数移动平均, 距离上次更新越久, 本次的观测值权重越大
+    """
+    now = int(time.time())
+    if account.last_update_at and now > account.last_update_at:
+        elapsed = now - account.last_update_at
+        rate = new_records / elapsed * 86400
+        if account.activity_rate is None:
+            account.activity_rate = rate
+        else:
+            account.activity_rate += (1 - math.exp(-elapsed / conf.analysis.activity_window)) * (rate - account.activity_rate)
+    account.last_update_at = now
+    account.next_update_at = get_next_update_at(account, now)
+    await (Account
+           .update(activity_rate=account.activity_rate, last_update_at=account.last_update_at, next_update_at=account.next_update_at)
+           .where(Account.id == account.id)
+           .aio_execute())
+
+
+@use_pool('scheduled')
+async def schedule_account_updates():
+    """
+    持续运行, 每次取出少量到期的账号加入刷新任务
+    """
+    while True:
+        now = int(time.time())
+        try:
+            accounts = await (Account
+                              .select()
+                              .where((Account.available == True) & (Account.next_update_at <= now))
+                              .order_by(Account.next_update_at)
+                              .limit(conf.analysis.update_batch_size)
+                              .aio_execute())
+            scheduled = 0
+            account: Account
+            for account in accounts:
+                claimed = await (Account
+                                 .update(next_update_at=get_next_update_at(account, now))
+                                 .where((Account.id == account.id) & (Account.next_update_at == account.next_update_at))
+                                 .aio_execute())
+                if claimed:  # 其他进程没有抢先
+                    await enqueue_job(account, JobType.FETCH)
+                    scheduled += 1
+            if scheduled:
+                task_items.inc(scheduled, task='schedule_account_updates')
+                logger.debug(f'Scheduled {scheduled} accounts to update')
+        except Exception as e:
+            logger.warning(f'Schedule account updates error: {e}')
+        await sleep(conf.analysis.update_check_interval)
 
+
+@timed_task('auto_get_gift')
+@use_pool('scheduled')
 async def auto_get_gift():
     logger.info('Start auto_get_gift')
-    gift_code = GiftCodeInfo.get_gift_code()
+    if not conf.analysis.gift_dead_codes:
+        logger.warning('analysis.gift_dead_codes is empty, invalid or expired gift codes will be retried on every account; '
+                       'fill it with the invalid/expired codes from the "failed with upstream codes" log lines')
+    gift_code = [code for code in GiftCodeInfo.get_gift_code() if not dead_gift_codes.get(code)]
     if not gift_code:
         logger.info('No gift code, end')
         return
 
-    account_n = 0
-    gift_n = 0
-
-    account: Account
-    for account in await Account.select(Account, DBUser).join(DBUser).where(Account.owner.is_null(False) & Account.available == True).aio_execute():
-        if not account.owner.user_config.is_auto_gift:
-            continue
-
-        used_gift_code = [record.code for record in await GiftRecord.select().where(GiftRecord.account == account).aio_execute()]
-        need_gift_code = [code for code in gift_code if code not in used_gift_code]
+    # 一次查询得到每个账号已经用过的礼包码, 只返回还有礼包码没用过的账号
+    query = (Account
+             .select(Account, fn.GROUP_CONCAT(fn.DISTINCT(GiftRecord.code)).alias('used_codes'))
+             .join(DBUser)
+             .switch(Account)
+             .join(GiftRecord, JOIN.LEFT_OUTER, on=((GiftRecord.account == Account.id) & GiftRecord.code.in_(gift_code)))
+             .where((DBUser.is_auto_gift == True) & (Account.available == True))
+             .group_by(Account.id)
+             .having(fn.COUNT(fn.DISTINCT(GiftRecord.code)) < len(gift_code)))
 
-        if not need_gift_code:
-            continue
+    code_success = defaultdict[str, int](int)
+    code_failure = defaultdict[str, int](int)  # 只统计兑换码本身无效或过期的失败
+    code_results = defaultdict[str, Counter[int]](Counter)  # 每个礼包码失败时上游返回的 code
+    semaphore = Semaphore(GIFT_CONCURRENCY)
 
-        account_n += 1
+    async def get_account_gift(account: Account, need_gift_code: list[str]) -> int:
+        gift_n = 0
         request: ArknightsDataRequest = create_request_by_token(account.token, account.channel)
-        try:
+        async with semaphore:
             for code in need_gift_code:
-                if await request.try_get_gift(code):
+                if dead_gift_codes.get(code):
+                    continue
+                await gift_limiter.acquire()
+                try:
+                    result = await request.try_get_gift(code)
+                except ValueError:
+                    break  # 账号或网络问题 跳过这个账号
+                if result == GIFT_SUCCESS:
                     logger.debug(f'Add gift code {code} to {account.uid} success')
+                    code_success[code] += 1
                     gift_n += 1
-                await sleep(1)
-        except ValueError:
-            continue
+                    continue
+                code_results[code][result] += 1
+                if result in conf.analysis.gift_dead_codes:  # 已经兑换过, 账号不满足条件等失败与兑换码是否有效无关
+                    code_failure[code] += 1
+                    if not code_success[code] and code_failure[code] >= DEAD_GIFT_CODE_THRESHOLD:
+                        logger.info(f'Gift code {code} failed {code_failure[code]} times without success, skip it')
+                        dead_gift_codes.set(code, True)
+        return gift_n
+
+    account_n = 0
+    gift_n = 0
+    async for accounts in aio_iter_pages(query):
+        tasks = []
+        account: Account
+        for account in accounts:
+            used_gift_code = set(account.used_codes.split(',')) if account.used_codes else set()
+            tasks.append(get_account_gift(account, [code for code in gift_code if code not in used_gift_code]))
+
+        account_n += len(tasks)
+        gift_n += sum(await gather(*tasks))
+    task_items.inc(account_n, task='auto_get_gift')
+    for code, results in code_results.items():
+        logger.info(f'Gift code {code} failed with upstream codes {dict(results)}')
     logger.info(f'Stop auto_get_gift, check {account_n} accounts, and use {gift_n} gift codes')
 
 
 def update_pool_info():
     logger.info('Try update pool info')
-    if PoolInfo.update_data():
+    with task_run_seconds.time(task='update_pool_info'):
+        updated = PoolInfo.update_data()
+    if updated:
         logger.info('Success update pool info')
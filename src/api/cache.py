@@ -1,30 +1,127 @@
 import time
 import asyncio
 
+from collections import OrderedDict
 from typing import Callable, Any
 
-from aiocache import Cache
-from aiocache.serializers import JsonSerializer
 from functools import wraps
 
+from src.api.metrics import Gauge, cache_requests, cache_compute_seconds
+from src.logger import logger
+
+CACHE_MAX_SIZE = 256
+
+
+class LRUCache[K, V]:
+    """
+    进程内的有界缓存, 直接保存对象(不做序列化), 超出容量时淘汰最久未使用的条目
+    保存的对象会被多个请求共享, 不要修改取出的对象
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._data: OrderedDict[K, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> V | None:
+        if (value := self._data.get(key)) is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class TTLCache[K, V](LRUCache[K, tuple[V, float]]):
+    """
+    带过期时间的 LRUCache
+    """
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        super().__init__(max_size)
+        self.ttl: float = ttl
+
+    def get(self, key: K) -> V | None:
+        if (item := super().get(key)) is None:
+            return None
+        value, expiry_time = item
+        if time.monotonic() > expiry_time:
+            self.delete(key)
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        super().set(key, (value, time.monotonic() + self.ttl))
+
+
+cache: LRUCache[str, tuple[Any, float]] = LRUCache(max_size=CACHE_MAX_SIZE)  # key -> (结果, 过期时间)
+refreshing: dict[str, asyncio.Task] = {}
+
+Gauge('cache_entries', 'cached_with_refresh entries', collect=lambda: [({}, len(cache))])
+
 
 def cached_with_refresh(ttl: int, key_builder: Callable[[], str]):
+    """
+    缓存无参数的异步函数的结果
+    未命中时同一个 key 只计算一次, 过期后先返回旧值, 同时在后台刷新
+    """
+
     def decorator(func: Callable[[], Any]):
+        async def compute(key: str) -> Any:
+            with cache_compute_seconds.time(key=key):
+                result = await func()
+            cache.set(key, (result, time.monotonic() + ttl))
+            return result
+
+        def done(key: str, task: asyncio.Task) -> None:
+            refreshing.pop(key, None)
+            if not task.cancelled() and (e := task.exception()):
+                logger.warning(f'Compute cache {key} error: {e!r}')
+
+        def start_compute(key: str) -> asyncio.Task:
+            if (task := refreshing.get(key)) is None:
+                task = refreshing[key] = asyncio.create_task(compute(key))
+                task.add_done_callback(lambda t: done(key, t))
+            return task
+
         @wraps(func)
         async def wrapper():
             key = key_builder()
-            result, expiry_time = await cache.get(key, (None, None))
-            if result is not None:
-                if time.time() > expiry_time:
-                    _ = asyncio.create_task(cache.set(key, (await func(), time.time() + ttl)))
-            else:
-                result = await func()
-                await cache.set(key, (result, time.time() + ttl))
-            return result
+            if (item := cache.get(key)) is not None:
+                result, expiry_time = item
+                if time.monotonic() > expiry_time:
+                    cache_requests.inc(key=key, result='stale')
+                    start_compute(key)
+                else:
+                    cache_requests.inc(key=key, result='hit')
+                return result
+
+            cache_requests.inc(key=key, result='miss')
+            return await asyncio.shield(start_compute(key))  # 请求被取消时不影响其他等待者
 
         return wrapper
 
     return decorator
-
-
-cache = Cache(Cache.MEMORY, serializer=JsonSerializer())
@@ -1,8 +1,11 @@
 import random
 import base64
+import asyncio
 
 from io import BytesIO
+from collections import deque
 from datetime import timedelta
+from functools import cache
 
 from pydantic import BaseModel
 from fastapi import HTTPException, status
@@ -11,6 +14,8 @@ from jose import JWTError, ExpiredSignatureError
 
 from src.config import conf
 from src.api.utils import create_jwt, decode_jwt
+from src.api.metrics import Gauge
+from src.logger import logger
 
 
 class CaptchaInfo(BaseModel):
@@ -23,6 +28,11 @@ class CaptchaValid(BaseModel):
     code: str
 
 
+@cache
+def get_font(font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype('data/JetBrainsMono.ttf', size=font_size)
+
+
 def random_color():
     c1 = random.randint(0, 255)
     c2 = random.randint(0, 255)
@@ -55,7 +65,7 @@ def draw_str(count, image, font_size):
     :return:
     """
     draw = ImageDraw.Draw(image)
-    font = ImageFont.truetype('data/JetBrainsMono.ttf', size=font_size)
+    font = get_font(font_size)
     temp = []
     for i in range(count):
         random_char = random_str()
@@ -122,10 +132,10 @@ def valid_captcha_code(captcha: CaptchaValid):
         )
 
 
-def create_captcha_code() -> CaptchaInfo:
+def render_captcha() -> tuple[str, str]:
     """
     生成图片验证码,并对图片进行base64编码
-    :return:
+    :return: 图片数据, 验证码
     """
     image = generate_picture()
     valid_str, image = draw_str(4, image, 35)
@@ -140,4 +150,53 @@ def create_captcha_code() -> CaptchaInfo:
     data = str(encode_data, encoding='utf-8')
     img_data = f"data:image/jpeg;base64,{data}"
 
+    return img_data, valid_str
+
+
+class CaptchaPool:
+    """
+    预生成的验证码池, 由后台任务补充到 pool_size
+    """
+
+    def __init__(self, pool_size: int) -> None:
+        self.pool_size: int = pool_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self._pool: deque[tuple[str, str]] = deque()
+        self._refill: asyncio.Event = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pool)
+
+    async def get(self) -> tuple[str, str]:
+        self._refill.set()
+        try:
+            item = self._pool.popleft()
+            self.hits += 1
+        except IndexError:
+            self.misses += 1
+            item = await asyncio.to_thread(render_captcha)
+        return item
+
+    async def run(self) -> None:
+        self._refill.set()
+        while True:
+            await self._refill.wait()
+            self._refill.clear()
+            while len(self._pool) < self.pool_size:
+                try:
+                    self._pool.append(await asyncio.to_thread(render_captcha))
+                except Exception as e:
+                    logger.warning(f'Render captcha error: {e}')
+                    break
+            logger.trace(f'Captcha pool refilled, depth {self.depth}, hits {self.hits}, misses {self.misses}')
+
+
+captcha_pool = CaptchaPool(conf.captcha.pool_size)
+Gauge('captcha_pool_depth', 'Pre-rendered captchas available', collect=lambda: [({}, captcha_pool.depth)])
+
+
+async def create_captcha_code() -> CaptchaInfo:
+    img_data, valid_str = await captcha_pool.get()
     return CaptchaInfo(image=img_data, captcha_token=create_captcha_token(valid_str))
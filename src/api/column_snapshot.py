@@ -0,0 +1,461 @@
+# 列存快照的通用部分: 内存中的 numpy 数组, 以及多个 worker 进程通过 mmap 共享的磁盘格式
+# 磁盘格式, 每个版本一个目录 data/snapshot/<name>-<watermark>-<pid>/:
+#   header.json  {'format', 'name', 'rows', 'watermark', 'created_at', 'columns': {列名: dtype}, 'dictionary': [...]}
+#   <列名>.bin   定宽小端数组, 共 rows 个元素
+# data/snapshot/<name>.current 保存当前版本的目录名, 发布时用 os.replace 原子替换
+# worker 启动时 mmap 当前版本(与数据量无关), 再从数据库读取 id 大于 watermark 的记录
+# 并发的事务可能先分配较小的 id 但较晚提交, 所以增量读取时会重新读取最近 SNAPSHOT_SAFETY_SECONDS 秒内 watermark 以上的记录并去重
+# 读取快照的计算通过 use 持有 lock, 增量读取和替换数据也都在 lock 中进行; 全量加载在新的对象中进行, 完成后在 lock 中替换
+from __future__ import annotations
+
+import os
+import copy
+import json
+import time
+import shutil
+import asyncio
+
+from pathlib import Path
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Self
+
+from src.config import conf
+from src.api.metrics import Gauge
+from src.api.databases import read_replica, use_pool
+from src.data_store import get_res_path
+from src.logger import logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_PAGE_SIZE = 50000
+SNAPSHOT_KEEP_SECONDS = 3600  # 旧版本目录保留的时间, 之后才删除
+SNAPSHOT_SAFETY_SECONDS = 300  # 比这更久才提交的事务写入的记录要等到下一次全量加载
+SNAPSHOT_REFRESH_SECONDS = 60  # 定时同步快照(使用其他进程发布的版本, 到期时全量加载)的间隔
+SNAPSHOT_STATE = ('base', 'tail', 'base_size', 'tail_size', 'generation', 'dictionary', 'dictionary_index', 'watermarks', 'loaded_at')  # 全量加载后替换的属性
+MIN_CAPACITY = 1 << 16
+
+snapshots: list[ColumnSnapshot] = []
+
+if np is None and conf.statistics.snapshot:
+    logger.warning('numpy is not installed, statistics.snapshot is disabled, statistics and ranks will be computed from MySQL')
+
+Gauge('snapshot_rows', 'Rows in the in-memory column snapshots', collect=lambda: [({'name': snapshot.name}, len(snapshot)) for snapshot in snapshots])
+
+
+class ColumnSnapshot:
+    """
+    子类需要定义:
+      name: 快照名称, 也是文件名前缀
+      columns: 列名 -> dtype(小端), 第一列是递增的主键 id
+      dictionary_column: 用 dictionary 中的下标保存的字符串列, -1 表示 None
+      null_values: 可以为 None 的列 -> 用来表示 None 的值
+      fetch_rows: 按 id 升序读取 id 大于 last_id 的记录(或者重写 load_page, 直接按列读取)
+    数据分为两段: base 是从快照文件 mmap 的部分(写时复制, 修改不会写回文件), tail 是之后从数据库追加的部分
+    两段各自按 id 升序, 但 tail 中补读到的记录的 id 可能小于 base 的最后一条
+    """
+    name: str
+    columns: dict[str, str]
+    dictionary_column: str
+    null_values: dict[str, int] = {}
+
+    def __init__(self) -> None:
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.loaded_at: float = 0  # 数据最后一次从数据库全量加载的时间, 0 表示需要重新加载
+        self.generation: str | None = None  # 当前 mmap 的版本目录名
+        self.base: dict[str, np.ndarray] = {}
+        self.tail: dict[str, np.ndarray] = {}
+        self.base_size: int = 0
+        self.tail_size: int = 0
+        self.dictionary: list[str] = []
+        self.dictionary_index: dict[str, int] = {}
+        self.watermarks: deque[tuple[float, int]] = deque()  # 每次增量读取后的 (时间, watermark)
+        self.updates: dict[int, tuple[float, dict[str, object]]] = {}  # 对已有行的修改 id -> (修改时间, {列名: 原始值}), 映射其他进程的版本后重新应用
+        self.reloading: bool = False  # 正在全量加载, 避免同时进行多次
+        self.clear()
+        snapshots.append(self)
+
+    def __len__(self) -> int:
+        return self.base_size + self.tail_size
+
+    @property
+    def ranges(self) -> tuple[tuple[int, int], tuple[int, int]]:
+        """
+        base 和 tail 在 len(self) 个行中的下标范围
+        """
+        return (0, self.base_size), (self.base_size, len(self))
+
+    @property
+    def watermark(self) -> int:
+        base = int(self.base['id'][self.base_size - 1]) if self.base_size else 0
+        tail = int(self.tail['id'][self.tail_size - 1]) if self.tail_size else 0
+        return max(base, tail)
+
+    @property
+    def tail_nbytes(self) -> int:
+        return sum(array.nbytes for array in self.tail.values())
+
+    def clear(self) -> None:
+        self.base = {name: np.empty(0, dtype) for name, dtype in self.columns.items()}
+        self.tail = {name: np.empty(0, dtype) for name, dtype in self.columns.items()}
+        self.base_size = self.tail_size = 0
+        self.generation = None
+        self.dictionary = []
+        self.dictionary_index = {}
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        有 tail 时返回拼接后的副本, 计算时应该使用 mask / select 分段处理
+        """
+        if not self.tail_size:
+            return self.base[name]
+        return np.concatenate((self.base[name], self.tail[name][:self.tail_size]))
+
+    def parts(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        return self.base[name][:self.base_size], self.tail[name][:self.tail_size]
+
+    def select(self, name: str, mask: np.ndarray) -> np.ndarray:
+        """
+        :return: mask 选中的行的值, 只复制选中的部分
+        """
+        base, tail = self.parts(name)
+        if not self.tail_size:
+            return base[mask]
+        return np.concatenate((base[mask[:self.base_size]], tail[mask[self.base_size:]]))
+
+    def index_of(self, row_id: int) -> int | None:
+        """
+        :return: id 为 row_id 的行的下标, 不存在时返回 None
+        """
+        for offset, ids in zip((0, self.base_size), self.parts('id')):
+            index = int(np.searchsorted(ids, row_id))
+            if index < len(ids) and ids[index] == row_id:
+                return offset + index
+        return None
+
+    def set_value(self, index: int, name: str, value: int) -> None:
+        if index < self.base_size:
+            self.base[name][index] = value
+        else:
+            self.tail[name][index - self.base_size] = value
+
+    def encode(self, name: str, value: object) -> object:
+        if name == self.dictionary_column:
+            return self.get_code(value)
+        if value is None and name in self.null_values:
+            return self.null_values[name]
+        return value
+
+    def update_row(self, row_id: int, values: dict[str, object]) -> None:
+        """
+        修改已有的行, 修改会被记录下来, 在映射其他进程发布的版本后重新应用
+        :param values: 列名 -> 原始值(与 append 的相同)
+        """
+        self.updates[row_id] = (time.time(), values)
+        self.apply_update(row_id, values)
+
+    def apply_update(self, row_id: int, values: dict[str, object]) -> None:
+        if (index := self.index_of(row_id)) is not None:
+            for name, value in values.items():
+                self.set_value(index, name, self.encode(name, value))
+
+    def get_code(self, value: str | None) -> int:
+        if value is None:
+            return -1
+        if (code := self.dictionary_index.get(value)) is None:
+            code = self.dictionary_index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+
+    def append(self, rows: list[tuple]) -> None:
+        """
+        :param rows: 按 columns 的顺序, dictionary_column 是原始字符串, 按 id 升序
+        """
+        if not rows:
+            return
+        columns: dict[str, list] = {}
+        for name, values in zip(self.columns, zip(*rows)):
+            if name == self.dictionary_column:
+                values = [self.get_code(value) for value in values]
+            elif name in self.null_values:
+                values = [self.null_values[name] if value is None else value for value in values]
+            columns[name] = values
+        self.append_columns(columns, len(rows))
+
+    def append_columns(self, columns: dict[str, np.ndarray | list], rows: int) -> None:
+        """
+        :param columns: 已经转换好的各列(dictionary_column 是下标), 按 id 升序
+        """
+        if not rows:
+            return
+        size = self.tail_size + rows
+        if size > len(self.tail['id']):
+            capacity = max(MIN_CAPACITY, len(self.tail['id']))
+            while capacity < size:
+                capacity *= 2
+            for name, array in self.tail.items():
+                grown = np.empty(capacity, array.dtype)
+                grown[:self.tail_size] = array[:self.tail_size]
+                self.tail[name] = grown
+
+        for name in self.columns:
+            self.tail[name][self.tail_size:size] = columns[name]
+        self.tail_size = size
+
+    async def fetch_rows(self, last_id: int, limit: int) -> list[tuple]:
+        raise NotImplementedError
+
+    async def load_page(self, last_id: int, limit: int) -> int | None:
+        """
+        读取并追加一页
+        :return: 下一页的 last_id, 没有更多记录时返回 None
+        """
+        rows = await self.fetch_rows(last_id, limit)
+        self.append(rows)
+        return rows[-1][0] if len(rows) >= limit else None
+
+    async def load_after(self, last_id: int) -> None:
+        while (last_id := await self.load_page(last_id, SNAPSHOT_PAGE_SIZE)) is not None:
+            pass
+
+    async def load_recent(self) -> None:
+        """
+        增量读取: 从 SNAPSHOT_SAFETY_SECONDS 秒前的 watermark 开始重新读取, 去掉已经存在的记录
+        """
+        now = time.time()
+        while len(self.watermarks) > 1 and self.watermarks[1][0] <= now - SNAPSHOT_SAFETY_SECONDS:
+            self.watermarks.popleft()
+        low = min(self.watermarks[0][1], self.watermark) if self.watermarks else self.watermark
+        start = self.tail_size
+        await self.load_after(low)
+        self.dedupe_tail(start, low)
+        self.watermarks.append((now, self.watermark))
+
+    def dedupe_tail(self, start: int, low: int) -> None:
+        """
+        去掉 tail 中从 start 开始新读取的记录里已经存在的部分(它们的 id 都大于 low), 并保持 tail 按 id 升序
+        """
+        if start >= self.tail_size:
+            return
+        base_ids = self.base['id'][:self.base_size]
+        old_ids = self.tail['id'][:start]
+        existing = np.concatenate((base_ids[np.searchsorted(base_ids, low, side='right'):], old_ids[np.searchsorted(old_ids, low, side='right'):]))
+        keep = ~np.isin(self.tail['id'][start:self.tail_size], existing)
+        size = start + int(keep.sum())
+        if size < self.tail_size:
+            for array in self.tail.values():
+                array[start:size] = array[start:self.tail_size][keep]
+            self.tail_size = size
+
+        ids = self.tail['id'][:self.tail_size]
+        if start and size > start and ids[start] < ids[start - 1]:
+            order = np.argsort(ids, kind='stable')
+            for array in self.tail.values():
+                array[:self.tail_size] = array[:self.tail_size][order]
+
+    @property
+    def directory(self) -> Path:
+        return get_res_path(['data', 'snapshot'])
+
+    def read_current(self) -> tuple[str, dict] | None:
+        """
+        :return: 当前发布的版本目录名和 header, 不存在或格式不兼容时返回 None
+        """
+        try:
+            generation = (self.directory / f'{self.name}.current').read_text(encoding='utf-8').strip()
+            header = json.loads((self.directory / generation / 'header.json').read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if header.get('format') != SNAPSHOT_FORMAT or header.get('columns') != self.columns:
+            return None
+        return generation, header
+
+    def map_generation(self, generation: str, header: dict) -> None:
+        rows: int = header['rows']
+        base: dict[str, np.ndarray] = {}
+        for name, dtype in self.columns.items():
+            path = self.directory / generation / f'{name}.bin'
+            if path.stat().st_size != rows * np.dtype(dtype).itemsize:
+                raise ValueError(f'Snapshot {generation} column {name} size mismatch')
+            base[name] = np.memmap(path, dtype=dtype, mode='c', shape=(rows,)) if rows else np.empty(0, dtype)
+
+        self.clear()
+        self.base, self.base_size, self.generation = base, rows, generation
+        self.dictionary = list(header['dictionary'])
+        self.dictionary_index = {value: code for code, value in enumerate(self.dictionary)}
+        self.loaded_at = header['created_at']
+
+        # 版本开始全量加载之后的修改不一定包含在其中
+        self.updates = {row_id: update for row_id, update in self.updates.items() if update[0] > self.loaded_at}
+        for row_id, (_, values) in self.updates.items():
+            self.apply_update(row_id, values)
+
+    def write_generation(self) -> tuple[str, dict]:
+        """
+        把当前数据写成新的版本并发布, 在线程中执行
+        """
+        watermark = self.watermark
+        generation = f'{self.name}-{watermark}-{os.getpid()}'
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            'name': self.name,
+            'rows': len(self),
+            'watermark': watermark,
+            'created_at': self.loaded_at,
+            'columns': self.columns,
+            'dictionary': self.dictionary
+        }
+
+        tmp = self.directory / f'{generation}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        ids = self.column('id')
+        order = np.argsort(ids, kind='stable') if (ids[1:] < ids[:-1]).any() else None  # 补读的记录让 base 和 tail 之间乱序
+        for name, dtype in self.columns.items():
+            values = self.column(name)
+            (values if order is None else values[order]).astype(dtype, copy=False).tofile(tmp / f'{name}.bin')
+        (tmp / 'header.json').write_text(json.dumps(header, ensure_ascii=False), encoding='utf-8')
+        shutil.rmtree(self.directory / generation, ignore_errors=True)
+        tmp.rename(self.directory / generation)
+
+        pointer = self.directory / f'{self.name}.current.{os.getpid()}'
+        pointer.write_text(generation, encoding='utf-8')
+        os.replace(pointer, self.directory / f'{self.name}.current')
+
+        # 其他进程可能还在使用旧版本, 过一段时间才删除(已经 mmap 的进程不受影响)
+        for path in self.directory.glob(f'{self.name}-*'):
+            if path.name != generation and time.time() - path.stat().st_mtime > SNAPSHOT_KEEP_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        return generation, header
+
+    async def publish(self) -> None:
+        generation, header = await asyncio.to_thread(self.write_generation)
+        self.map_generation(generation, header)
+        logger.info(f'Snapshot {generation} published, {header["rows"]} rows')
+
+    async def update(self) -> None:
+        """
+        增量同步, 调用时需要持有 lock: 使用其他进程发布的更新的版本, 再读取新增的记录
+        还没有加载过(或者出错后需要重新加载)时不读取, 等待定时的全量加载
+        """
+        if (current := self.read_current()) is not None:
+            generation, header = current
+            if generation != self.generation and header['created_at'] >= self.loaded_at and header['watermark'] >= self.watermark:
+                self.map_generation(generation, header)
+        if not self.loaded_at:
+            return
+        async with read_replica(False):  # 写入后立即调用 catch_up, 需要读到刚写入的记录
+            await self.load_recent()
+
+    async def reload(self) -> None:
+        """
+        从数据库全量加载到新的对象中并发布, 加载期间读取和增量同步继续使用原来的数据, 完成后在 lock 中替换
+        """
+        start = time.perf_counter()
+        fresh = copy.copy(self)
+        fresh.clear()
+        fresh.watermarks = deque()
+        fresh.loaded_at = time.time()
+        async with read_replica():  # 全量加载是最大的扫描, 放到只读副本
+            await fresh.load_after(0)
+
+        async with self.lock:
+            for name in SNAPSHOT_STATE:
+                setattr(self, name, getattr(fresh, name))
+            # 加载期间对已有行的修改不一定包含在新的数据中
+            self.updates = {row_id: update for row_id, update in self.updates.items() if update[0] > self.loaded_at}
+            for row_id, (_, values) in self.updates.items():
+                self.apply_update(row_id, values)
+            async with read_replica(False):
+                await self.load_recent()
+            logger.info(f'Snapshot {self.name} loaded {len(self)} rows in {time.perf_counter() - start:.1f}s')
+            await self.publish()
+
+    async def sync(self) -> None:
+        """
+        定时调用: 增量同步, 距上次全量加载超过 snapshot_reload_interval 时从数据库重新加载并发布, tail 过大时发布新版本
+        """
+        async with self.lock:
+            await self.update()
+            reload = time.time() - self.loaded_at > conf.statistics.snapshot_reload_interval
+            if not reload and self.tail_size > max(SNAPSHOT_PAGE_SIZE, self.base_size // 10):
+                await self.publish()
+        if reload and not self.reloading:
+            self.reloading = True
+            try:
+                await self.reload()
+            finally:
+                self.reloading = False
+
+    async def catch_up(self) -> None:
+        """
+        写入记录后调用, 让快照立即包含新增的记录, 只做增量读取, 出错时只记录日志, 之后由定时同步全量加载
+        """
+        if not self.loaded_at:
+            return  # 还没有加载过, 之后会全量加载
+        try:
+            async with self.lock:
+                async with read_replica(False):  # 需要读到刚写入的记录
+                    await self.load_recent()
+        except Exception as e:
+            self.loaded_at = 0
+            logger.warning(f'Update snapshot {self.name} error: {e!r}')
+
+    @asynccontextmanager
+    async def use(self) -> AsyncIterator[Self | None]:
+        """
+        读取快照的计算在其中进行, 期间持有 lock, 数据不会被追加或替换, mask 的长度保持不变
+        先增量同步, 还没有加载完成(或同步出错)时得到 None, 调用者应该改为从数据库读取
+        """
+        async with self.lock:
+            try:
+                await self.update()
+            except Exception as e:
+                self.loaded_at = 0
+                logger.warning(f'Update snapshot {self.name} error: {e!r}')
+            yield self if self.loaded_at else None
+
+    def mask(self, accounts: list[int] | None = None, values: list[str] | None = None) -> np.ndarray:
+        """
+        :param accounts: 只选中这些账号的记录
+        :param values: 只选中 dictionary_column 是这些值的记录
+        """
+        mask = np.ones(len(self), bool)
+        if accounts is not None:
+            accounts = np.asarray(accounts, dtype=self.columns['account'])
+            for part, (start, end) in zip(self.parts('account'), self.ranges):
+                mask[start:end] &= np.isin(part, accounts)
+        if values is not None:
+            codes = np.asarray([self.dictionary_index[value] for value in values if value in self.dictionary_index], dtype=self.columns[self.dictionary_column])
+            for part, (start, end) in zip(self.parts(self.dictionary_column), self.ranges):
+                mask[start:end] &= np.isin(part, codes)
+        return mask
+
+    def group_count(self, key: str, mask: np.ndarray, *conditions: np.ndarray) -> tuple[np.ndarray, np.ndarray, list[np.ndarray]]:
+        """
+        按 key 列(非负整数)分组统计 mask 选中的行数, 以及其中满足每个 condition 的行数
+        :param conditions: 只对 mask 选中的行, 如 snapshot.select('rarity', mask) == 6
+        :return: (出现过的 key, 行数, [满足各个 condition 的行数])
+        """
+        keys = self.select(key, mask)
+        counts = np.bincount(keys)
+        present = np.flatnonzero(counts)
+        sums = [np.bincount(keys, weights=condition, minlength=len(counts))[present].astype(np.int64) for condition in conditions]
+        return present, counts[present], sums
+
+
+@use_pool('scheduled')
+async def load_snapshot(snapshot: ColumnSnapshot | None) -> None:
+    """
+    启动时和每 SNAPSHOT_REFRESH_SECONDS 秒调用一次
+    """
+    if snapshot is None:
+        return
+    try:
+        await snapshot.sync()
+    except Exception as e:
+        logger.warning(f'Load snapshot {snapshot.name} error: {e!r}')
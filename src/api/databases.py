@@ -1,33 +1,205 @@
 import json
+import time
+import asyncio
 
 from enum import Enum
-from typing import Any
+from typing import Any, Self, AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 
-from peewee import DoesNotExist
-from peewee import CharField, BooleanField, ForeignKeyField, IntegerField, TimestampField, AutoField
+import peewee
+
+from peewee import DoesNotExist, Value, fn, chunked
+from peewee import CharField, BooleanField, ForeignKeyField, IntegerField, SmallIntegerField, FloatField, BlobField, TimestampField, AutoField
 from playhouse.migrate import MySQLMigrator, migrate
 from playhouse.mysql_ext import JSONField
 from playhouse.shortcuts import ReconnectMixin
 
 from peewee_async import AioModel
+from peewee_async.aio_model import AioModelSelect
 from peewee_async import PooledMySQLDatabase as AsyncPooledMySQLDatabase
+from peewee_async import MysqlPoolBackend
+from peewee_async.connection import ConnectionContextManager
 
+from src.logger import logger
 from src.config import conf, ConfigData
+from src.config.config_model import MysqlPoolConfig
 from src.api.models import UserConfig
+from src.api.metrics import Gauge, db_pool_acquire_seconds, db_pool_acquire_timeouts, db_query_seconds
+from src.api.query_counter import record_query
+from src.api.packed_operators import pack_operators, unpack_operators, replace_is_up
+
+DICTIONARY_RELOAD_INTERVAL = 10  # 查询字典表中没有的值时, 最多每隔这么多秒重新读取一次字典表
+DICTIONARY_MISSING_ID = 0  # 不对应任何值, 查询条件中不认识的值换成它, 查询得到空结果
+DICTIONARY_MIGRATE_BATCH_SIZE = 50000
+OPERATOR_CONVERT_BATCH_SIZE = 10000  # 转换干员保存方式时每个事务处理的寻访记录数
+OPERATOR_CONVERT_LOCK = 'arknights_data_analysis.operator_storage'  # 转换干员保存方式时持有的 MySQL 命名锁
+DATABASE_MIGRATE_LOCK = 'arknights_data_analysis.migrate'  # 升级数据库结构时持有的 MySQL 命名锁
+POOL_NAMES = ('api', 'ingestion', 'scheduled')  # 主库的连接池: 接口请求, 后台任务(刷新和导入), 定时任务和统计
+READ_POOL = 'read'
+
+
+read_route: ContextVar[bool] = ContextVar('read_route', default=False)
+pool_route: ContextVar[str] = ContextVar('pool_route', default='api')
+
+
+class PoolTimeout(peewee.OperationalError):
+    """
+    等待连接池的连接超过 acquire_timeout
+    """
+
+
+class MetricsMysqlPoolBackend(MysqlPoolBackend):
+    """
+    记录获取连接的等待时间和正在等待的数量, 超过 acquire_timeout 秒时抛出 PoolTimeout
+    """
+    name: str = 'api'
+    acquire_timeout: float | None = None
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.waiting: int = 0
+
+    async def acquire(self) -> Any:
+        self.waiting += 1
+        try:
+            with db_pool_acquire_seconds.time(pool=self.name):
+                return await asyncio.wait_for(super().acquire(), self.acquire_timeout)
+        except TimeoutError:
+            db_pool_acquire_timeouts.inc(pool=self.name)
+            raise PoolTimeout(f'Acquire connection from pool {self.name} timed out') from None
+        finally:
+            self.waiting -= 1
 
 
 class ReconnectAsyncPooledMySQLDatabase(ReconnectMixin, AsyncPooledMySQLDatabase):
+    """
+    主库按负载分成多个连接池(POOL_NAMES), 由 use_pool 选择, 默认是 api, 互相之间不会抢占连接
+    read_replica 块中事务之外的 SELECT 使用只读副本的连接池(配置了 mysql.read_host 时)
+    """
     _instance = None
+    pool_backend_cls = MetricsMysqlPoolBackend
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.pool_backends: dict[str, MetricsMysqlPoolBackend] = {}
+        super().__init__(*args, **kwargs)
+
+    def add_pool(self, name: str, config: MysqlPoolConfig, **params: Any) -> None:
+        """
+        :param params: 与主库不同的连接参数, api 连接池就是原来的 pool_backend, 只能修改大小
+        """
+        if name == 'api':
+            backend = self.pool_backend
+            backend.connect_params['maxsize'] = config.max_connections
+        else:
+            backend = self.pool_backend_cls(database=self.database, **{**self.pool_params, **params, 'maxsize': config.max_connections})
+        backend.name = name
+        backend.acquire_timeout = config.acquire_timeout
+        self.pool_backends[name] = backend
+
+    def aio_connection(self, read: bool = False) -> ConnectionContextManager:
+        if read and read_route.get() and (backend := self.pool_backends.get(READ_POOL)) is not None:
+            return ConnectionContextManager(backend)
+        return ConnectionContextManager(self.pool_backends.get(pool_route.get(), self.pool_backend))
+
+    async def aio_execute(self, query: Any, fetch_results: Any = None) -> Any:
+        try:
+            return await super().aio_execute(query, fetch_results)
+        except UnknownDictionaryId as e:
+            # 读取到其他进程新增的字典值, 重新读取字典表后再执行一次
+            if not await e.dictionary.aio_reload_for(e.id_):
+                raise
+            return await super().aio_execute(query, fetch_results)
+
+    async def aio_execute_sql(self, sql: str, params: list | None = None, fetch_results: Any = None) -> Any:
+        start = time.perf_counter()
+        read = sql.startswith('SELECT') and not sql.endswith('FOR UPDATE')
+        try:
+            # 与 AioDatabase.aio_execute_sql 相同, 只是按语句选择连接池(事务中总是复用事务的连接)
+            with peewee.__exception_wrapper__:
+                async with self.aio_connection(read) as connection:
+                    async with connection.cursor() as cursor:
+                        await cursor.execute(sql, params or ())
+                        if fetch_results is not None:
+                            return await fetch_results(cursor)
+        finally:
+            elapsed = time.perf_counter() - start
+            db_query_seconds.observe(elapsed, statement=sql.split(' ', 1)[0].upper())
+            record_query(sql, elapsed)
+
+    async def aio_close(self) -> None:
+        await super().aio_close()
+        for backend in self.pool_backends.values():
+            if backend is not self.pool_backend:
+                await backend.terminate()
 
     @classmethod
     def get_db_instance(cls, *db_arg, **db_config):
         if not cls._instance:
-            cls._instance = cls(*db_arg, **db_config, max_connections=100)
+            cls._instance = cls(*db_arg, **db_config)
         return cls._instance
 
 
-database = ReconnectAsyncPooledMySQLDatabase.get_db_instance(**conf.mysql.model_dump())
+database = ReconnectAsyncPooledMySQLDatabase.get_db_instance(**conf.mysql.model_dump(include={'host', 'user', 'password', 'database', 'port'}))
 database.set_allow_sync(False)
+for pool_name in POOL_NAMES:
+    database.add_pool(pool_name, conf.mysql.pools[pool_name])
+if conf.mysql.read_host:
+    database.add_pool(READ_POOL, conf.mysql.pools[READ_POOL], host=conf.mysql.read_host, port=conf.mysql.read_port)
+
+
+@asynccontextmanager
+async def use_pool(name: str) -> AsyncIterator[None]:
+    """
+    块内(包括其中创建的任务)使用主库的 name 连接池, 也可以作为异步函数的装饰器 @use_pool(...)
+    """
+    token = pool_route.set(name)
+    try:
+        yield
+    finally:
+        pool_route.reset(token)
+
+
+@asynccontextmanager
+async def read_replica(enable: bool = True) -> AsyncIterator[None]:
+    """
+    块内(包括其中创建的任务)事务之外的 SELECT 从只读副本读取, 没有配置只读副本时没有影响
+    也可以作为异步函数的装饰器 @read_replica()
+    :param enable: False 时在块内强制使用主库
+    """
+    token = read_route.set(enable)
+    try:
+        yield
+    finally:
+        read_route.reset(token)
+
+
+def collect_pool_usage() -> list[tuple[dict[str, str], float]]:
+    samples: list[tuple[dict[str, str], float]] = []
+    for name, backend in database.pool_backends.items():
+        if (pool := backend.pool) is None:
+            continue
+        samples.extend([
+            ({'pool': name, 'state': 'used'}, pool.size - pool.freesize),
+            ({'pool': name, 'state': 'free'}, pool.freesize),
+            ({'pool': name, 'state': 'max'}, pool.maxsize),
+            ({'pool': name, 'state': 'waiting'}, backend.waiting)
+        ])
+    return samples
+
+
+Gauge('db_pool_connections', 'Database pool connections', ('pool', 'state'), collect=collect_pool_usage)
+
+
+identity_map: ContextVar[dict[tuple[type['BaseModel'], int], 'BaseModel'] | None] = ContextVar('identity_map', default=None)
+
+
+async def use_identity_map() -> None:
+    """
+    全局依赖, 为每个请求开启一个新的 identity map
+    请求内(包括请求创建的后台任务)已加载的对象会被复用, 定时任务中不启用
+    """
+    identity_map.set({})
 
 
 class BaseModel(AioModel):
@@ -36,6 +208,36 @@ class BaseModel(AioModel):
     class Meta:
         database = database
 
+    def remember(self) -> Self:
+        if (loaded := identity_map.get()) is not None:
+            loaded[(type(self), self.id)] = self
+        return self
+
+    @classmethod
+    async def aio_get_by_id(cls, pk: int) -> Self:
+        if (loaded := identity_map.get()) is not None:
+            if instance := loaded.get((cls, pk)):
+                return instance
+        return (await cls.aio_get(cls.id == pk)).remember()
+
+
+async def aio_iter_pages(query: AioModelSelect, page_size: int | None = None) -> AsyncIterator[list]:
+    """
+    按主键 keyset 分页读取查询结果, 每次只持有一页, 遍历过程中新增的行也会被读到
+    :param query: 查询, 不能带有 order_by 和 limit
+    :param page_size: 每页的行数
+    """
+    model = query.model
+    page_size = page_size or conf.analysis.page_size
+    last_id = 0
+    while True:
+        page = await query.where(model.id > last_id).order_by(model.id).limit(page_size).aio_execute()
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1].id
+
 
 class EnumField(CharField):
     def __init__(self, enum: type[Enum], *args: Any, **kwargs: Any) -> None:
@@ -78,6 +280,14 @@ class DBUser(BaseModel):
     hashed_password = CharField(max_length=60)
     user_config = UserConfigField()
     disabled = BooleanField(default=False)
+    # 以下与 user_config 中的开关同步, 用于在 SQL 中筛选
+    is_statistics = BooleanField(default=True, index=True)
+    is_lucky_rank = BooleanField(default=False, index=True)
+    is_auto_gift = BooleanField(default=False, index=True)
+
+    @staticmethod
+    def config_columns(config: UserConfig) -> dict[str, bool]:
+        return {'is_statistics': config.is_statistics, 'is_lucky_rank': config.is_lucky_rank, 'is_auto_gift': config.is_auto_gift}
 
 
 class AccountChannel(str, Enum):
@@ -106,6 +316,9 @@ class Account(BaseModel):
     token = CharField(max_length=500)
     channel = EnumField(AccountChannel)
     available = BooleanField()
+    next_update_at = OnlyTimestampField(default=0, index=True)
+    last_update_at = OnlyTimestampField(default=0)
+    activity_rate = FloatField(null=True)  # 平均每天新增的记录数, 未知时为空
 
     @classmethod
     async def aio_get_by_uid(cls, uid: str):
@@ -115,17 +328,225 @@ class Account(BaseModel):
             return None
 
 
+class UnknownDictionaryId(KeyError):
+    """
+    读取到字典表缓存中没有的 id, 可能是其他进程新增的值, 由 aio_execute 重新读取字典表后重试
+    """
+
+    def __init__(self, dictionary: 'DictionaryCache', id_: int) -> None:
+        super().__init__(f'Unknown {dictionary.field.model.__name__} id {id_}')
+        self.dictionary: DictionaryCache = dictionary
+        self.id_: int = id_
+
+
+class DictionaryCache:
+    """
+    字典表(维度表)的进程内缓存, 字典表很小, 每个进程缓存全部内容
+    其他进程新增的值在读取到不认识的 id 时异步重新读取, 同步读取只在启动时进行
+    """
+
+    def __init__(self, field: CharField) -> None:
+        self.field: CharField = field
+        self.ids: dict[str, int] = {}
+        self.values: dict[int, str] = {}
+        self.max_id: int = 0
+        self.loaded_at: float = 0
+        self.reload_lock: asyncio.Lock = asyncio.Lock()
+        self.reload_task: asyncio.Task | None = None
+
+    def add(self, rows: Any) -> None:
+        for id_, value in rows:
+            self.ids[value] = id_
+            self.values[id_] = value
+            self.max_id = max(self.max_id, id_)
+
+    def load(self) -> None:
+        """
+        同步读取整个字典表, 只在启动时调用
+        """
+        model = self.field.model
+        with database.allow_sync():
+            self.add(model.select(model.id, self.field).tuples().execute())
+        self.loaded_at = time.monotonic()
+
+    async def aio_load(self) -> None:
+        model = self.field.model
+        self.add(await model.select(model.id, self.field).tuples().aio_execute())
+        self.loaded_at = time.monotonic()
+
+    async def aio_reload_for(self, id_: int) -> bool:
+        """
+        读取到不认识的 id 时调用, 比已知的最大 id 大的是其他进程新增的值, 直接重新读取, 否则最多每 DICTIONARY_RELOAD_INTERVAL 秒读取一次
+        :return: 重新读取后是否认识这个 id
+        """
+        async with self.reload_lock:
+            if id_ not in self.values and (id_ > self.max_id or time.monotonic() - self.loaded_at > DICTIONARY_RELOAD_INTERVAL):
+                await self.aio_load()
+        return id_ in self.values
+
+    async def aio_ensure(self, ids: Iterable[int]) -> None:
+        """
+        解码直接保存 id 的数据(packed_operators)之前调用, 读取其中其他进程新增的值
+        """
+        if (missing := max((id_ for id_ in ids if id_ not in self.values), default=None)) is not None:
+            await self.aio_reload_for(missing)
+
+    async def reload_in_background(self) -> None:
+        try:
+            async with self.reload_lock:
+                await self.aio_load()
+        except Exception as e:
+            logger.warning(f'Reload {self.field.model.__name__} dictionary error: {e}')
+
+    def get_id(self, value: str) -> int:
+        """
+        写入时使用, 值需要已经 aio_register, 没有注册的值直接报错, 不会写入读不回来的 id
+        """
+        if (id_ := self.ids.get(value)) is None:
+            raise KeyError(f'{value!r} is not registered in {self.field.model.__name__}, call aio_register first')
+        return id_
+
+    def find_id(self, value: str) -> int:
+        """
+        查询条件使用, 值可能来自客户端, 不认识的值得到 DICTIONARY_MISSING_ID 而不是等待读取字典表
+        同时在后台重新读取字典表(最多每 DICTIONARY_RELOAD_INTERVAL 秒一次), 让之后的查询能看到其他进程新增的值
+        """
+        if (id_ := self.ids.get(value)) is not None:
+            return id_
+        if time.monotonic() - self.loaded_at > DICTIONARY_RELOAD_INTERVAL and (self.reload_task is None or self.reload_task.done()):
+            try:
+                self.reload_task = asyncio.get_running_loop().create_task(self.reload_in_background())
+            except RuntimeError:  # 没有运行中的事件循环(同步脚本)
+                pass
+        return DICTIONARY_MISSING_ID
+
+    def get_value(self, id_: int) -> str:
+        if (value := self.values.get(id_)) is None:
+            raise UnknownDictionaryId(self, id_)
+        return value
+
+    async def aio_register(self, values: dict[str, dict[str, Any]]) -> None:
+        """
+        写入使用这些值的记录之前调用, 保证它们都在字典表中, 不要在事务中调用
+        :param values: 值 -> 新建时其他字段的值
+        """
+        if not (missing := [value for value in values if value not in self.ids]):
+            return
+        model = self.field.model
+        await model.insert_many([{self.field.name: value, **values[value]} for value in missing]).on_conflict_ignore().aio_execute()
+        self.add(await model.select(model.id, self.field).where(self.field.in_(missing)).tuples().aio_execute())
+
+
+class DictionaryField(SmallIntegerField):
+    """
+    在数据库中保存字典表的 id, 在 Python 中(包括查询条件)使用原来的字符串
+    写入新的值之前需要先调用 aio_register, 查询条件(==, !=, in_, not_in)中不认识的值不会报错, 只是匹配不到记录
+    """
+
+    def __init__(self, dictionary: DictionaryCache, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.dictionary: DictionaryCache = dictionary
+
+    def filter_value(self, value: Any) -> Any:
+        if value is None or isinstance(value, peewee.Node):
+            return value
+        return Value(value, converter=lambda item: None if item is None else self.dictionary.find_id(item))
+
+    def __eq__(self, rhs: Any) -> Any:
+        return super().__eq__(self.filter_value(rhs))
+
+    def __ne__(self, rhs: Any) -> Any:
+        return super().__ne__(self.filter_value(rhs))
+
+    def in_(self, rhs: Any) -> Any:
+        return super().in_(self.filter_value(rhs))
+
+    def not_in(self, rhs: Any) -> Any:
+        return super().not_in(self.filter_value(rhs))
+
+    __hash__ = SmallIntegerField.__hash__
+    __lshift__ = in_
+
+    def db_value(self, value: Any) -> Any:
+        return None if value is None else self.dictionary.get_id(value)
+
+    def python_value(self, value: Any) -> Any:
+        return None if value is None else self.dictionary.get_value(value)
+
+
+class Operator(BaseModel):
+    name = CharField(max_length=20, unique=True)
+    rarity = SmallIntegerField()
+
+
+class GachaPool(BaseModel):
+    name = CharField(max_length=50, unique=True)  # 卡池 id 或卡池名称
+
+
+operator_names = DictionaryCache(Operator.name)
+pool_names = DictionaryCache(GachaPool.name)
+
+
 class OperatorSearchRecord(BaseModel):
     account = ForeignKeyField(Account, backref='card_records')
-    real_pool = CharField(null=True)
-    pool_id = CharField(null=True)
+    real_pool = DictionaryField(pool_names, null=True)
+    pool_id = DictionaryField(pool_names, null=True)
     time = OnlyTimestampField()
+    packed_operators = BlobField(null=True)  # storage.packed_operators 开启时保存干员, 见 packed_operators
+
+    @staticmethod
+    def pack_operators(operators: list[tuple[str, int, bool, bool | None]]) -> bytes:
+        """
+        :param operators: 按 index 顺序的 (名称, 星级, 是否新干员, 是否UP), 名称需要已经 aio_register
+        """
+        return pack_operators((operator_names.get_id(name), rarity, is_new, is_up) for name, rarity, is_new, is_up in operators)
+
+    async def aio_get_operators(self) -> list['OSROperator']:
+        """
+        按 index 排序的干员, 打包保存时直接解码(返回未保存的 OSROperator, 不查询数据库)
+        """
+        if conf.storage.packed_operators:
+            items = unpack_operators(self.packed_operators)
+            await operator_names.aio_ensure(item.operator for item in items)
+            return [
+                OSROperator(record=self, index=item.index, name=operator_names.get_value(item.operator), rarity=item.rarity, is_new=item.is_new, is_up=item.is_up)
+                for item in items
+            ]
+        return list(await OSROperator.select().where(OSROperator.record == self).order_by(OSROperator.index).aio_execute())
+
+    @staticmethod
+    async def aio_get_operators_of(records: list['OperatorSearchRecord']) -> dict[int, list['OSROperator']]:
+        """
+        一次读取多条记录的干员, 代替逐条调用 aio_get_operators
+        :return: 记录 id -> 按 index 排序的干员
+        """
+        if conf.storage.packed_operators:
+            return {record.id: await record.aio_get_operators() for record in records}
+        operators: dict[int, list[OSROperator]] = {record.id: [] for record in records}
+        for record_ids in chunked(list(operators), 1000):
+            osr_operator: OSROperator
+            for osr_operator in await OSROperator.select().where(OSROperator.record.in_(record_ids)).order_by(OSROperator.record, OSROperator.index).aio_execute():
+                operators[osr_operator.record_id].append(osr_operator)
+        return operators
+
+    async def aio_update_is_up(self, up_chars: list[str]) -> None:
+        """
+        卡池修改后, 按新卡池的 UP 干员重新设置每个干员是否 UP
+        """
+        if conf.storage.packed_operators:
+            self.packed_operators = replace_is_up(self.packed_operators, {operator_names.ids[name] for name in up_chars if name in operator_names.ids})
+            await self.aio_save(only=[OperatorSearchRecord.packed_operators])
+            return
+        osr_operator: OSROperator
+        for osr_operator in await OSROperator.select().where(OSROperator.record == self).aio_execute():
+            osr_operator.is_up = bool(osr_operator.name in up_chars)
+            await osr_operator.aio_save()
 
 
 class OSROperator(BaseModel):
     record = ForeignKeyField(OperatorSearchRecord, backref='operators')
     index = IntegerField()
-    name = CharField(max_length=10)
+    name = DictionaryField(operator_names)
     rarity = IntegerField()
     is_new = BooleanField()
     is_up = BooleanField(null=True)
@@ -176,17 +597,192 @@ class GiftRecord(BaseModel):
     code = CharField()
 
 
+class JobType(str, Enum):
+    FETCH = 'FETCH'
+    IMPORT_GACHA = 'IMPORT_GACHA'
+    IMPORT_PAY = 'IMPORT_PAY'
+
+
+class JobStatus(str, Enum):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    SUCCESS = 'SUCCESS'
+    FAILED = 'FAILED'
+
+
+class AccountJob(BaseModel):
+    account = ForeignKeyField(Account, backref='jobs')
+    type = EnumField(JobType, max_length=20)
+    status = EnumField(JobStatus, max_length=10)
+    force = BooleanField(default=False)
+    payload = CharField(null=True)
+    active_key = CharField(max_length=40, null=True, unique=True)  # 未完成时为 账号:类型, 用于合并重复任务
+    attempts = IntegerField(default=0)
+    error = CharField(null=True)
+    progress = CJSONField(null=True)
+    run_at = OnlyTimestampField()
+    created_at = OnlyTimestampField()
+    updated_at = OnlyTimestampField()
+
+    class Meta:
+        indexes = (
+            (('status', 'run_at'), False),
+        )
+
+
+async def aio_can_read_replica(account_id: int) -> bool:
+    """
+    账号的数据能否从只读副本读取: 有任务正在运行, 或者最近 read_fresh_seconds 秒内有任务(刷新或导入)结束时,
+    副本上可能还是旧数据, 这时从主库读取
+    """
+    if READ_POOL not in database.pool_backends:
+        return False
+    since = int(time.time()) - conf.mysql.read_fresh_seconds
+    return not await (AccountJob
+                      .select()
+                      .where((AccountJob.account == account_id) & ((AccountJob.status == JobStatus.RUNNING) | (AccountJob.updated_at >= since)))
+                      .aio_exists())
+
+
 def migrator_database(version: str, migrator: MySQLMigrator):
     if version == '0.1.0':
         version = '0.1.1'
         migrate(
             migrator.alter_column_type('Account', 'token', CharField(max_length=500)),
         )
+    if version == '0.1.1':
+        version = '0.1.2'
+        if database.table_exists('accountjob'):
+            migrate(
+                migrator.add_column('accountjob', 'progress', CJSONField(null=True)),
+            )
+    if version == '0.1.2':
+        version = '0.1.3'
+        migrate(
+            migrator.add_column('account', 'next_update_at', OnlyTimestampField(default=0)),
+            migrator.add_index('account', ('next_update_at',), False),
+        )
+    if version == '0.1.3':
+        version = '0.1.4'
+        migrate(
+            migrator.add_column('account', 'last_update_at', OnlyTimestampField(default=0)),
+            migrator.add_column('account', 'activity_rate', FloatField(null=True)),
+        )
+    if version == '0.1.4':
+        version = '0.1.5'
+        migrate(
+            migrator.add_column('dbuser', 'is_statistics', BooleanField(default=True)),
+            migrator.add_column('dbuser', 'is_lucky_rank', BooleanField(default=False)),
+            migrator.add_column('dbuser', 'is_auto_gift', BooleanField(default=False)),
+            migrator.add_index('dbuser', ('is_statistics',), False),
+            migrator.add_index('dbuser', ('is_lucky_rank',), False),
+            migrator.add_index('dbuser', ('is_auto_gift',), False),
+        )
+        # 从 user_config 回填, 相同设置的用户一起更新
+        user_ids: dict[tuple[tuple[str, bool], ...], list[int]] = {}
+        for user in DBUser.select(DBUser.id, DBUser.user_config).execute():
+            user_ids.setdefault(tuple(DBUser.config_columns(user.user_config).items()), []).append(user.id)
+        for columns, ids in user_ids.items():
+            DBUser.update(dict(columns)).where(DBUser.id.in_(ids)).execute()
+    if version == '0.1.5':
+        version = '0.1.6'
+        migrate_dictionary_columns(migrator)
+    if version == '0.1.6':
+        version = '0.1.7'
+        migrate(
+            migrator.add_column('operatorsearchrecord', 'packed_operators', BlobField(null=True)),
+        )
     return version
 
 
+def migrate_dictionary_columns(migrator: MySQLMigrator) -> None:
+    """
+    把干员名称和卡池的字符串列换成字典表的 id, 按主键分批更新, 避免长时间锁表
+    """
+    database.create_tables([Operator, GachaPool])
+    database.execute_sql('INSERT IGNORE INTO operator (name, rarity) SELECT name, MAX(rarity) FROM osroperator GROUP BY name')
+    database.execute_sql('INSERT IGNORE INTO gachapool (name) SELECT pool_id FROM operatorsearchrecord WHERE pool_id IS NOT NULL GROUP BY pool_id')
+    database.execute_sql('INSERT IGNORE INTO gachapool (name) SELECT real_pool FROM operatorsearchrecord WHERE real_pool IS NOT NULL GROUP BY real_pool')
+
+    migrate(
+        migrator.add_column('osroperator', 'name_code', SmallIntegerField(null=True)),
+        migrator.add_column('operatorsearchrecord', 'pool_id_code', SmallIntegerField(null=True)),
+        migrator.add_column('operatorsearchrecord', 'real_pool_code', SmallIntegerField(null=True)),
+    )
+    updates = {
+        'osroperator': 'UPDATE osroperator t JOIN operator o ON o.name = t.name SET t.name_code = o.id WHERE t.id > %s AND t.id <= %s',
+        'operatorsearchrecord': 'UPDATE operatorsearchrecord t '
+                                'LEFT JOIN gachapool p ON p.name = t.pool_id LEFT JOIN gachapool r ON r.name = t.real_pool '
+                                'SET t.pool_id_code = p.id, t.real_pool_code = r.id WHERE t.id > %s AND t.id <= %s'
+    }
+    for table, sql in updates.items():
+        max_id = database.execute_sql(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+        for start in range(0, max_id, DICTIONARY_MIGRATE_BATCH_SIZE):
+            with database.atomic():
+                database.execute_sql(sql, (start, start + DICTIONARY_MIGRATE_BATCH_SIZE))
+
+    migrate(
+        migrator.drop_column('osroperator', 'name'),
+        migrator.rename_column('osroperator', 'name_code', 'name'),
+        migrator.add_not_null('osroperator', 'name'),
+        migrator.drop_column('operatorsearchrecord', 'pool_id'),
+        migrator.rename_column('operatorsearchrecord', 'pool_id_code', 'pool_id'),
+        migrator.drop_column('operatorsearchrecord', 'real_pool'),
+        migrator.rename_column('operatorsearchrecord', 'real_pool_code', 'real_pool'),
+    )
+
+
+def convert_operator_storage(packed: bool) -> None:
+    """
+    在 OSROperator 表和 packed_operators 列之间转换已有的干员, 按寻访记录 id 分批, 每批一个事务
+    转换完的数据会从原来的位置删除, 中断后重新执行只处理剩下的部分
+    """
+    max_id = OperatorSearchRecord.select(fn.MAX(OperatorSearchRecord.id)).scalar() or 0
+    for start in range(0, max_id, OPERATOR_CONVERT_BATCH_SIZE):
+        in_batch = OperatorSearchRecord.id.between(start + 1, start + OPERATOR_CONVERT_BATCH_SIZE)
+        with database.atomic():
+            if packed:
+                operators: dict[int, list[tuple[int, int, bool, bool | None]]] = {}
+                # name 已经是 Operator.id, 直接读取原始值
+                for record_id, operator, rarity, is_new, is_up in database.execute_sql(
+                        'SELECT record_id, name, rarity, is_new, is_up FROM osroperator WHERE record_id BETWEEN %s AND %s ORDER BY record_id, `index`',
+                        (start + 1, start + OPERATOR_CONVERT_BATCH_SIZE)):
+                    operators.setdefault(record_id, []).append((operator, rarity, bool(is_new), None if is_up is None else bool(is_up)))
+                for record_id, items in operators.items():
+                    OperatorSearchRecord.update(packed_operators=pack_operators(items)).where(OperatorSearchRecord.id == record_id).execute()
+                OSROperator.delete().where(OSROperator.record.between(start + 1, start + OPERATOR_CONVERT_BATCH_SIZE)).execute()
+            else:
+                rows: list[dict] = []
+                for record_id, data in OperatorSearchRecord.select(OperatorSearchRecord.id, OperatorSearchRecord.packed_operators).where(in_batch & OperatorSearchRecord.packed_operators.is_null(False)).tuples().execute():
+                    rows.extend({
+                        'record': record_id, 'index': item.index, 'name': operator_names.get_value(item.operator), 'rarity': item.rarity, 'is_new': item.is_new, 'is_up': item.is_up
+                    } for item in unpack_operators(data))
+                for chunk in chunked(rows, 1000):
+                    OSROperator.insert_many(chunk).execute()
+                OperatorSearchRecord.update(packed_operators=None).where(in_batch).execute()
+
+
 with database.allow_sync():
-    database_version = ConfigData.get_and_update_database_version()
-    if database_version != ConfigData.database_version:
-        migrator_database(database_version, MySQLMigrator(database))
-    database.create_tables([DBUser, Account, OperatorSearchRecord, OSROperator, PayRecord, DiamondRecord, GiftRecord])
+    if ConfigData.data['database_version'] != ConfigData.database_version:
+        # 与转换干员保存方式相同, 多个 worker 同时启动时只让拿到锁的进程升级, 其他进程等待后重新读取版本
+        database.execute_sql('SELECT GET_LOCK(%s, -1)', (DATABASE_MIGRATE_LOCK,))
+        try:
+            ConfigData.load_data()
+            database_version = ConfigData.get_and_update_database_version()
+            if database_version != ConfigData.database_version:
+                migrator_database(database_version, MySQLMigrator(database))
+        finally:
+            database.execute_sql('SELECT RELEASE_LOCK(%s)', (DATABASE_MIGRATE_LOCK,))
+    database.create_tables([DBUser, Account, Operator, GachaPool, OperatorSearchRecord, OSROperator, PayRecord, DiamondRecord, GiftRecord, AccountJob])
+    operator_names.load()
+    pool_names.load()
+    if (ConfigData.get_operator_storage() == 'packed') != conf.storage.packed_operators:
+        # 每个 worker 启动时都会执行到这里, 只让拿到锁的进程转换, 其他进程等待后重新读取转换状态
+        database.execute_sql('SELECT GET_LOCK(%s, -1)', (OPERATOR_CONVERT_LOCK,))
+        try:
+            ConfigData.load_data()
+            if (ConfigData.get_operator_storage() == 'packed') != conf.storage.packed_operators:
+                convert_operator_storage(conf.storage.packed_operators)
+                ConfigData.set_operator_storage('packed' if conf.storage.packed_operators else 'rows')
+        finally:
+            database.execute_sql('SELECT RELEASE_LOCK(%s)', (OPERATOR_CONVERT_LOCK,))
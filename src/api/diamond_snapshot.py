@@ -0,0 +1,91 @@
+# 所有源石记录的列存快照, 供全站统计使用
+# 内存占用: 每行 id 8 + account 4 + time 8 + operation 2 + before 4 + after 4 = 30 字节, 每百万条约 29 MiB
+from __future__ import annotations
+
+from contextlib import AbstractAsyncContextManager, nullcontext
+
+from src.config import conf
+from src.api.column_snapshot import ColumnSnapshot, np, load_snapshot
+from src.api.databases import DiamondRecord
+
+
+class DiamondSnapshot(ColumnSnapshot):
+    name = 'diamonds'
+    columns = {
+        'id': '<i8',  # DiamondRecord.id
+        'account': '<i4',
+        'time': '<i8',
+        'operation': '<i2',  # dictionary 中的操作名称的下标
+        'before': '<i4',
+        'after': '<i4'
+    }
+    dictionary_column = 'operation'
+
+    async def fetch_rows(self, last_id: int, limit: int) -> list[tuple]:
+        return list(await (DiamondRecord
+                           .select(DiamondRecord.id, DiamondRecord.account, DiamondRecord.operate_time, DiamondRecord.operation, DiamondRecord.before, DiamondRecord.after)
+                           .where(DiamondRecord.id > last_id)
+                           .order_by(DiamondRecord.id)
+                           .limit(limit)
+                           .tuples()
+                           .aio_execute()))
+
+
+def summarize_diamond(snapshot: DiamondSnapshot, mask: np.ndarray) -> dict:
+    """
+    与 statistics_compute.summarize_diamond 的结果相同
+    """
+    account = snapshot.select('account', mask)
+    times = snapshot.select('time', mask)
+    operation = snapshot.select('operation', mask).astype(np.intp)
+    before = snapshot.select('before', mask).astype(np.int64)
+    after = snapshot.select('after', mask).astype(np.int64)
+
+    # 每个账号最新的一条记录
+    order = np.lexsort((times, account))
+    last = np.ones(len(order), bool)
+    last[:-1] = account[order][1:] != account[order][:-1]
+    now = int(after[order][last].sum())
+
+    change = after - before
+    is_get = change > 0
+    operation_number = len(snapshot.dictionary)
+
+    def to_list(is_selected: np.ndarray, numbers: np.ndarray) -> list[dict[str, object]]:
+        present = np.bincount(operation[is_selected], minlength=operation_number) > 0
+        totals = np.bincount(operation[is_selected], weights=numbers[is_selected], minlength=operation_number)
+        items = [{'type': snapshot.dictionary[code], 'number': int(totals[code])} for code in np.flatnonzero(present)]
+        return sorted(items, key=lambda x: x['number'], reverse=True)
+
+    return {
+        'now': now,
+        'total_use': int(-change[~is_get].sum()),
+        'total_get': int(change[is_get].sum()),
+        'type_use': to_list(~is_get, -change),
+        'type_get': to_list(is_get, change)
+    }
+
+
+diamond_snapshot: DiamondSnapshot | None = DiamondSnapshot() if np is not None and conf.statistics.snapshot else None
+
+
+def use_diamond_snapshot() -> AbstractAsyncContextManager[DiamondSnapshot | None]:
+    """
+    async with use_diamond_snapshot() as snapshot: 在其中完成对快照的计算
+    没有启用(或没有安装 numpy), 或者还没有加载完成时得到 None
+    """
+    if diamond_snapshot is None:
+        return nullcontext()
+    return diamond_snapshot.use()
+
+
+async def load_diamond_snapshot() -> None:
+    await load_snapshot(diamond_snapshot)
+
+
+async def on_diamonds_changed() -> None:
+    """
+    写入源石记录后调用, 让快照立即包含新增的记录
+    """
+    if diamond_snapshot is not None:
+        await diamond_snapshot.catch_up()
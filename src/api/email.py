@@ -9,7 +9,7 @@ from pydantic import BaseModel
 
 from src.config import conf
 from src.api.databases import DBUser
-from src.api.users import get_user_by_email, UserInDB, get_password_hash
+from src.api.users import get_user_by_email, UserInDB, get_password_hash, invalidate_user_cache
 from src.api.utils import decode_jwt, create_jwt, JustMsgModel
 from src.api.datas import EmailInfo
 from src.data_store import get_res_path
@@ -78,6 +78,7 @@ async def email_verify(verify_token: str) -> EmailVerifyInfo:
                 await db_user.aio_save()
             case _:
                 raise credentials_exception
+        invalidate_user_cache(user.username)
     except JWTError:
         raise credentials_exception
 
@@ -99,6 +100,7 @@ async def create_email_verify(email: str, type: str, ex_data: dict = None) -> st
         case "verify_email":
             db_user.disabled = True
             await db_user.aio_save()
+            invalidate_user_cache(db_user.username)
         case "change_password":
             new_hashed_password: str = get_password_hash(ex_data.get('new_password'))
             data.update({
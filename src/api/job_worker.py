@@ -0,0 +1,166 @@
+import time
+import asyncio
+
+from pathlib import Path
+from contextlib import suppress
+
+from src.config import conf
+from src.api.arkgacha_data_import import import_file
+from src.api.arknights_data_analysis import ArknightsDataAnalysis
+from src.api.auto_data_update import record_account_activity
+from src.api.databases import Account, AccountJob, JobType, JobStatus, database, use_pool
+from src.api.jobs import job_event
+from src.api.metrics import job_run_seconds
+from src.api.query_counter import track_queries
+from src.logger import logger
+
+JOB_KEEP_SECONDS = 7 * 24 * 3600
+MAINTENANCE_INTERVAL = 600
+JOB_STALE_GRACE = 60  # 任务超时后 worker 自己会取消并调用 finish_job, 再等这么久还是 RUNNING 才认为 worker 已经丢失
+JOB_CLAIM_LOCK = 'arknights_data_analysis.claim_job'  # 领取任务时持有的 MySQL 命名锁, 让各进程依次检查 max_running
+JOB_CLAIM_LOCK_TIMEOUT = 10
+
+
+class JobAbort(Exception):
+    """
+    任务无法完成且重试没有意义
+    """
+
+
+async def fetch_one(cursor) -> int | None:
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def claim_job() -> AccountJob | None:
+    """
+    领取一个到期的任务, 所有进程正在执行的任务达到 jobs.max_running 时不领取
+    计数和领取在命名锁中进行(UPDATE 中的计数子查询是一致性读, 并发的领取看不到彼此, 会超过上限)
+    """
+    # GET_LOCK 属于连接, 固定使用同一个连接, 领取的 UPDATE 在释放锁之前已经自动提交
+    async with database.aio_connection():
+        if not await database.aio_execute_sql('SELECT GET_LOCK(%s, %s)', [JOB_CLAIM_LOCK, JOB_CLAIM_LOCK_TIMEOUT], fetch_one):
+            return None
+        try:
+            if await AccountJob.select().where(AccountJob.status == JobStatus.RUNNING).aio_count() >= conf.jobs.max_running:
+                return None
+            now = int(time.time())
+            jobs = await (AccountJob
+                          .select()
+                          .where((AccountJob.status == JobStatus.PENDING) & (AccountJob.run_at <= now))
+                          .order_by(AccountJob.run_at)
+                          .limit(conf.jobs.workers)
+                          .aio_execute())
+
+            job: AccountJob
+            for job in jobs:
+                claimed = await (AccountJob
+                                 .update(status=JobStatus.RUNNING, attempts=AccountJob.attempts + 1, updated_at=now)
+                                 .where((AccountJob.id == job.id) & (AccountJob.status == JobStatus.PENDING))
+                                 .aio_execute())
+                if claimed:  # 任务可能已经被取消或合并
+                    job.status = JobStatus.RUNNING
+                    job.attempts += 1
+                    return job
+            return None
+        finally:
+            await database.aio_execute_sql('SELECT RELEASE_LOCK(%s)', [JOB_CLAIM_LOCK])
+
+
+async def execute_job(job: AccountJob) -> None:
+    account: Account = await Account.aio_get_by_id(job.account_id)
+    match job.type:
+        case JobType.FETCH:
+            if not (analysis := await ArknightsDataAnalysis.get_analysis(account)):
+                raise JobAbort('token invalid')
+            if not await analysis.fetch_data(job.force):
+                raise ValueError('fetch data failed')
+            await record_account_activity(account, analysis.new_records)
+        case JobType.IMPORT_GACHA | JobType.IMPORT_PAY:
+            await import_file(job, account)
+
+
+async def finish_job(job: AccountJob, error: Exception | None) -> None:
+    now = int(time.time())
+    updates: dict = {'updated_at': now, 'error': str(error)[:255] if error else None}
+    if error is None:
+        updates.update(status=JobStatus.SUCCESS, active_key=None)
+    elif not isinstance(error, JobAbort) and job.attempts < conf.jobs.max_attempts:
+        updates.update(status=JobStatus.PENDING, run_at=now + conf.jobs.retry_delay * 2 ** (job.attempts - 1))
+    else:
+        updates.update(status=JobStatus.FAILED, active_key=None)
+
+    await AccountJob.update(**updates).where(AccountJob.id == job.id).aio_execute()
+
+    if updates['status'] != JobStatus.PENDING and job.payload:
+        Path(job.payload).unlink(missing_ok=True)
+
+
+@use_pool('ingestion')
+async def job_worker() -> None:
+    while True:
+        try:
+            job = await claim_job()
+        except Exception as e:
+            logger.warning(f'Claim job error: {e}')
+            job = None
+
+        if job is None:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(job_event.wait(), conf.jobs.poll_interval)
+            job_event.clear()
+            continue
+
+        error: Exception | None = None
+        start = time.perf_counter()
+        with track_queries() as stats:
+            try:
+                await asyncio.wait_for(execute_job(job), conf.jobs.timeout)
+                logger.debug(f'Job {job.id} {job.type.value} success')
+            except Exception as e:
+                error = e
+                logger.warning(f'Job {job.id} {job.type.value} attempt {job.attempts} failed: {e!r}')
+        job_run_seconds.observe(time.perf_counter() - start, type=job.type.value, result='failure' if error else 'success')
+        if conf.query_counter.enable and stats.exceeded():
+            logger.warning(f'Job {job.id} {job.type.value} took {(time.perf_counter() - start) * 1000:.1f}ms, {stats.summary()}')
+        try:
+            await finish_job(job, error)
+        except Exception as e:  # 任务保持 RUNNING, 超时后由 job_maintenance 重新排队
+            logger.warning(f'Finish job {job.id} {job.type.value} error: {e!r}')
+
+
+@use_pool('ingestion')
+async def job_maintenance() -> None:
+    """
+    重新排队超时(进程退出时丢失)的任务, 已经用完 max_attempts 次的标记为失败, 清理过期的任务记录
+    执行中的任务通过更新 updated_at 表示仍在运行(导入任务每批更新一次进度)
+    """
+    while True:
+        now = int(time.time())
+        stale = (AccountJob.status == JobStatus.RUNNING) & (AccountJob.updated_at < now - conf.jobs.timeout - JOB_STALE_GRACE)
+        try:
+            await (AccountJob
+                   .update(status=JobStatus.PENDING, run_at=now, updated_at=now)
+                   .where(stale & (AccountJob.attempts < conf.jobs.max_attempts))
+                   .aio_execute())
+            job: AccountJob
+            for job in await AccountJob.select().where(stale & (AccountJob.attempts >= conf.jobs.max_attempts)).aio_execute():
+                failed = await (AccountJob
+                                .update(status=JobStatus.FAILED, active_key=None, error='worker lost', updated_at=now)
+                                .where((AccountJob.id == job.id) & stale)
+                                .aio_execute())
+                if failed and job.payload:
+                    Path(job.payload).unlink(missing_ok=True)
+            await (AccountJob
+                   .delete()
+                   .where(AccountJob.status.in_([JobStatus.SUCCESS, JobStatus.FAILED]) & (AccountJob.updated_at < now - JOB_KEEP_SECONDS))
+                   .aio_execute())
+        except Exception as e:
+            logger.warning(f'Job maintenance error: {e}')
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+def start_job_workers() -> list[asyncio.Task]:
+    tasks = [asyncio.create_task(job_worker()) for _ in range(conf.jobs.workers)]
+    tasks.append(asyncio.create_task(job_maintenance()))
+    return tasks
@@ -0,0 +1,68 @@
+import time
+import asyncio
+
+from datetime import datetime
+
+from peewee import IntegrityError, DoesNotExist
+from pydantic import BaseModel, ConfigDict
+
+from src.api.databases import Account, AccountJob, JobType, JobStatus
+
+job_event = asyncio.Event()  # 同进程内有新任务时唤醒 worker
+
+
+class JobInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    type: JobType
+    status: JobStatus
+    attempts: int
+    error: str | None
+    progress: dict[str, int] | None
+    created_at: datetime
+    updated_at: datetime
+
+
+def get_active_key(account: Account, job_type: JobType) -> str | None:
+    if job_type == JobType.FETCH:
+        return f'{account.id}:{job_type.value}'
+    return None  # 导入任务每次的数据都不同 不合并
+
+
+async def enqueue_job(account: Account, job_type: JobType, force: bool = False, payload: str | None = None) -> AccountJob:
+    """
+    添加后台任务, 同一账号未完成的刷新任务会被合并
+    :param account: 账号
+    :param job_type: 任务类型
+    :param force: 是否强制全量刷新
+    :param payload: 任务附带的数据(导入文件路径)
+    :return: 新建或被合并的任务
+    """
+    active_key = get_active_key(account, job_type)
+    for _ in range(3):
+        now = int(time.time())
+        try:
+            job = await AccountJob.aio_create(
+                account=account, type=job_type, status=JobStatus.PENDING, force=force, payload=payload,
+                active_key=active_key, run_at=now, created_at=now, updated_at=now
+            )
+            break
+        except IntegrityError:
+            try:
+                job = await AccountJob.aio_get(AccountJob.active_key == active_key)
+            except DoesNotExist:
+                continue  # 任务刚好结束 重新创建
+            if force and not job.force and job.status == JobStatus.PENDING:
+                await AccountJob.update(force=True, updated_at=now).where((AccountJob.id == job.id) & (AccountJob.status == JobStatus.PENDING)).aio_execute()
+            break
+    else:
+        raise ValueError(f'Enqueue {job_type.value} job for {account.uid} failed')
+
+    job_event.set()
+    return job
+
+
+async def get_jobs(account: Account, limit: int = 10) -> list[JobInfo]:
+    jobs = await AccountJob.select().where(AccountJob.account == account).order_by(AccountJob.id.desc()).limit(limit).aio_execute()
+    return [JobInfo.model_validate(job) for job in jobs]
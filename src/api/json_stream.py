@@ -0,0 +1,103 @@
+import json
+import codecs
+
+from typing import Any, BinaryIO, Iterator
+
+CHUNK_SIZE = 1 << 16
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+class JsonStreamReader:
+    """
+    增量读取 JSON 文件, 对象可以逐个键读取, 内存中只保留当前的值
+
+    用法::
+
+        for key in reader.iter_object():
+            if key == 'data':
+                for sub_key in reader.iter_object():
+                    value = reader.read_value()
+            else:
+                value = reader.read_value()
+
+    每次 iter_object 产出键后, 必须在取下一个键之前读取完它的值
+    """
+
+    def __init__(self, file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+        self._file: BinaryIO = file
+        self._chunk_size: int = chunk_size
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer: str = ''
+        self._pos: int = 0
+        self._eof: bool = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + self._utf8.decode(chunk, final=self._eof)
+        self._pos = 0
+        return True
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise json.JSONDecodeError('Unexpected end of data', self._buffer, self._pos)
+        return self._buffer[self._pos]
+
+    def _expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise json.JSONDecodeError(f'Expecting {char!r}', self._buffer, self._pos)
+        self._pos += 1
+
+    def read_value(self) -> Any:
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # 数字可能在块的边界被截断(如 98064|.047), 需要看到数字之后的字符才能确定已经读完
+                if self._eof or not isinstance(value, int | float) or isinstance(value, bool) or (end < len(self._buffer) and self._buffer[end] not in NUMBER_CHARS):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def iter_object(self) -> Iterator[str]:
+        self._expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError('Expecting property name', self._buffer, self._pos)
+            self._expect(':')
+            yield key
+            match self.peek():
+                case ',':
+                    self._pos += 1
+                case '}':
+                    self._pos += 1
+                    return
+                case _:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", self._buffer, self._pos)
+
+    def iter_items(self) -> Iterator[tuple[str, Any]]:
+        for key in self.iter_object():
+            yield key, self.read_value()
+
+    def at_end(self) -> bool:
+        self._skip_whitespace()
+        return self._pos >= len(self._buffer)
@@ -0,0 +1,216 @@
+import time
+import math
+import secrets
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Awaitable, Callable, Iterable, Iterator
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 进程内的 Prometheus 文本格式指标, 多 worker 部署时每个进程各自统计
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+type LabelValues = tuple[str, ...]
+type Sample = tuple[str, dict[str, str], float]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+class Metric(ABC):
+    type: str
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = tuple(labelnames)
+        registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    @abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{format_labels(labels)} {format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        for key, value in self._values.items():
+            yield f'{self.name}_total', self._labels(key), value
+
+
+class Gauge(Metric):
+    """
+    可以直接 set, 也可以传入 collect 在导出时读取当前值
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), collect: Callable[[], Iterable[tuple[dict[str, str], float]]] | None = None) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> Iterator[Sample]:
+        values = dict(self._values)
+        if self._collect is not None:
+            values.update((self._key(labels), value) for labels, value in self._collect())
+        for key, value in values.items():
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}  # 每个桶的计数(不累计), [总和]
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if (item := self._values.get(key)) is None:
+            item = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[Sample]:
+        for key, (counts, total) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': format_value(bound)}, cumulative
+            yield f'{self.name}_sum', labels, total[0]
+            yield f'{self.name}_count', labels, cumulative
+
+
+registry: list[Metric] = []
+
+
+def render_metrics() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+def metrics_allowed(client_host: str | None, authorization: str | None, token: str, allow_ips: list[str]) -> bool:
+    """
+    /metrics 只允许 allow_ips 中的地址, 或者带有 Authorization: Bearer <token> 的请求访问(token 为空时不接受 token)
+    """
+    if client_host is not None and client_host in allow_ips:
+        return True
+    if not token or not authorization:
+        return False
+    scheme, _, credentials = authorization.partition(' ')
+    return scheme.lower() == 'bearer' and secrets.compare_digest(credentials.strip().encode(), token.encode())
+
+
+http_request_seconds = Histogram('http_request_duration_seconds', 'HTTP request latency', ('router', 'route', 'method', 'status'))
+db_pool_acquire_seconds = Histogram('db_pool_acquire_seconds', 'Time spent waiting for a database connection', ('pool',))
+db_pool_acquire_timeouts = Counter('db_pool_acquire_timeouts', 'Database connection acquires that timed out', ('pool',))
+db_query_seconds = Histogram('db_query_duration_seconds', 'SQL statement latency', ('statement',))
+upstream_request_seconds = Histogram('upstream_request_duration_seconds', 'Upstream HTTP request latency', ('host', 'status'))
+upstream_retries = Counter('upstream_retries', 'Upstream HTTP request retries', ('host',))
+cache_requests = Counter('cache_requests', 'cached_with_refresh lookups', ('key', 'result'))
+cache_compute_seconds = Histogram('cache_compute_duration_seconds', 'cached_with_refresh compute time', ('key',))
+job_run_seconds = Histogram('job_run_duration_seconds', 'Background job run time', ('type', 'result'), buckets=(*DEFAULT_BUCKETS, 300.0, 1800.0))
+task_run_seconds = Histogram('scheduled_task_duration_seconds', 'Scheduled task run time', ('task',), buckets=(*DEFAULT_BUCKETS, 300.0, 1800.0, 3600.0))
+task_items = Counter('scheduled_task_items', 'Items processed by scheduled tasks', ('task',))
+
+
+def timed_task[**P, R](task: str) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    """
+    记录定时任务每次运行的耗时
+    """
+
+    def decorator(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with task_run_seconds.time(task=task):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    按路由记录请求耗时, router 标签取路由的第一个 tag
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            http_request_seconds.observe(
+                time.perf_counter() - start,
+                router=route.tags[0] if getattr(route, 'tags', None) else 'other',
+                route=getattr(route, 'path', 'unmatched'),
+                method=scope['method'],
+                status=str(status_code)
+            )
@@ -0,0 +1,92 @@
+# 打包保存寻访记录中的干员(storage.packed_operators), 代替每个干员一行的 OSROperator 表
+# 每个干员 4 字节, 按 index 顺序排列在 OperatorSearchRecord.packed_operators 中:
+#   operator  <u2  Operator.id
+#   rarity    u1
+#   flags     u1   bit0 是否新干员, bit1 是否有 UP 信息, bit2 是否 UP
+from __future__ import annotations
+
+import struct
+
+from typing import Iterable, NamedTuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PACKED_STRUCT = struct.Struct('<HBB')
+PACKED_SIZE = PACKED_STRUCT.size
+MAX_OPERATORS = 16  # 单条记录最多的干员数, 快照中用 记录 id * MAX_OPERATORS + index 作为干员的 id
+FLAG_NEW = 1
+FLAG_HAS_UP = 2
+FLAG_UP = 4
+
+PACKED_DTYPE = np.dtype([('operator', '<u2'), ('rarity', 'u1'), ('flags', 'u1')]) if np is not None else None
+
+
+class PackedOperator(NamedTuple):
+    index: int
+    operator: int  # Operator.id
+    rarity: int
+    is_new: bool
+    is_up: bool | None
+
+
+class PackedColumns(NamedTuple):
+    record: np.ndarray  # 干员所在的记录在 blobs 中的下标
+    index: np.ndarray
+    operator: np.ndarray
+    rarity: np.ndarray
+    is_new: np.ndarray
+    is_up: np.ndarray  # -1 表示没有 UP 信息
+
+
+def encode_flags(is_new: bool, is_up: bool | None) -> int:
+    flags = FLAG_NEW if is_new else 0
+    if is_up is not None:
+        flags |= FLAG_HAS_UP | (FLAG_UP if is_up else 0)
+    return flags
+
+
+def pack_operators(operators: Iterable[tuple[int, int, bool, bool | None]]) -> bytes:
+    """
+    :param operators: 按 index 顺序的 (Operator.id, 星级, 是否新干员, 是否UP)
+    """
+    items = [PACKED_STRUCT.pack(operator, rarity, encode_flags(is_new, is_up)) for operator, rarity, is_new, is_up in operators]
+    if len(items) > MAX_OPERATORS:
+        raise ValueError(f'Too many operators in one record: {len(items)}')
+    return b''.join(items)
+
+
+def unpack_operators(data: bytes | None) -> list[PackedOperator]:
+    if not data:
+        return []
+    if len(data) % PACKED_SIZE:
+        raise ValueError(f'Invalid packed operators length: {len(data)}')
+    return [
+        PackedOperator(index, operator, rarity, bool(flags & FLAG_NEW), bool(flags & FLAG_UP) if flags & FLAG_HAS_UP else None)
+        for index, (operator, rarity, flags) in enumerate(PACKED_STRUCT.iter_unpack(data))
+    ]
+
+
+def replace_is_up(data: bytes | None, up_operators: set[int]) -> bytes:
+    """
+    按卡池的 UP 干员重新设置每个干员是否 UP
+    """
+    return pack_operators((item.operator, item.rarity, item.is_new, item.operator in up_operators) for item in unpack_operators(data))
+
+
+def unpack_columns(blobs: list[bytes | None]) -> PackedColumns:
+    """
+    把多条记录的干员一次解码成列, 不逐个干员创建 Python 对象(需要 numpy)
+    """
+    lengths = np.fromiter((len(blob) if blob else 0 for blob in blobs), np.int64, len(blobs))
+    if (lengths % PACKED_SIZE).any():
+        raise ValueError('Invalid packed operators length')
+    lengths //= PACKED_SIZE
+    data = np.frombuffer(b''.join(blob for blob in blobs if blob), PACKED_DTYPE)
+    record = np.repeat(np.arange(len(blobs)), lengths)
+    index = np.arange(len(data)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    flags = data['flags']
+    is_up = np.where(flags & FLAG_HAS_UP, (flags & FLAG_UP) > 0, -1).astype(np.int8)
+    return PackedColumns(record, index, data['operator'], data['rarity'], (flags & FLAG_NEW) > 0, is_up)
@@ -0,0 +1,47 @@
+import gzip
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024  # 太小的响应压缩没有意义
+
+
+def get_accepted_encodings(request: Request) -> set[str]:
+    encodings = set()
+    for item in request.headers.get('accept-encoding', '').split(','):
+        name, _, params = item.partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+class PreparedResponse[T: BaseModel]:
+    """
+    预先序列化(和压缩)好的响应, 适合很少变化的数据, 命中缓存时直接返回字节
+    """
+
+    def __init__(self, model: T) -> None:
+        self.model: T = model
+        self.body: bytes = model.model_dump_json().encode()
+        self.encoded: dict[str, bytes] = {}
+        if len(self.body) >= MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(self.body, quality=11)
+            self.encoded['gzip'] = gzip.compress(self.body, compresslevel=9)
+
+    def to_response(self, request: Request) -> Response:
+        headers = {'Vary': 'Accept-Encoding'}
+        body = self.body
+        accepted = get_accepted_encodings(request)
+        for encoding, encoded in self.encoded.items():  # br 优先
+            if encoding in accepted:
+                headers['Content-Encoding'] = encoding
+                body = encoded
+                break
+        return Response(content=body, media_type='application/json', headers=headers)
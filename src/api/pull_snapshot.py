@@ -0,0 +1,190 @@
+# 所有寻访记录(每个干员一行)的列存快照, 供全站统计和排行使用
+# 内存占用: 每行 id 8 + account 4 + time 8 + pool 2 + rarity 1 + is_up 1 + is_new 1 = 25 字节, 每百万条约 24 MiB,
+# 这部分由所有 worker 通过 mmap 共享, 每个进程私有的只有发布之后追加的记录
+# 打包保存干员(storage.packed_operators)时没有 OSROperator.id, 用 记录 id * MAX_OPERATORS + index 代替, 快照名称也不同
+from __future__ import annotations
+
+from datetime import datetime
+from contextlib import AbstractAsyncContextManager, nullcontext
+
+from src.config import conf
+from src.api.column_snapshot import ColumnSnapshot, np, load_snapshot
+from src.api.databases import OperatorSearchRecord, OSROperator
+from src.api.packed_operators import MAX_OPERATORS, unpack_operators, unpack_columns
+from src.logger import logger
+
+
+class PullSnapshot(ColumnSnapshot):
+    name = 'pulls-packed' if conf.storage.packed_operators else 'pulls'
+    columns = {
+        'id': '<i8',  # OSROperator.id 或 记录 id * MAX_OPERATORS + index
+        'account': '<i4',
+        'time': '<i8',
+        'pool': '<i2',  # dictionary 中的卡池 id 的下标
+        'rarity': '<i1',
+        'is_up': '<i1',  # -1 表示没有 UP 信息
+        'is_new': '?'
+    }
+    dictionary_column = 'pool'
+    null_values = {'is_up': -1}
+
+    async def fetch_rows(self, last_id: int, limit: int) -> list[tuple]:
+        return list(await (OSROperator
+                           .select(OSROperator.id, OperatorSearchRecord.account, OperatorSearchRecord.time, OperatorSearchRecord.pool_id, OSROperator.rarity, OSROperator.is_up, OSROperator.is_new)
+                           .join(OperatorSearchRecord)
+                           .where(OSROperator.id > last_id)
+                           .order_by(OSROperator.id)
+                           .limit(limit)
+                           .tuples()
+                           .aio_execute()))
+
+    async def load_page(self, last_id: int, limit: int) -> int | None:
+        if not conf.storage.packed_operators:
+            return await super().load_page(last_id, limit)
+
+        # 按寻访记录分页, 一次解码整页的干员
+        records = list(await (OperatorSearchRecord
+                              .select(OperatorSearchRecord.id, OperatorSearchRecord.account, OperatorSearchRecord.time, OperatorSearchRecord.pool_id, OperatorSearchRecord.packed_operators)
+                              .where(OperatorSearchRecord.id > last_id // MAX_OPERATORS)
+                              .order_by(OperatorSearchRecord.id)
+                              .limit(limit)
+                              .tuples()
+                              .aio_execute()))
+        if not records:
+            return None
+        record_ids, accounts, times, pool_ids, blobs = zip(*records)
+        packed = unpack_columns(list(blobs))
+        pools = np.asarray([self.get_code(pool_id) for pool_id in pool_ids], self.columns['pool'])
+        self.append_columns({
+            'id': np.asarray(record_ids, np.int64)[packed.record] * MAX_OPERATORS + packed.index,
+            'account': np.asarray(accounts, np.int64)[packed.record],
+            'time': np.asarray(times, np.int64)[packed.record],
+            'pool': pools[packed.record],
+            'rarity': packed.rarity,
+            'is_up': packed.is_up,
+            'is_new': packed.is_new
+        }, len(packed.record))
+        return record_ids[-1] * MAX_OPERATORS + MAX_OPERATORS - 1 if len(records) >= limit else None
+
+    async def refresh_records(self, record_ids: list[int]) -> None:
+        """
+        重新读取这些寻访记录的卡池和 UP 信息
+        """
+        async with self.lock:
+            if not self.loaded_at:
+                return
+            if conf.storage.packed_operators:
+                rows = [
+                    (record_id * MAX_OPERATORS + item.index, pool_id, item.is_up)
+                    for record_id, pool_id, data in await (OperatorSearchRecord
+                                                           .select(OperatorSearchRecord.id, OperatorSearchRecord.pool_id, OperatorSearchRecord.packed_operators)
+                                                           .where(OperatorSearchRecord.id.in_(record_ids))
+                                                           .tuples()
+                                                           .aio_execute())
+                    for item in unpack_operators(data)
+                ]
+            else:
+                rows = await (OSROperator
+                              .select(OSROperator.id, OperatorSearchRecord.pool_id, OSROperator.is_up)
+                              .join(OperatorSearchRecord)
+                              .where(OperatorSearchRecord.id.in_(record_ids))
+                              .tuples()
+                              .aio_execute())
+            for operator_id, pool_id, is_up in rows:
+                self.update_row(operator_id, {'pool': pool_id, 'is_up': is_up})
+
+
+def get_month_bounds(start: int, end: int) -> tuple[np.ndarray, list[str]]:
+    """
+    :return: start 所在月份到 end 所在月份的每个月(本地时间)的开始时间和名称
+    """
+    bounds: list[int] = []
+    months: list[str] = []
+    date = datetime.fromtimestamp(start).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while date.timestamp() <= end:
+        bounds.append(int(date.timestamp()))
+        months.append(date.strftime('%Y-%m'))
+        date = date.replace(year=date.year + 1, month=1) if date.month == 12 else date.replace(month=date.month + 1)
+    return np.asarray(bounds, np.int64), months
+
+
+def summarize_osr(snapshot: PullSnapshot, mask: np.ndarray, pool_types: dict[str, tuple[str, bool]]) -> dict:
+    """
+    与 statistics_compute.summarize_osr 的结果相同
+    :param pool_types: 卡池 id -> (卡池类型, 是否有 UP 干员), 需要包含 snapshot.dictionary
+    """
+    pool_ids = snapshot.dictionary
+    pool_number = len(pool_ids)
+    # 末尾多一项, 让 -1(未知卡池)取到 False
+    valid_pools = np.asarray([pool_types[pool_id][0] != 'UNKNOWN' for pool_id in pool_ids] + [False])
+    up_pools = np.asarray([pool_types[pool_id][1] for pool_id in pool_ids] + [False])
+
+    mask = mask.copy()
+    mask[mask] = valid_pools[snapshot.select('pool', mask)]
+    pool = snapshot.select('pool', mask).astype(np.intp)
+    times = snapshot.select('time', mask)
+    rarity = snapshot.select('rarity', mask)
+    is_up = snapshot.select('is_up', mask)
+
+    number_pool = np.bincount(pool, minlength=pool_number)
+    first_time = np.full(pool_number, np.iinfo(np.int64).max)
+    np.minimum.at(first_time, pool, times)
+    rarity_number = {r: int(n) for r, n in zip(('3', '4', '5', '6'), np.bincount(rarity, minlength=7)[3:7])}
+    is_six = (rarity == 6) & up_pools[pool]
+    six = np.bincount(pool[is_six], minlength=pool_number)
+    not_up = np.bincount(pool[is_six & (is_up != 1)], minlength=pool_number)
+
+    number_month: dict[str, int] = {}
+    if len(times):
+        bounds, months = get_month_bounds(int(times.min()), int(times.max()))
+        month_counts = np.bincount(np.searchsorted(bounds, times, side='right') - 1, minlength=len(months))
+        number_month = {month: int(n) for month, n in reversed(list(zip(months, month_counts))) if n}
+
+    total = sum(rarity_number.values())
+    pools = sorted(np.flatnonzero(number_pool).tolist(), key=lambda index: (first_time[index], pool_ids[index]))
+
+    osr_number_pool: dict[str, int | dict[str, int]] = {'total': {'all': total, **rarity_number}}
+    osr_number_pool.update((pool_ids[index], int(number_pool[index])) for index in pools)
+
+    osr_not_up_avg: dict[str, float] = {'total': int(not_up.sum()) / int(six.sum()) if six.sum() else 0}
+    osr_not_up_avg.update((pool_ids[index], int(not_up[index]) / int(six[index])) for index in pools if six[index])
+
+    return {
+        'osr_number_pool': osr_number_pool,
+        'osr_number_month': number_month,
+        'osr_lucky_avg': {r: total / rarity_number[r] if rarity_number[r] else 0 for r in ('6', '5', '4', '3')},
+        'osr_not_up_avg': osr_not_up_avg
+    }
+
+
+pull_snapshot: PullSnapshot | None = PullSnapshot() if np is not None and conf.statistics.snapshot else None
+
+
+def use_pull_snapshot() -> AbstractAsyncContextManager[PullSnapshot | None]:
+    """
+    async with use_pull_snapshot() as snapshot: 在其中完成对快照的计算
+    没有启用(或没有安装 numpy), 或者还没有加载完成时得到 None
+    """
+    if pull_snapshot is None:
+        return nullcontext()
+    return pull_snapshot.use()
+
+
+async def load_pull_snapshot() -> None:
+    await load_snapshot(pull_snapshot)
+
+
+async def on_pulls_changed(record_ids: list[int] | None = None) -> None:
+    """
+    写入寻访记录后调用, 让快照立即包含新增的记录
+    :param record_ids: 卡池或 UP 信息被修改的已有寻访记录
+    """
+    if pull_snapshot is None:
+        return
+    await pull_snapshot.catch_up()
+    if record_ids:
+        try:
+            await pull_snapshot.refresh_records(record_ids)
+        except Exception as e:
+            pull_snapshot.loaded_at = 0
+            logger.warning(f'Refresh pull snapshot error: {e!r}')
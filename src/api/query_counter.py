@@ -0,0 +1,106 @@
+import re
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import conf
+from src.logger import logger
+
+IN_LIST_PATTERN = re.compile(r'\(%s(?:, %s)+\)')
+
+
+class QueryStats:
+    """
+    一次请求或任务中执行的 SQL 统计, 同一形状(参数不同)的语句被反复执行通常意味着 N+1 查询
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.total_time: float = 0
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, sql: str, elapsed: float) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        self.shapes[IN_LIST_PATTERN.sub('(%s, ...)', sql)] += 1
+
+    def repeated(self, limit: int = 3) -> list[tuple[str, int]]:
+        return [(shape, n) for shape, n in self.shapes.most_common(limit) if n > 1]
+
+    def exceeded(self) -> bool:
+        return self.count > conf.query_counter.max_queries or self.total_time > conf.query_counter.max_time
+
+    def summary(self) -> str:
+        lines = [f'{self.count} queries in {self.total_time * 1000:.1f}ms']
+        lines.extend(f'  {n}x {shape}' for shape, n in self.repeated())
+        return '\n'.join(lines)
+
+
+query_stats: ContextVar[QueryStats | None] = ContextVar('query_stats', default=None)
+
+
+def record_query(sql: str, elapsed: float) -> None:
+    if (stats := query_stats.get()) is not None:
+        stats.record(sql, elapsed)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """
+    统计上下文内(包括其中创建的任务)执行的 SQL
+    """
+    token = query_stats.set(stats := QueryStats())
+    try:
+        yield stats
+    finally:
+        query_stats.reset(token)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int) -> Iterator[QueryStats]:
+    """
+    测试用, 上下文内执行的 SQL 超过 max_queries 条时失败
+
+    用法::
+
+        with assert_max_queries(5):
+            await get_osr_info(account)
+    """
+    with track_queries() as stats:
+        yield stats
+    assert stats.count <= max_queries, f'Expected at most {max_queries} queries, got {stats.summary()}'
+
+
+class QueryCounterMiddleware:
+    """
+    统计每个请求的 SQL 数量和耗时, 超过阈值时记录重复最多的语句, 调试模式下通过响应头返回
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            start = time.perf_counter()
+
+            async def send_wrapper(message: Message) -> None:
+                if message['type'] == 'http.response.start' and conf.safe.DEBUG:
+                    headers = MutableHeaders(scope=message)
+                    headers['X-Query-Count'] = str(stats.count)
+                    headers['X-Query-Time'] = f'{stats.total_time * 1000:.1f}'
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+        if stats.exceeded():
+            logger.warning(f'{scope["method"]} {scope["path"]} took {(time.perf_counter() - start) * 1000:.1f}ms, {stats.summary()}')
@@ -0,0 +1,182 @@
+import math
+import time
+import asyncio
+import sqlite3
+import threading
+
+from abc import ABC, abstractmethod
+from typing import override
+
+from jose import JWTError
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.config import conf
+from src.api.cache import TTLCache
+from src.api.utils import decode_jwt
+from src.data_store import get_res_path
+
+
+class TokenBucket:
+    """
+    令牌桶, 以 rate 个/秒 的速度补充, 最多存 burst 个
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate: float = rate
+        self.burst: float = burst
+
+    def take(self, tokens: float, updated_at: float, cost: float, now: float) -> tuple[float, float]:
+        """
+        尝试从桶中取出令牌
+        :param tokens: 桶中上次剩余的令牌
+        :param updated_at: 上次更新的时间
+        :param cost: 需要的令牌数
+        :param now: 当前时间
+        :return: 新的令牌数, 需要等待的秒数(0 为允许)
+        """
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens >= cost:
+            return tokens - cost, 0
+        return tokens, (min(cost, self.burst) - tokens) / self.rate
+
+    @property
+    def refill_time(self) -> float:
+        return self.burst / self.rate
+
+
+class BucketStore(ABC):
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket: TokenBucket = bucket
+
+    @abstractmethod
+    async def take(self, keys: list[str], cost: float) -> float:
+        """
+        所有桶都有足够的令牌时才从每个桶中取出, 否则都不扣除(被自己的限额拒绝的请求不会继续消耗共享的 IP 桶)
+        :return: 需要等待的秒数, 0 为允许
+        """
+        ...
+
+
+class MemoryBucketStore(BucketStore):
+    """
+    进程内的令牌桶, 单 worker 时使用
+    """
+
+    def __init__(self, bucket: TokenBucket, max_size: int = 65536) -> None:
+        super().__init__(bucket)
+        self._buckets: TTLCache[str, tuple[float, float]] = TTLCache(ttl=bucket.refill_time, max_size=max_size)
+
+    @override
+    async def take(self, keys: list[str], cost: float) -> float:
+        now = time.monotonic()
+        results = {}
+        for key in keys:
+            tokens, updated_at = self._buckets.get(key) or (self.bucket.burst, now)
+            results[key] = self.bucket.take(tokens, updated_at, cost, now)
+        if wait := max(wait for _, wait in results.values()):
+            return wait
+        for key, (tokens, _) in results.items():
+            self._buckets.set(key, (tokens, now))
+        return 0
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    基于本地 SQLite 文件的令牌桶, 多 worker 时共享状态
+    """
+
+    def __init__(self, bucket: TokenBucket, path: str) -> None:
+        super().__init__(bucket)
+        self.path: str = path
+        self._local = threading.local()
+        self._calls: int = 0
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, 'connection', None)) is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def _take(self, keys: list[str], cost: float, cleanup: bool) -> float:
+        connection = self._connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            results = {}
+            for key in keys:
+                row = connection.execute('SELECT tokens, updated_at FROM bucket WHERE key = ?', (key,)).fetchone()
+                tokens, updated_at = row or (self.bucket.burst, now)
+                results[key] = self.bucket.take(tokens, updated_at, cost, now)
+            if not (wait := max(wait for _, wait in results.values())):
+                connection.executemany('REPLACE INTO bucket (key, tokens, updated_at) VALUES (?, ?, ?)', [(key, tokens, now) for key, (tokens, _) in results.items()])
+            if cleanup:  # 超过补满时间的桶和新桶没有区别
+                connection.execute('DELETE FROM bucket WHERE updated_at < ?', (now - self.bucket.refill_time,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    @override
+    async def take(self, keys: list[str], cost: float) -> float:
+        self._calls += 1
+        try:
+            return await asyncio.to_thread(self._take, keys, cost, self._calls % 1000 == 0)
+        except sqlite3.OperationalError:
+            return 0  # 限流存储不可用时放行 不影响正常请求
+
+
+def create_bucket_store() -> BucketStore:
+    bucket = TokenBucket(conf.rate_limit.rate, conf.rate_limit.burst)
+    if (conf.web.workers or 1) > 1:
+        return SQLiteBucketStore(bucket, str(get_res_path('data') / 'rate_limit.db'))
+    return MemoryBucketStore(bucket)
+
+
+def get_request_user(scope: Scope) -> str | None:
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            scheme, _, token = value.decode('latin-1').partition(' ')
+            if scheme.lower() != 'bearer':
+                return None
+            try:
+                return decode_jwt(token).get('sub')
+            except JWTError:
+                return None
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    按 IP 和用户分别限流, 每个路由消耗的令牌数由 rate_limit.costs 配置
+    """
+
+    def __init__(self, app: ASGIApp, store: BucketStore | None = None) -> None:
+        self.app: ASGIApp = app
+        self.store: BucketStore = store or create_bucket_store()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not scope['path'].startswith('/api/'):
+            await self.app(scope, receive, send)
+            return
+
+        cost = conf.rate_limit.costs.get(scope['path'], conf.rate_limit.default_cost)
+        client = scope.get('client')
+        keys = [f'ip:{client[0] if client else "unknown"}']
+        if user := get_request_user(scope):
+            keys.append(f'user:{user}')
+
+        if (wait := await self.store.take(keys, cost)) > 0:
+            response = JSONResponse(
+                {'detail': 'rate_limit.exceeded'},
+                status_code=429,
+                headers={'Retry-After': str(math.ceil(wait))}
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
@@ -1,15 +1,31 @@
+import asyncio
+import multiprocessing
+
+from typing import AsyncIterator
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import Request, Response
+from peewee import fn, BooleanField, Expression
 from pydantic import BaseModel
-from collections import defaultdict
 
+from src.config import conf
 from src.api.account_datas import DiamondTypeInfo
 from src.api.cache import cached_with_refresh
+from src.api.prepared_response import PreparedResponse
 from src.api.datas import PoolInfo
 from src.api.users import UserInDB, UserConfig
 from src.api.models import UsernameDisplayStatus
-from src.api.databases import Account, DBUser, OperatorSearchRecord, OSROperator, PayRecord, DiamondRecord
+from src.api.databases import Account, DBUser, OperatorSearchRecord, OSROperator, PayRecord, DiamondRecord, read_replica, use_pool
+from src.api.packed_operators import PackedColumns, np, unpack_operators, unpack_columns
+from src.api.statistics_compute import OSRColumns, DiamondColumns, summarize_site_statistics
+from src.api.pull_snapshot import use_pull_snapshot, summarize_osr as summarize_snapshot_osr
+from src.api.diamond_snapshot import use_diamond_snapshot, summarize_diamond as summarize_snapshot_diamond
 from src.api.utils import f_hide_mid
 
+STATISTICS_PAGE_SIZE = 50000
+
+statistics_executor = ProcessPoolExecutor(max_workers=conf.statistics.workers, mp_context=multiprocessing.get_context('spawn'))
+
 
 class LuckyRankUser(BaseModel):
     name: str
@@ -69,10 +85,10 @@ class SiteStatisticsInfo(BaseModel):
     total_pay_money: int
 
 
-def get_confined_account_name(user: UserInDB, account: Account) -> str:
-    if user.username == account.owner.name:
-        return f'{account.nickname} (Self)'
-
+def get_display_name(account: Account) -> str:
+    """
+    按账号所有者的设置生成排行中显示的名称, account.owner 需要已经加载
+    """
     username: str
     user_config: UserConfig = account.owner.user_config
     match user_config.name_display:
@@ -91,30 +107,199 @@ def get_confined_account_name(user: UserInDB, account: Account) -> str:
     return username
 
 
-@cached_with_refresh(ttl=3600, key_builder=lambda: 'lucky_rank_info')
-async def compute_lucky_rank() -> dict | None:
-    enable_users: list[DBUser] = list([user for user in await DBUser.select().where(DBUser.disabled == False).aio_execute() if user.user_config.is_lucky_rank])
-
-    osr_lucky = defaultdict(lambda: {'six': 0, 'count': 0, 'account': None, 'avg': 0.0})
-
-    records = await OperatorSearchRecord.select(OperatorSearchRecord, Account).join(Account).where(Account.owner.in_(enable_users)).aio_execute()
-
-    record: OperatorSearchRecord
-    for record in records:
-        account = record.account
-        osr_lucky[account.id]['account'] = account
+class PreparedRank[T: BaseModel](PreparedResponse[T]):
+    """
+    预先计算好显示名称的排行, 只有 "(Self)" 标记与查看者有关
+    查看者不在榜上时直接使用预先序列化的响应
+    """
+
+    def __init__(self, model: T, owners: dict[str, list[tuple[str, str]]]) -> None:
+        super().__init__(model)
+        self.owners: dict[str, list[tuple[str, str]]] = owners  # 列表字段 -> 每一项的 (所有者用户名, 账号昵称)
+        self.usernames: set[str] = {owner for entries in owners.values() for owner, _ in entries}
+
+    def for_user(self, user: UserInDB) -> T:
+        if user.username not in self.usernames:
+            return self.model
+
+        model = self.model.model_copy(deep=True)
+        for field, entries in self.owners.items():
+            for item, (owner, nickname) in zip(getattr(model, field), entries):
+                if owner == user.username:
+                    item.name = f'{nickname} (Self)'
+        return model
+
+    def to_user_response(self, request: Request, user: UserInDB) -> Response:
+        if user.username not in self.usernames:
+            return self.to_response(request)
+        return Response(content=self.for_user(user).model_dump_json(), media_type='application/json')
+
+
+def prepare_rank[T: BaseModel](model_type: type[T], info: dict, fields: tuple[str, str]) -> PreparedRank[T]:
+    owners: dict[str, list[tuple[str, str]]] = {}
+    for field in fields:
+        owners[field] = []
+        for item in info[field]:
+            account: Account = item.pop('account')
+            item['name'] = get_display_name(account)
+            owners[field].append((account.owner.username, account.nickname))
+    return PreparedRank(model_type.model_validate(info), owners)
+
+
+def is_enabled(flag: BooleanField) -> Expression:
+    """
+    账号的所有者没有被禁用, 并且打开了 flag 对应的开关, 需要 join DBUser
+    """
+    return (DBUser.disabled == False) & (flag == True)
+
+
+async def get_account_ids(flag: BooleanField) -> list[int]:
+    return [account_id for account_id, in await Account.select(Account.id).join(DBUser).where(is_enabled(flag)).tuples().aio_execute()]
+
+
+async def iter_packed_records(flag: BooleanField, condition: Expression | None = None) -> AsyncIterator[list[tuple]]:
+    """
+    打包保存干员时, 按主键分页读取账号的寻访记录 (id, account, time, pool_id, packed_operators)
+    """
+    last_id = 0
+    while True:
+        query = (OperatorSearchRecord
+                 .select(OperatorSearchRecord.id, OperatorSearchRecord.account, OperatorSearchRecord.time, OperatorSearchRecord.pool_id, OperatorSearchRecord.packed_operators)
+                 .join(Account)
+                 .join(DBUser)
+                 .where(is_enabled(flag) & (OperatorSearchRecord.id > last_id)))
+        if condition is not None:
+            query = query.where(condition)
+        rows = await query.order_by(OperatorSearchRecord.id).limit(STATISTICS_PAGE_SIZE).tuples().aio_execute()
+        yield rows
+        if len(rows) < STATISTICS_PAGE_SIZE:
+            return
+        last_id = rows[-1][0]
+
+
+async def iter_packed_columns(flag: BooleanField, condition: Expression | None = None) -> AsyncIterator[tuple[dict[str, 'np.ndarray'], list[str], PackedColumns]]:
+    """
+    与 iter_packed_records 相同, 但每页的干员一次解码成列(需要 numpy)
+    :return: 每页的 ({'account', 'time'}: 每个干员所在记录的值, 每条记录的 pool_id, 干员的各列)
+    """
+    async for rows in iter_packed_records(flag, condition):
+        if not rows:
+            continue
+        _, accounts, times, pool_ids, blobs = zip(*rows)
+        packed = unpack_columns(list(blobs))
+        yield {'account': np.asarray(accounts, np.int64)[packed.record], 'time': np.asarray(times, np.int64)[packed.record]}, list(pool_ids), packed
+
+
+def merge_counts(result: dict[int, tuple[int, int]], accounts: 'np.ndarray', is_first: 'np.ndarray', is_second: 'np.ndarray') -> None:
+    """
+    把一页中每个账号满足 is_first / is_second 的干员数累加到 result
+    """
+    accounts, inverse = np.unique(accounts[is_first], return_inverse=True)
+    firsts = np.bincount(inverse, minlength=len(accounts))
+    seconds = np.bincount(inverse, weights=is_second[is_first], minlength=len(accounts)).astype(np.int64)
+    for account, first, second in zip(accounts.tolist(), firsts.tolist(), seconds.tolist()):
+        old_first, old_second = result.get(account, (0, 0))
+        result[account] = (old_first + first, old_second + second)
+
+
+async def count_six(flag: BooleanField, pool_id: str | None = None) -> dict[int, tuple[int, int]]:
+    """
+    :return: 账号 id -> (干员数, 六星数), 只包含有寻访记录的账号
+    """
+    async with use_pull_snapshot() as snapshot:
+        if snapshot is not None:
+            mask = snapshot.mask(accounts=await get_account_ids(flag), values=[pool_id] if pool_id else None)
+            accounts, counts, (six,) = snapshot.group_count('account', mask, snapshot.select('rarity', mask) == 6)
+            return dict(zip(accounts.tolist(), zip(counts.tolist(), six.tolist())))
+
+    if conf.storage.packed_operators and np is not None:
+        result: dict[int, tuple[int, int]] = {}
+        async for values, _, packed in iter_packed_columns(flag, (OperatorSearchRecord.pool_id == pool_id) if pool_id else None):
+            merge_counts(result, values['account'], np.ones(len(packed.record), bool), packed.rarity == 6)
+        return result
+
+    if conf.storage.packed_operators:
+        result = {}
+        async for rows in iter_packed_records(flag, (OperatorSearchRecord.pool_id == pool_id) if pool_id else None):
+            for _, account, _, _, data in rows:
+                if operators := unpack_operators(data):
+                    count, six = result.get(account, (0, 0))
+                    result[account] = (count + len(operators), six + sum(operator.rarity == 6 for operator in operators))
+        return result
+
+    query = (OSROperator
+             .select(OperatorSearchRecord.account, fn.COUNT(OSROperator.id), fn.SUM(OSROperator.rarity == 6))
+             .join(OperatorSearchRecord)
+             .join(Account)
+             .join(DBUser)
+             .where(is_enabled(flag))
+             .group_by(OperatorSearchRecord.account))
+    if pool_id:
+        query = query.where(OperatorSearchRecord.pool_id == pool_id)
+    return {account: (count, int(six)) for account, count, six in await query.tuples().aio_execute()}
+
+
+async def count_not_up(flag: BooleanField, pool_ids: list[str]) -> dict[int, tuple[int, int]]:
+    """
+    :return: 账号 id -> (有 UP 信息的六星数, 其中歪了的数量), 只包含有这样的六星的账号
+    """
+    async with use_pull_snapshot() as snapshot:
+        if snapshot is not None:
+            mask = snapshot.mask(accounts=await get_account_ids(flag), values=pool_ids)
+            mask[mask] = (snapshot.select('rarity', mask) == 6) & (snapshot.select('is_up', mask) != -1)
+            accounts, six, (not_up,) = snapshot.group_count('account', mask, snapshot.select('is_up', mask) == 0)
+            return dict(zip(accounts.tolist(), zip(six.tolist(), not_up.tolist())))
+
+    if conf.storage.packed_operators and np is not None:
+        result: dict[int, tuple[int, int]] = {}
+        async for values, _, packed in iter_packed_columns(flag, OperatorSearchRecord.pool_id.in_(pool_ids)):
+            merge_counts(result, values['account'], (packed.rarity == 6) & (packed.is_up != -1), packed.is_up == 0)
+        return result
+
+    if conf.storage.packed_operators:
+        result = {}
+        async for rows in iter_packed_records(flag, OperatorSearchRecord.pool_id.in_(pool_ids)):
+            for _, account, _, _, data in rows:
+                for operator in unpack_operators(data):
+                    if operator.rarity == 6 and operator.is_up is not None:
+                        six, not_up = result.get(account, (0, 0))
+                        result[account] = (six + 1, not_up + (not operator.is_up))
+        return result
+
+    query = (OSROperator
+             .select(OperatorSearchRecord.account, fn.COUNT(OSROperator.id), fn.SUM(OSROperator.is_up == False))
+             .join(OperatorSearchRecord)
+             .join(Account)
+             .join(DBUser)
+             .where(is_enabled(flag) & OperatorSearchRecord.pool_id.in_(pool_ids))
+             .where((OSROperator.rarity == 6) & OSROperator.is_up.is_null(False))
+             .group_by(OperatorSearchRecord.account))
+    return {account: (six, int(not_up)) for account, six, not_up in await query.tuples().aio_execute()}
+
+
+async def load_rank_accounts(items: list[dict]) -> None:
+    """
+    把排行中每一项的 account 从 id 换成 Account(包括 owner)
+    """
+    accounts = {
+        account.id: account for account in await (Account
+                                                   .select(Account, DBUser)
+                                                   .join(DBUser)
+                                                   .where(Account.id.in_([item['account'] for item in items]))
+                                                   .aio_execute())
+    }
+    for item in items:
+        item['account'] = accounts[item['account']]
 
-        operator: OSROperator
-        for operator in await OSROperator.select().where(OSROperator.record == record).aio_execute():
-            osr_lucky[account.id]['count'] += 1
-            if operator.rarity == 6:
-                osr_lucky[account.id]['six'] += 1
 
-    osr_lucky = [v for v in osr_lucky.values() if v['six'] > 5]
-    for item in osr_lucky:
-        item['avg'] = item['count'] / item['six']
+@cached_with_refresh(ttl=3600, key_builder=lambda: 'lucky_rank_info')
+@use_pool('scheduled')
+@read_replica()
+async def compute_lucky_rank() -> PreparedRank[LuckyRankInfo] | None:
+    counts = await count_six(DBUser.is_lucky_rank)
+    osr_lucky = [{'account': account, 'six': six, 'count': count, 'avg': count / six} for account, (count, six) in counts.items() if six > 5]
 
-    osr_lucky = list(sorted(osr_lucky, key=lambda x: x['avg']))
+    osr_lucky = list(sorted(osr_lucky, key=lambda x: (x['avg'], x['account'])))
 
     if len(osr_lucky) < 20:
         return None
@@ -124,31 +309,23 @@ async def compute_lucky_rank() -> dict | None:
         'unlucky': list(reversed(osr_lucky[-10:])),
         'time': datetime.now()
     }
+    await load_rank_accounts(osr_lucky_rank['lucky'] + osr_lucky_rank['unlucky'])
 
-    return osr_lucky_rank
-
+    return prepare_rank(LuckyRankInfo, osr_lucky_rank, ('lucky', 'unlucky'))
 
-async def get_lucky_rank_info(user: UserInDB) -> LuckyRankInfo | None:
-    info: dict = await compute_lucky_rank()
-    if info is None:
-        return None
 
-    for item in info['lucky']:
-        item['name'] = get_confined_account_name(user, item['account'])
-    for item in info['unlucky']:
-        item['name'] = get_confined_account_name(user, item['account'])
-    return LuckyRankInfo.model_validate(info)
+async def get_lucky_rank_response(request: Request, user: UserInDB) -> Response | None:
+    rank = await compute_lucky_rank()
+    return rank.to_user_response(request, user) if rank else None
 
 
 @cached_with_refresh(ttl=3600, key_builder=lambda: 'pool_lucky_rank_info')
-async def compute_pool_lucky_rank() -> dict[str, object] | None:
+@use_pool('scheduled')
+@read_replica()
+async def compute_pool_lucky_rank() -> PreparedRank[PoolLuckyRankInfo] | None:
     def get_first_pool_id_of_type(pool_type: str) -> str:
         return next((pool_id for pool_id in pools if PoolInfo.get_pool_info(pool_id)['type'] == pool_type), '')
 
-    enable_users: list[DBUser] = list([user for user in await DBUser.select().where(DBUser.disabled == False).aio_execute() if user.user_config.is_lucky_rank])
-
-    osr_lucky = defaultdict(lambda: {'six': 0, 'count': 0, 'account': None, 'avg': 0.0})
-
     pools = PoolInfo.get_now_pools()
     if pools is None:
         return None
@@ -161,24 +338,10 @@ async def compute_pool_lucky_rank() -> dict[str, object] | None:
     if not pool:
         return None
 
-    records = await OperatorSearchRecord.select(OperatorSearchRecord, Account).join(Account).where(OperatorSearchRecord.pool_id == pool).where(Account.owner.in_(enable_users)).aio_execute()
-
-    record: OperatorSearchRecord
-    for record in records:
-        account = record.account
-        osr_lucky[account.id]['account'] = account
+    counts = await count_six(DBUser.is_lucky_rank, pool)
+    osr_lucky = [{'account': account, 'six': six, 'count': count, 'avg': count / six} for account, (count, six) in counts.items() if six > 1]
 
-        operator: OSROperator
-        for operator in await OSROperator.select().where(OSROperator.record == record).aio_execute():
-            osr_lucky[account.id]['count'] += 1
-            if operator.rarity == 6:
-                osr_lucky[account.id]['six'] += 1
-
-    osr_lucky = [v for v in osr_lucky.values() if v['six'] > 1]
-    for item in osr_lucky:
-        item['avg'] = item['count'] / item['six']
-
-    osr_lucky = list(sorted(osr_lucky, key=lambda x: x['avg']))
+    osr_lucky = list(sorted(osr_lucky, key=lambda x: (x['avg'], x['account'])))
 
     if len(osr_lucky) < 20:
         return None
@@ -189,48 +352,26 @@ async def compute_pool_lucky_rank() -> dict[str, object] | None:
         'time': datetime.now(),
         'pool': pool
     }
+    await load_rank_accounts(osr_lucky_rank['lucky'] + osr_lucky_rank['unlucky'])
 
-    return osr_lucky_rank
-
+    return prepare_rank(PoolLuckyRankInfo, osr_lucky_rank, ('lucky', 'unlucky'))
 
-async def get_pool_lucky_rank_info(user: UserInDB) -> PoolLuckyRankInfo | None:
-    info: dict = await compute_pool_lucky_rank()
-    if info is None:
-        return None
 
-    for item in info['lucky']:
-        item['name'] = get_confined_account_name(user, item['account'])
-    for item in info['unlucky']:
-        item['name'] = get_confined_account_name(user, item['account'])
-    return PoolLuckyRankInfo.model_validate(info)
+async def get_pool_lucky_rank_response(request: Request, user: UserInDB) -> Response | None:
+    rank = await compute_pool_lucky_rank()
+    return rank.to_user_response(request, user) if rank else None
 
 
 @cached_with_refresh(ttl=3600, key_builder=lambda: 'six_up_rank_info')
-async def compute_six_up_rank() -> dict | None:
-    enable_users: list[DBUser] = list([user for user in await DBUser.select().where(DBUser.disabled == False).aio_execute() if user.user_config.is_lucky_rank])
+@use_pool('scheduled')
+@read_replica()
+async def compute_six_up_rank() -> PreparedRank[UPRankInfo] | None:
     up_pools = list([k for k, v in PoolInfo.get_all_pools().items() if 'up_char_info' in v])
 
-    osr_up = defaultdict(lambda: {'six': 0, 'not_up': 0, 'account': None, 'avg': 0.0})
-
-    records = await OperatorSearchRecord.select(OperatorSearchRecord, Account).where(OperatorSearchRecord.pool_id.in_(up_pools)).join(Account).where(Account.owner.in_(enable_users)).aio_execute()
-
-    record: OperatorSearchRecord
-    for record in records:
-        account = record.account
-        osr_up[account.id]['account'] = account
+    counts = await count_not_up(DBUser.is_lucky_rank, up_pools)
+    osr_up = [{'account': account, 'six': six, 'not_up': not_up, 'avg': not_up / six} for account, (six, not_up) in counts.items() if six > 5]
 
-        operator: OSROperator
-        for operator in await OSROperator.select().where(OSROperator.record == record).aio_execute():
-            if operator.rarity == 6 and operator.is_up is not None:
-                osr_up[account.id]['six'] += 1
-                if not operator.is_up:
-                    osr_up[account.id]['not_up'] += 1
-
-    osr_up = [v for v in osr_up.values() if v['six'] > 5]
-    for item in osr_up:
-        item['avg'] = item['not_up'] / item['six']
-
-    osr_up = list(sorted(osr_up, key=lambda x: x['avg']))
+    osr_up = list(sorted(osr_up, key=lambda x: (x['avg'], x['account'])))
 
     if len(osr_up) < 20:
         return None
@@ -240,29 +381,108 @@ async def compute_six_up_rank() -> dict | None:
         'not_up': list(reversed(osr_up[-10:])),
         'time': datetime.now()
     }
-
-    return osr_up_info
-
-
-async def get_six_up_rank_info(user: UserInDB) -> UPRankInfo | None:
-    info: dict = await compute_six_up_rank()
-    if info is None:
-        return None
-
-    for item in info['up']:
-        item['name'] = get_confined_account_name(user, item['account'])
-    for item in info['not_up']:
-        item['name'] = get_confined_account_name(user, item['account'])
-    return UPRankInfo.model_validate(info)
+    await load_rank_accounts(osr_up_info['up'] + osr_up_info['not_up'])
+
+    return prepare_rank(UPRankInfo, osr_up_info, ('up', 'not_up'))
+
+
+async def get_six_up_rank_response(request: Request, user: UserInDB) -> Response | None:
+    rank = await compute_six_up_rank()
+    return rank.to_user_response(request, user) if rank else None
+
+
+async def load_osr_columns(flag: BooleanField) -> OSRColumns:
+    """
+    按列读取账号的所有干员记录, 按主键分页以限制单次查询的结果大小
+    """
+    columns = OSRColumns()
+    pool_index: dict[str, int] = {}
+
+    def get_pool(pool_id: str) -> int:
+        if (pool := pool_index.get(pool_id)) is None:
+            pool = pool_index[pool_id] = len(columns.pool_ids)
+            columns.pool_ids.append(pool_id)
+        return pool
+
+    if conf.storage.packed_operators and np is not None:
+        async for values, pool_ids, packed in iter_packed_columns(flag, OperatorSearchRecord.pool_id.is_null(False)):
+            pools = np.asarray([get_pool(pool_id) for pool_id in pool_ids], np.int64)[packed.record]
+            for array, column in ((columns.time, values['time']), (columns.pool, pools), (columns.rarity, packed.rarity), (columns.is_up, packed.is_up)):
+                array.frombytes(column.astype(array.typecode).tobytes())
+        return columns
+
+    if conf.storage.packed_operators:
+        async for records in iter_packed_records(flag, OperatorSearchRecord.pool_id.is_null(False)):
+            for _, _, time, pool_id, data in records:
+                pool = get_pool(pool_id)
+                for operator in unpack_operators(data):
+                    columns.time.append(time)
+                    columns.pool.append(pool)
+                    columns.rarity.append(operator.rarity)
+                    columns.is_up.append(-1 if operator.is_up is None else operator.is_up)
+        return columns
+
+    last_id = 0
+    while True:
+        rows = await (OSROperator
+                      .select(OSROperator.id, OperatorSearchRecord.time, OperatorSearchRecord.pool_id, OSROperator.rarity, OSROperator.is_up)
+                      .join(OperatorSearchRecord)
+                      .join(Account)
+                      .join(DBUser)
+                      .where(is_enabled(flag) & OperatorSearchRecord.pool_id.is_null(False) & (OSROperator.id > last_id))
+                      .order_by(OSROperator.id)
+                      .limit(STATISTICS_PAGE_SIZE)
+                      .tuples()
+                      .aio_execute())
+        for _, time, pool_id, rarity, is_up in rows:
+            columns.time.append(time)
+            columns.pool.append(get_pool(pool_id))
+            columns.rarity.append(rarity)
+            columns.is_up.append(-1 if is_up is None else is_up)
+        if len(rows) < STATISTICS_PAGE_SIZE:
+            return columns
+        last_id = rows[-1][0]
+
+
+async def load_diamond_columns(flag: BooleanField) -> DiamondColumns:
+    columns = DiamondColumns()
+    operation_index: dict[str, int] = {}
+    rows = await (DiamondRecord
+                  .select(DiamondRecord.account, DiamondRecord.operation, DiamondRecord.before, DiamondRecord.after)
+                  .join(Account)
+                  .join(DBUser)
+                  .where(is_enabled(flag))
+                  .order_by(DiamondRecord.account, DiamondRecord.operate_time.desc())
+                  .tuples()
+                  .aio_execute())
+    for account, operation, before, after in rows:
+        if (index := operation_index.get(operation)) is None:
+            index = operation_index[operation] = len(columns.operations)
+            columns.operations.append(operation)
+        columns.account.append(account)
+        columns.operation.append(index)
+        columns.before.append(before)
+        columns.after.append(after)
+    return columns
+
+
+def get_pool_types(pool_ids: list[str]) -> dict[str, tuple[str, bool]]:
+    pool_types: dict[str, tuple[str, bool]] = {}
+    for pool_id in pool_ids:
+        pool_info = PoolInfo.get_pool_info(pool_id)
+        pool_types[pool_id] = (pool_info['type'], 'up_char_info' in pool_info)
+    return pool_types
 
 
 @cached_with_refresh(ttl=7200, key_builder=lambda: 'site_statistics')
-async def compute_site_statistics() -> dict:
-    enable_users: list[DBUser] = list([user for user in await DBUser.select().where(DBUser.disabled == False).aio_execute() if user.user_config.is_statistics])
-    accounts = [account for account in await Account.select().where(Account.owner.in_(enable_users)).aio_execute()]
+@use_pool('scheduled')
+@read_replica()
+async def compute_site_statistics() -> PreparedResponse[SiteStatisticsInfo]:
+    accounts: list[tuple[int, bool]] = list(await Account.select(Account.id, Account.available).join(DBUser).where(is_enabled(DBUser.is_statistics)).tuples().aio_execute())
+    account_ids = [account_id for account_id, _ in accounts]
 
     account_number: int = len(accounts)
-    available_account_number: int = await Account.select().where(Account.owner.in_(enable_users)).where(Account.available == True).aio_count()
+    available_account_number: int = sum(1 for _, available in accounts if available)
 
     account_info: dict = {
         'account_number': account_number,
@@ -270,106 +490,20 @@ async def compute_site_statistics() -> dict:
         'available_avg': available_account_number / account_number
     }
 
-    total_pay_money: int = 0
-
-    pay_records = await PayRecord.select().where(PayRecord.account.in_(accounts)).aio_execute()
-    pay_record: PayRecord
-    for pay_record in pay_records:
-        total_pay_money += pay_record.amount / 100
-
-    diamond_info: dict = {
-        'now': 0,
-        'total_use': 0,
-        'total_get': 0,
-        'type_use': defaultdict[str, dict[str, object]](lambda: {'type': '', 'number': 0}),
-        'type_get': defaultdict[str, dict[str, object]](lambda: {'type': '', 'number': 0})
-    }
-
-    for account in accounts:
-        diamond_records = await DiamondRecord.select().where(DiamondRecord.account == account).order_by(DiamondRecord.operate_time.desc()).aio_execute()
-        diamond_now = True
-
-        diamond_record: DiamondRecord
-        for diamond_record in diamond_records:
-            if diamond_now:
-                diamond_now = False
-                diamond_info['now'] += diamond_record.after
-
-            change = diamond_record.after - diamond_record.before
-            if change > 0:
-                diamond_info['total_get'] += change
-                diamond_info['type_get'][diamond_record.operation]['type'] = diamond_record.operation
-                diamond_info['type_get'][diamond_record.operation]['number'] += change
-            else:
-                diamond_info['total_use'] -= change
-                diamond_info['type_use'][diamond_record.operation]['type'] = diamond_record.operation
-                diamond_info['type_use'][diamond_record.operation]['number'] -= change
-
-    diamond_info['type_get'] = list(sorted(diamond_info['type_get'].values(), key=lambda x: x['number'], reverse=True))
-    diamond_info['type_use'] = list(sorted(diamond_info['type_use'].values(), key=lambda x: x['number'], reverse=True))
-
-    osr_info: dict = {
-        'osr_number_pool': defaultdict[str, int | dict[str, int]](int),
-        'osr_number_month': defaultdict(int),
-        'osr_lucky': {
-            '6': 0, '5': 0, '4': 0, '3': 0,
-            'count': {'6': 0, '5': 0, '4': 0, '3': 0}
-        },
-        'osr_lucky_avg': {'6': 0, '5': 0, '4': 0, '3': 0},
-        'osr_not_up': {'total': 0},
-        'osr_six': defaultdict(int),
-        'osr_not_up_avg': {}
-    }
-
-    osr_info['osr_number_pool']['total'] = {'all': 0, '3': 0, '4': 0, '5': 0, '6': 0}
-
-    records = await OperatorSearchRecord.select().where(OperatorSearchRecord.account.in_(accounts)).order_by(OperatorSearchRecord.time).aio_execute()
-    record: OperatorSearchRecord
-    for record in records:
-        pool_id: str = record.pool_id
-        if not pool_id:
-            continue
-
-        pool_info = PoolInfo.get_pool_info(pool_id)
-        if pool_info['type'] == 'UNKNOWN':
-            continue
-
-        operators = await OSROperator.select().where(OSROperator.record == record).aio_execute()
-        operators_number = len(operators)
-
-        osr_info['osr_number_month'][datetime.fromtimestamp(record.time).strftime('%Y-%m')] += operators_number
-        osr_info['osr_number_pool'][pool_id] += operators_number
-        osr_info['osr_number_pool']['total']['all'] += operators_number
-
-        operator: OSROperator
-        for operator in operators:
-            rarity = str(operator.rarity)
-            osr_info['osr_number_pool']['total'][rarity] += 1
-
-            for r in map(str, range(3, 7)):
-                osr_info['osr_lucky']['count'][r] += 1
-            osr_info['osr_lucky'][rarity] += 1
-
-            if rarity == '6' and 'up_char_info' in pool_info:
-                if pool_id not in osr_info['osr_not_up']:
-                    osr_info['osr_not_up'][pool_id] = 0
-
-                osr_info['osr_six'][pool_id] += 1
-                osr_info['osr_six']['total'] += 1
-                if not operator.is_up:
-                    osr_info['osr_not_up'][pool_id] += 1
-                    osr_info['osr_not_up']['total'] += 1
-
-    for r in map(str, range(3, 7)):
-        if osr_info['osr_lucky'][r] == 0:
-            osr_info['osr_lucky_avg'][r] = 0
-        else:
-            osr_info['osr_lucky_avg'][r] = osr_info['osr_lucky']['count'][r] / osr_info['osr_lucky'][r]
-
-    for osr_not_up_pool in osr_info['osr_not_up']:
-        osr_info['osr_not_up_avg'][osr_not_up_pool] = osr_info['osr_not_up'][osr_not_up_pool] / osr_info['osr_six'][osr_not_up_pool]
-
-    osr_info['osr_number_month'] = dict(reversed(osr_info['osr_number_month'].items()))
+    total_pay_money: int = (await PayRecord.select(fn.SUM(PayRecord.amount)).join(Account).join(DBUser).where(is_enabled(DBUser.is_statistics)).aio_scalar() or 0) / 100
+
+    # 有快照时直接在快照上计算(毫秒级), 否则从数据库读取, 聚合是 CPU 密集的, 放到独立进程中避免阻塞事件循环
+    osr_info = diamond_info = None
+    async with use_pull_snapshot() as pulls, use_diamond_snapshot() as diamonds:
+        if pulls is not None and diamonds is not None:
+            osr_info = summarize_snapshot_osr(pulls, pulls.mask(accounts=account_ids), get_pool_types(pulls.dictionary))
+            diamond_info = summarize_snapshot_diamond(diamonds, diamonds.mask(accounts=account_ids))
+    if osr_info is None:
+        osr_columns = await load_osr_columns(DBUser.is_statistics)
+        diamond_columns = await load_diamond_columns(DBUser.is_statistics)
+        osr_info, diamond_info = await asyncio.get_running_loop().run_in_executor(
+            statistics_executor, summarize_site_statistics, osr_columns, get_pool_types(osr_columns.pool_ids), diamond_columns
+        )
 
     statistics_info = {
         'account_info': account_info,
@@ -378,8 +512,8 @@ async def compute_site_statistics() -> dict:
         'osr_info': osr_info
     }
 
-    return statistics_info
+    return PreparedResponse(SiteStatisticsInfo.model_validate(statistics_info))
 
 
-async def get_site_statistics_info() -> SiteStatisticsInfo:
-    return SiteStatisticsInfo.model_validate(await compute_site_statistics())
+async def get_site_statistics_response(request: Request) -> Response:
+    return (await compute_site_statistics()).to_response(request)
@@ -0,0 +1,125 @@
+# 全站统计的聚合计算, 输入是按列存放的数组, 会在进程池中执行
+# 不要在这里导入数据库或配置相关的模块
+from array import array
+from datetime import datetime
+from dataclasses import dataclass, field
+from collections import defaultdict
+
+RARITIES = ('3', '4', '5', '6')
+
+
+@dataclass
+class OSRColumns:
+    """
+    寻访记录中的每个干员一行, pool 是 pool_ids 中的下标, is_up 为 -1 表示没有 UP 信息
+    """
+    pool_ids: list[str] = field(default_factory=list)
+    time: array = field(default_factory=lambda: array('q'))
+    pool: array = field(default_factory=lambda: array('i'))
+    rarity: array = field(default_factory=lambda: array('b'))
+    is_up: array = field(default_factory=lambda: array('b'))
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+
+@dataclass
+class DiamondColumns:
+    """
+    源石记录, 按账号分组, 组内按时间倒序, operation 是 operations 中的下标
+    """
+    operations: list[str] = field(default_factory=list)
+    account: array = field(default_factory=lambda: array('q'))
+    operation: array = field(default_factory=lambda: array('i'))
+    before: array = field(default_factory=lambda: array('q'))
+    after: array = field(default_factory=lambda: array('q'))
+
+    def __len__(self) -> int:
+        return len(self.account)
+
+
+def summarize_osr(columns: OSRColumns, pool_types: dict[str, tuple[str, bool]]) -> dict:
+    """
+    :param columns: 干员数据
+    :param pool_types: 卡池 id -> (卡池类型, 是否有 UP 干员)
+    """
+    valid_pools = [pool_types.get(pool_id, ('UNKNOWN', False))[0] != 'UNKNOWN' for pool_id in columns.pool_ids]
+    up_pools = [pool_types.get(pool_id, ('UNKNOWN', False))[1] for pool_id in columns.pool_ids]
+
+    month_cache: dict[int, str] = {}
+    number_month: defaultdict[str, int] = defaultdict(int)
+    number_pool: list[int] = [0] * len(columns.pool_ids)
+    first_time: list[int] = [0] * len(columns.pool_ids)
+    rarity_number: dict[str, int] = dict.fromkeys(RARITIES, 0)
+    six: list[int] = [0] * len(columns.pool_ids)
+    not_up: list[int] = [0] * len(columns.pool_ids)
+
+    for time, pool, rarity, is_up in zip(columns.time, columns.pool, columns.rarity, columns.is_up):
+        if not valid_pools[pool]:
+            continue
+
+        bucket = time // 900  # 按 15 分钟缓存月份字符串, 避免每行都格式化(时区偏移都是 15 分钟的整数倍)
+        if (month := month_cache.get(bucket)) is None:
+            month = month_cache[bucket] = datetime.fromtimestamp(time).strftime('%Y-%m')
+        number_month[month] += 1
+        if not number_pool[pool] or time < first_time[pool]:
+            first_time[pool] = time
+        number_pool[pool] += 1
+        rarity_number[str(rarity)] += 1
+
+        if rarity == 6 and up_pools[pool]:
+            six[pool] += 1
+            if is_up != 1:
+                not_up[pool] += 1
+
+    total = sum(rarity_number.values())
+    pools = sorted((index for index, number in enumerate(number_pool) if number), key=lambda index: (first_time[index], columns.pool_ids[index]))
+
+    osr_number_pool: dict[str, int | dict[str, int]] = {'total': {'all': total, **rarity_number}}
+    osr_number_pool.update((columns.pool_ids[index], number_pool[index]) for index in pools)
+
+    osr_not_up_avg: dict[str, float] = {'total': sum(not_up) / sum(six) if sum(six) else 0}
+    osr_not_up_avg.update((columns.pool_ids[index], not_up[index] / six[index]) for index in pools if six[index])
+
+    return {
+        'osr_number_pool': osr_number_pool,
+        'osr_number_month': dict(sorted(number_month.items(), reverse=True)),
+        'osr_lucky_avg': {r: total / rarity_number[r] if rarity_number[r] else 0 for r in reversed(RARITIES)},
+        'osr_not_up_avg': osr_not_up_avg
+    }
+
+
+def summarize_diamond(columns: DiamondColumns) -> dict:
+    now = total_use = total_get = 0
+    type_use: dict[int, int] = {}
+    type_get: dict[int, int] = {}
+
+    last_account = None
+    for account, operation, before, after in zip(columns.account, columns.operation, columns.before, columns.after):
+        if account != last_account:  # 每个账号的第一条是最新的记录
+            last_account = account
+            now += after
+
+        change = after - before
+        if change > 0:
+            total_get += change
+            type_get[operation] = type_get.get(operation, 0) + change
+        else:
+            total_use -= change
+            type_use[operation] = type_use.get(operation, 0) - change
+
+    def to_list(numbers: dict[int, int]) -> list[dict[str, object]]:
+        items = [{'type': columns.operations[operation], 'number': number} for operation, number in numbers.items()]
+        return sorted(items, key=lambda x: x['number'], reverse=True)
+
+    return {
+        'now': now,
+        'total_use': total_use,
+        'total_get': total_get,
+        'type_use': to_list(type_use),
+        'type_get': to_list(type_get)
+    }
+
+
+def summarize_site_statistics(osr: OSRColumns, pool_types: dict[str, tuple[str, bool]], diamond: DiamondColumns) -> tuple[dict, dict]:
+    return summarize_osr(osr, pool_types), summarize_diamond(diamond)
@@ -5,10 +5,14 @@ from jose import JWTError
 from pydantic import BaseModel, ConfigDict
 from bcrypt import checkpw, hashpw, gensalt
 
+from src.api.cache import TTLCache
 from src.api.databases import DBUser
 from src.api.models import UserConfig
 from src.api.utils import decode_jwt
 
+USER_CACHE_TTL = 30  # 秒, 多 worker 时其他进程最多读到这么久的旧数据
+USER_CACHE_SIZE = 4096
+
 
 class Token(BaseModel):
     access_token: str
@@ -40,7 +44,7 @@ class UserInDB(UserInfo):
     hashed_password: str
 
     async def get_db(self) -> DBUser:
-        return await DBUser.aio_get(DBUser.id == self.id)
+        return await DBUser.aio_get_by_id(self.id)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -57,6 +61,21 @@ async def get_user_by_email(email: str) -> UserInDB | None:
         return UserInDB.model_validate(user)
 
 
+user_cache: TTLCache[str, UserInDB] = TTLCache(ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE)
+
+
+async def get_cached_user_by_name(username: str) -> UserInDB | None:
+    if user := user_cache.get(username):
+        return user
+    if user := await get_user_by_name(username):
+        user_cache.set(username, user)
+    return user
+
+
+def invalidate_user_cache(username: str) -> None:
+    user_cache.delete(username)
+
+
 async def authenticate_user(data: OAuth2PasswordRequestForm = Depends()) -> UserInfo | None:
     user: UserInDB | None = await get_user_by_name(data.username)
     if user is None:
@@ -93,7 +112,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
-    user = await get_user_by_name(username=token_data.username)
+    user = await get_cached_user_by_name(username=token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -115,11 +134,15 @@ def get_password_hash(password: str) -> str:
 
 async def create_user(username: str, password: str, email: str) -> UserInfo:
     password = get_password_hash(password)
-    await DBUser.aio_create(username=username, hashed_password=password, email=email, user_config=UserConfig().model_dump_json())
+    config = UserConfig()
+    await DBUser.aio_create(username=username, hashed_password=password, email=email, user_config=config.model_dump_json(), **DBUser.config_columns(config))
     return await get_user_by_name(username)
 
 
 async def modify_user_config(user: UserInDB, config: UserConfig) -> None:
     db_user = await user.get_db()
     db_user.user_config = config.model_dump_json()
+    for name, value in DBUser.config_columns(config).items():
+        setattr(db_user, name, value)
     await db_user.aio_save()
+    invalidate_user_cache(user.username)
@@ -1,6 +1,9 @@
+import time
+
 from datetime import timedelta, timezone, datetime
-from asyncio import Semaphore, sleep
+from asyncio import Semaphore, Lock, sleep
 from secrets import token_urlsafe
+from urllib.parse import urlsplit
 from typing import cast, Optional, Coroutine, Any, Callable
 
 from aiohttp import ClientSession, ClientResponse
@@ -9,6 +12,7 @@ from jose import jwt
 
 from src.logger import logger
 from src.config import conf
+from src.api.metrics import upstream_request_seconds, upstream_retries
 
 
 class JustMsgModel(BaseModel):
@@ -16,6 +20,25 @@ class JustMsgModel(BaseModel):
     msg: str = 'ok'
 
 
+class AsyncRateLimiter:
+    """
+    按固定速率放行请求, 多个协程共享时依次排队
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval: float = 1 / rate
+        self._next_time: float = 0
+        self._lock: Lock = Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            await sleep(wait)
+
+
 class AsyncRequest:
     semaphore = Semaphore(5)  # 全局并发上限
 
@@ -52,21 +75,28 @@ class AsyncRequest:
 
     @classmethod
     async def _request_with_retry(cls, func: Callable[..., Coroutine[Any, Any, ClientResponse]], url: str, retries: int = 3, **kwargs: Any) -> Optional[dict[str, object]]:
+        host = urlsplit(url).hostname or 'unknown'
         for attempt in range(retries):
+            if attempt:
+                upstream_retries.inc(host=host)
+                await sleep(2 ** (attempt - 1))  # Exponential backoff
             async with cls.semaphore:
+                start = time.perf_counter()
+                status = 'error'
                 try:
                     async with func(url, **kwargs) as response:
+                        status = str(response.status)
                         if response.status // 100 == 2:
                             return cast(dict[str, object], await response.json())
                         else:
                             raise ValueError(f'Response {url} status code is {response.status}')
                 except ConnectionResetError as e:
                     logger.warning(f"Network error, attempt {attempt + 1}/{retries}: {e}")
-                    if attempt < retries - 1:
-                        await sleep(2 ** attempt)  # Exponential backoff
-                    else:
+                    if attempt == retries - 1:
                         logger.error(f"Failed after {retries} attempts")
                         raise ValueError(f'Response {url} failed after {retries} attempts')
+                finally:
+                    upstream_request_seconds.observe(time.perf_counter() - start, host=host, status=status)
 
 
 def f_hide_mid(info: str, count: int = 4, fix: str = '*') -> str:
@@ -1,31 +1,57 @@
-from contextlib import asynccontextmanager
+import asyncio
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import FastAPI, Depends, Request, HTTPException, status
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from src.config import conf
+from src.api.databases import use_identity_map, PoolTimeout
+from src.api.captcha import captcha_pool
+from src.api.job_worker import start_job_workers
+from src.api.rate_limit import RateLimitMiddleware
+from src.api.metrics import MetricsMiddleware, render_metrics, metrics_allowed
+from src.api.query_counter import QueryCounterMiddleware
+from src.api.column_snapshot import SNAPSHOT_REFRESH_SECONDS
+from src.api.pull_snapshot import load_pull_snapshot
+from src.api.diamond_snapshot import load_diamond_snapshot
 from src.backapi import users, captcha
 from src.backapi import statistics, email, accounts, account_datas, utils
-from src.api.auto_data_update import update_all_accounts_data, auto_get_gift, update_pool_info
+from src.api.auto_data_update import schedule_account_updates, auto_get_gift, update_pool_info
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):  # noqa
     scheduler = AsyncIOScheduler()
 
-    scheduler.add_job(update_all_accounts_data, CronTrigger.from_crontab(conf.analysis.update_time), misfire_grace_time=3)
     scheduler.add_job(auto_get_gift, CronTrigger.from_crontab(conf.analysis.auto_gift), misfire_grace_time=3600)
     scheduler.add_job(update_pool_info, CronTrigger.from_crontab(conf.analysis.pool_info_update), misfire_grace_time=60)
+    # 快照的全量加载只在这里进行, 写入记录后的 catch_up 和读取快照时都只做增量同步
+    scheduler.add_job(load_pull_snapshot, 'interval', seconds=SNAPSHOT_REFRESH_SECONDS, max_instances=1, coalesce=True)
+    scheduler.add_job(load_diamond_snapshot, 'interval', seconds=SNAPSHOT_REFRESH_SECONDS, max_instances=1, coalesce=True)
 
     scheduler.start()
+    tasks = [asyncio.create_task(captcha_pool.run()), asyncio.create_task(schedule_account_updates()), asyncio.create_task(load_pull_snapshot()), asyncio.create_task(load_diamond_snapshot()), *start_job_workers()]
     yield
+    for task in tasks:
+        task.cancel()
+    with suppress(asyncio.CancelledError):
+        await asyncio.gather(*tasks)
     scheduler.shutdown()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(use_identity_map)])
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):  # noqa
+    # 数据库连接池已满时快速失败, 而不是让请求一直排队
+    return JSONResponse(status_code=503, content={'detail': 'server.busy'})
+
 
 app.include_router(users.router)
 app.include_router(captcha.router)
@@ -35,6 +61,22 @@ app.include_router(statistics.router)
 app.include_router(email.router)
 app.include_router(utils.router)
 
+if conf.rate_limit.enable:
+    app.add_middleware(RateLimitMiddleware)  # type: ignore
+
+if conf.query_counter.enable:
+    app.add_middleware(QueryCounterMiddleware)  # type: ignore
+
+if conf.metrics.enable:
+    app.add_middleware(MetricsMiddleware)  # type: ignore
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(request: Request):
+        client_host = request.client.host if request.client else None
+        if not metrics_allowed(client_host, request.headers.get('Authorization'), conf.metrics.token, conf.metrics.allow_ips):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
 if conf.safe.DEBUG:
     app.add_middleware(
         CORSMiddleware,  # type: ignore
@@ -5,7 +5,8 @@ from src.api.accounts import AccountInfo, AccountInDB, AccountCreate, AccountRef
 from src.api.accounts import get_accounts, get_account_by_token, add_account_to_user, get_account_by_uid, del_account
 from src.api.accounts import refresh_account_data
 from src.api.arknights_data_analysis import ArknightsDataAnalysis
-from src.api.arkgacha_data_import import data_import
+from src.api.arkgacha_data_import import data_import, save_upload
+from src.api.jobs import JobInfo, get_jobs
 from src.api.utils import JustMsgModel
 from src.api.captcha import valid_captcha_code, CaptchaValid
 
@@ -60,10 +61,14 @@ async def refresh_account(account: AccountRefresh, current_user: UserBase = Depe
     return JustMsgModel(code=202, msg="accept")
 
 
+@router.post("/jobs", response_model=list[JobInfo])
+async def account_jobs(account: AccountInDB = Depends(get_account_by_uid)):
+    return await get_jobs(await account.get_db())
+
+
 @router.post("/import_from_arkgacha", status_code=status.HTTP_202_ACCEPTED, response_model=JustMsgModel)
 async def import_from_arkgacha(file: UploadFile, uid: str, captcha_token: str, code: str, user: UserBase = Depends(get_current_active_user)):
     valid_captcha_code(CaptchaValid(captcha_token=captcha_token, code=code))
     account = await get_account_by_uid(AccountBase(uid=uid), user)
-    file = await file.read()
-    await data_import(file, account)
+    await data_import(await save_upload(file), account)
     return JustMsgModel(code=202, msg="accept")
@@ -10,10 +10,9 @@ router = APIRouter(
 )
 
 
-# TODO 速率控制
 @router.get("/create", response_model=CaptchaInfo)
-def get_captcha():  # 不是异步 因为图像库不是异步
-    return create_captcha_code()
+async def get_captcha():  # 从预生成的池中取出 池空时在线程池中生成
+    return await create_captcha_code()
 
 
 @router.post("/validate", response_model=JustMsgModel, dependencies=[Depends(valid_captcha_code)])
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 
 from src.api.statistics import LuckyRankInfo, PoolLuckyRankInfo, UPRankInfo, SiteStatisticsInfo
-from src.api.statistics import get_lucky_rank_info, get_pool_lucky_rank_info, get_six_up_rank_info, get_site_statistics_info
+from src.api.statistics import get_lucky_rank_response, get_pool_lucky_rank_response, get_six_up_rank_response, get_site_statistics_response
 from src.api.users import UserInDB, get_current_active_user
 from src.api.utils import JustMsgModel
 
@@ -12,29 +12,29 @@ router = APIRouter(
 
 
 @router.get("/lucky_rank", response_model=LuckyRankInfo | JustMsgModel)
-async def lucky_rank(current_user: UserInDB = Depends(get_current_active_user)):
-    info: LuckyRankInfo = await get_lucky_rank_info(current_user)
-    if info is None:
+async def lucky_rank(request: Request, current_user: UserInDB = Depends(get_current_active_user)):
+    response = await get_lucky_rank_response(request, current_user)
+    if response is None:
         return JustMsgModel(code=404, msg="No lucky rank info available")
-    return info
+    return response
 
 
 @router.get("/pool_lucky_rank", response_model=PoolLuckyRankInfo | JustMsgModel)
-async def pool_lucky_rank(current_user: UserInDB = Depends(get_current_active_user)):
-    info: LuckyRankInfo = await get_pool_lucky_rank_info(current_user)
-    if info is None:
+async def pool_lucky_rank(request: Request, current_user: UserInDB = Depends(get_current_active_user)):
+    response = await get_pool_lucky_rank_response(request, current_user)
+    if response is None:
         return JustMsgModel(code=404, msg="No pool lucky rank info available")
-    return info
+    return response
 
 
 @router.get("/six_up_rank", response_model=UPRankInfo | JustMsgModel)
-async def six_up_rank(current_user: UserInDB = Depends(get_current_active_user)):
-    info: UPRankInfo = await get_six_up_rank_info(current_user)
-    if info is None:
+async def six_up_rank(request: Request, current_user: UserInDB = Depends(get_current_active_user)):
+    response = await get_six_up_rank_response(request, current_user)
+    if response is None:
         return JustMsgModel(code=404, msg="No six up rank info available")
-    return info
+    return response
 
 
 @router.get("/site_statistics", response_model=SiteStatisticsInfo, dependencies=[Depends(get_current_active_user)])
-async def site_statistics():
-    return await get_site_statistics_info()
+async def site_statistics(request: Request):
+    return await get_site_statistics_response(request)
@@ -3,11 +3,12 @@ import json
 
 
 class ConfigData:
-    version: str = '0.2.3'
-    database_version: str = '0.1.1'
+    version: str = '0.2.20'
+    database_version: str = '0.1.7'
     data: dict = {
         'version': version,
         'database_version': database_version,
+        'operator_storage': 'rows',  # 数据库中干员当前的保存方式, 由程序维护
         'safe': {
             'SECRET_KEY': os.urandom(32).hex(),
             'ALGORITHM': 'HS256',
@@ -33,17 +34,82 @@ class ConfigData:
             'use_tls': True
         },
         'analysis': {
-            'update_time': '20 4 * * *',
+            'update_interval': 86400,
+            'update_batch_size': 20,
+            'update_check_interval': 60,
+            'update_min_interval': 4 * 3600,
+            'update_max_interval': 7 * 86400,
+            'update_target_records': 10,
+            'activity_window': 3 * 86400,
             'auto_gift': '0 5 * * *',
+            'gift_dead_codes': [],
             'pool_info_update': '15 4 * * *',
-            'pool_info_url': 'https://raw.githubusercontent.com/s-yh-china/ArknightsGachaData/refs/heads/master/data/pool_info.json'
+            'pool_info_url': 'https://raw.githubusercontent.com/s-yh-china/ArknightsGachaData/refs/heads/master/data/pool_info.json',
+            'page_size': 200
+        },
+        'captcha': {
+            'pool_size': 256
+        },
+        'rate_limit': {
+            'enable': True,
+            'rate': 2.0,
+            'burst': 60,
+            'default_cost': 1,
+            'costs': {
+                '/api/captcha/create': 3,
+                '/api/accounts/refresh': 20,
+                '/api/accounts/import_from_arkgacha': 30,
+                '/api/statistics/site_statistics': 5,
+                '/api/statistics/lucky_rank': 5,
+                '/api/statistics/pool_lucky_rank': 5,
+                '/api/statistics/six_up_rank': 5
+            }
+        },
+        'jobs': {
+            'workers': 4,
+            'max_running': 8,
+            'max_attempts': 3,
+            'retry_delay': 60,
+            'poll_interval': 5,
+            'timeout': 1800
+        },
+        'arkgacha_import': {
+            'max_upload_size': 32 * 1024 * 1024,
+            'verify_workers': 2
+        },
+        'metrics': {
+            'enable': False,
+            'token': '',
+            'allow_ips': ['127.0.0.1', '::1']
+        },
+        'statistics': {
+            'workers': 1,
+            'snapshot': True,
+            'snapshot_reload_interval': 86400
+        },
+        'storage': {
+            'packed_operators': False
+        },
+        'query_counter': {
+            'enable': False,
+            'max_queries': 50,
+            'max_time': 1.0
         },
         'mysql': {
             'host': 'localhost',
             'user': 'root',
             'password': '',
             'database': '',
-            'port': 3306
+            'port': 3306,
+            'pools': {
+                'api': {'max_connections': 50, 'acquire_timeout': 5},
+                'ingestion': {'max_connections': 30, 'acquire_timeout': 60},
+                'scheduled': {'max_connections': 20, 'acquire_timeout': 120},
+                'read': {'max_connections': 50, 'acquire_timeout': 30}
+            },
+            'read_host': None,
+            'read_port': 3306,
+            'read_fresh_seconds': 30
         },
         'web': {
             'host': '0.0.0.0',
@@ -106,6 +172,79 @@ class ConfigData:
         if config_version == '0.2.2':
             config_version = '0.2.3'
             local_config['safe']['CORS']['allow_origin_regex'] = None
+        if config_version == '0.2.3':
+            config_version = '0.2.4'
+            local_config['captcha'] = {
+                'pool_size': 256
+            }
+        if config_version == '0.2.4':
+            config_version = '0.2.5'
+            local_config['rate_limit'] = cls.data['rate_limit']
+        if config_version == '0.2.5':
+            config_version = '0.2.6'
+            local_config['jobs'] = cls.data['jobs']
+        if config_version == '0.2.6':
+            config_version = '0.2.7'
+            local_config['arkgacha_import'] = cls.data['arkgacha_import']
+        if config_version == '0.2.7':
+            config_version = '0.2.8'
+            local_config['analysis']['page_size'] = 200
+        if config_version == '0.2.8':
+            config_version = '0.2.9'
+            local_config['analysis'].pop('update_time', None)
+            local_config['analysis']['update_interval'] = 86400
+            local_config['analysis']['update_batch_size'] = 20
+            local_config['analysis']['update_check_interval'] = 60
+        if config_version == '0.2.9':
+            config_version = '0.2.10'
+            local_config['analysis']['update_min_interval'] = 4 * 3600
+            local_config['analysis']['update_max_interval'] = 7 * 86400
+            local_config['analysis']['update_target_records'] = 10
+            local_config['analysis']['activity_window'] = 3 * 86400
+        if config_version == '0.2.10':
+            config_version = '0.2.11'
+            local_config['metrics'] = cls.data['metrics']
+        if config_version == '0.2.11':
+            config_version = '0.2.12'
+            local_config['query_counter'] = cls.data['query_counter']
+        if config_version == '0.2.12':
+            config_version = '0.2.13'
+            local_config['statistics'] = {'workers': 1}
+        if config_version == '0.2.13':
+            config_version = '0.2.14'
+            local_config['statistics']['snapshot'] = True
+            local_config['statistics']['snapshot_reload_interval'] = 86400
+        if config_version == '0.2.14':
+            config_version = '0.2.15'
+            local_config['storage'] = {'packed_operators': False}
+            local_config['operator_storage'] = 'rows'
+        if config_version == '0.2.15':
+            config_version = '0.2.16'
+            local_config['mysql']['max_connections'] = 100
+            local_config['mysql']['read_host'] = None
+            local_config['mysql']['read_port'] = local_config['mysql']['port']
+            local_config['mysql']['read_max_connections'] = 50
+            local_config['mysql']['read_fresh_seconds'] = 30
+        if config_version == '0.2.16':
+            config_version = '0.2.17'
+            # 原来的主库连接池按 5:3:2 分给三个连接池
+            max_connections = local_config['mysql'].pop('max_connections')
+            local_config['mysql']['pools'] = {
+                'api': {'max_connections': max(1, max_connections // 2), 'acquire_timeout': 5},
+                'ingestion': {'max_connections': max(1, max_connections * 3 // 10), 'acquire_timeout': 60},
+                'scheduled': {'max_connections': max(1, max_connections // 5), 'acquire_timeout': 120},
+                'read': {'max_connections': local_config['mysql'].pop('read_max_connections'), 'acquire_timeout': 30}
+            }
+        if config_version == '0.2.17':
+            config_version = '0.2.18'
+            local_config['jobs']['max_running'] = 8
+        if config_version == '0.2.18':
+            config_version = '0.2.19'
+            local_config['analysis']['gift_dead_codes'] = []
+        if config_version == '0.2.19':
+            config_version = '0.2.20'
+            local_config['metrics']['token'] = ''
+            local_config['metrics']['allow_ips'] = ['127.0.0.1', '::1']
         local_config['version'] = config_version
         cls.data = local_config
         cls.update_data()
@@ -117,3 +256,12 @@ class ConfigData:
             cls.data['database_version'] = cls.database_version
             cls.update_data()
         return database_version
+
+    @classmethod
+    def get_operator_storage(cls) -> str:
+        return cls.data.get('operator_storage', 'rows')
+
+    @classmethod
+    def set_operator_storage(cls, storage: str):
+        cls.data['operator_storage'] = storage
+        cls.update_data()
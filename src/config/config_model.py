@@ -52,10 +52,71 @@ class EmailConfig(BaseModel):
 
 
 class AnalysisConfig(BaseModel):
-    update_time: CronType
+    update_interval: int
+    update_batch_size: int
+    update_check_interval: int
+    update_min_interval: int
+    update_max_interval: int
+    update_target_records: int
+    activity_window: int
     auto_gift: CronType
+    gift_dead_codes: list[int]  # 兑换码无效或过期时上游返回的 code, 只有这些失败会让礼包码被视为失效; 上游没有公开这些 code, 默认为空(不判断失效), 需要按 auto_get_gift 日志中的 "failed with upstream codes" 填写
     pool_info_update: CronType
     pool_info_url: str
+    page_size: int
+
+
+class CaptchaConfig(BaseModel):
+    pool_size: int
+
+
+class RateLimitConfig(BaseModel):
+    enable: bool
+    rate: float
+    burst: float
+    default_cost: float
+    costs: dict[str, float]
+
+
+class JobsConfig(BaseModel):
+    workers: int  # 每个进程同时执行的后台任务上限
+    max_running: int  # 所有进程同时执行的后台任务上限
+    max_attempts: int
+    retry_delay: int
+    poll_interval: int
+    timeout: int
+
+
+class ArkgachaImportConfig(BaseModel):
+    max_upload_size: int
+    verify_workers: int
+
+
+class MetricsConfig(BaseModel):
+    enable: bool
+    token: str  # 非空时可以用 Authorization: Bearer <token> 访问 /metrics
+    allow_ips: list[str]  # 不需要 token 就能访问 /metrics 的客户端地址
+
+
+class StatisticsConfig(BaseModel):
+    workers: int  # 计算全站统计的进程数
+    snapshot: bool  # 在内存中保存所有寻访记录的列存快照(需要 numpy)
+    snapshot_reload_interval: int  # 快照全量重新加载的间隔(秒), 用于同步其他进程对已有记录的修改
+
+
+class StorageConfig(BaseModel):
+    packed_operators: bool  # 寻访记录的干员打包保存在 OperatorSearchRecord.packed_operators 中, 不使用 OSROperator 表, 修改后启动时转换已有数据
+
+
+class QueryCounterConfig(BaseModel):
+    enable: bool
+    max_queries: int  # 单个请求或任务超过这么多条 SQL 时记录日志
+    max_time: float  # 单个请求或任务的 SQL 总耗时超过这么多秒时记录日志
+
+
+class MysqlPoolConfig(BaseModel):
+    max_connections: int
+    acquire_timeout: float  # 等待连接超过这么多秒时放弃
 
 
 class MysqlConfig(BaseModel):
@@ -64,6 +125,10 @@ class MysqlConfig(BaseModel):
     password: str
     database: str
     port: int
+    pools: dict[str, MysqlPoolConfig]  # api, ingestion, scheduled 三个主库连接池和只读副本的 read 连接池
+    read_host: str | None  # 只读副本的地址, 为空时所有查询都使用主库, 用户名密码和数据库名与主库相同
+    read_port: int
+    read_fresh_seconds: int  # 账号的任务结束后这么多秒内, 读取账号数据时仍然使用主库
 
 
 class WebConfig(BaseModel):
@@ -78,5 +143,13 @@ class ServerConfig(BaseModel):
     user: UserConfig
     email: EmailConfig
     analysis: AnalysisConfig
+    captcha: CaptchaConfig
+    rate_limit: RateLimitConfig
+    jobs: JobsConfig
+    arkgacha_import: ArkgachaImportConfig
+    metrics: MetricsConfig
+    statistics: StatisticsConfig
+    storage: StorageConfig
+    query_counter: QueryCounterConfig
     mysql: MysqlConfig
     web: WebConfig
@@ -0,0 +1,224 @@
+# 测试在临时目录中使用默认配置运行, 数据库连接换成内存中的 FakeDatabase, 不需要 MySQL 和网络
+# FakeDatabase 只按 FROM / JOIN 返回表中的所有行(忽略 WHERE, ORDER BY 和 LIMIT), 写入语句不做任何事
+# 用来统计接口执行的 SQL 数量, 不能用来验证查询结果
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+
+from pathlib import Path
+from typing import Any, Iterator
+
+import httpx
+import peewee
+import pytest
+
+from peewee_async.pool import MysqlPoolBackend
+
+ROOT = Path(__file__).parent.parent
+WORKDIR = Path(tempfile.mkdtemp(prefix='arknights-data-analysis-test-'))
+POOL_INFO = {
+    'pool': {
+        'LIMITED_TEST_1': {
+            'id': 'LIMITED_TEST_1', 'name': '测试寻访', 'real_name': '测试寻访', 'type': 'LIMITED', 'start': 0, 'end': 4102444800,
+            'up_char_info': ['测试干员']
+        }
+    },
+    'process': []
+}
+
+TABLE_PATTERN = re.compile(r'(FROM|(?:LEFT OUTER |INNER )?JOIN) `(\w+)` AS `(\w+)`(?: ON \(`(\w+)`\.`(\w+)` = `(\w+)`\.`(\w+)`\))?')
+COLUMN_PATTERN = re.compile(r'^`(\w+)`\.`(\w+)`(?: AS `(\w+)`)?$')
+
+
+class FakeDatabase:
+    def __init__(self) -> None:
+        self.tables: dict[str, list[dict[str, Any]]] = {}
+
+    def insert(self, table: str, **row: Any) -> dict[str, Any]:
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def select(self, sql: str) -> tuple[list[tuple], list[tuple]]:
+        """
+        :return: (结果行, description)
+        """
+        if ' FROM ' not in sql:
+            return [(0,)], [('0',)]
+        columns = split_columns(sql[len('SELECT '):sql.index(' FROM ')].removeprefix('DISTINCT '))
+        joined: list[dict[str, dict[str, Any]]] = []
+        for kind, table, alias, left, left_column, right, right_column in TABLE_PATTERN.findall(sql):
+            rows = self.tables.get(table, [])
+            if kind == 'FROM':
+                joined = [{alias: row} for row in rows]
+                continue
+            result = []
+            for item in joined:
+                other, other_column, column = (left, left_column, right_column) if left != alias else (right, right_column, left_column)
+                match = next((row for row in rows if item.get(other) and row.get(column) == item[other].get(other_column)), None)
+                if match is not None or kind.startswith('LEFT'):
+                    result.append({**item, alias: match or {}})
+            joined = result
+
+        values = []
+        description = []
+        for column in columns:
+            if match := COLUMN_PATTERN.match(column):
+                alias, name, as_name = match.groups()
+                values.append(lambda item, alias=alias, name=name: item[alias].get(name))
+                description.append((as_name or name,))
+            else:  # 聚合等表达式
+                values.append(lambda item: 0)
+                description.append((column,))
+        return [tuple(value(item) for value in values) for item in joined], description
+
+
+def split_columns(text: str) -> list[str]:
+    columns, depth, start = [], 0, 0
+    for index, char in enumerate(text):
+        depth += char == '('
+        depth -= char == ')'
+        if char == ',' and not depth:
+            columns.append(text[start:index].strip())
+            start = index + 1
+    columns.append(text[start:].strip())
+    return columns
+
+
+fake_database = FakeDatabase()
+
+
+class FakeCursor:
+    def __init__(self) -> None:
+        self.rows: list[tuple] = []
+        self.description: list[tuple] | None = None
+        self.rowcount: int = 0
+        self.lastrowid: int = 1
+
+    def execute(self, sql: str, params: Any = None) -> None:
+        if sql.startswith('SELECT'):
+            self.rows, self.description = fake_database.select(sql)
+        else:
+            self.rows, self.description = [], None
+
+    def fetchone(self) -> tuple | None:
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self) -> list[tuple]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self) -> None:
+        pass
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self.fetchall())
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+class FakeAsyncCursor(FakeCursor):
+    async def execute(self, sql: str, params: Any = None) -> None:  # type: ignore[override]
+        super().execute(sql, params)
+
+    async def fetchone(self) -> tuple | None:  # type: ignore[override]
+        return super().fetchone()
+
+    async def fetchall(self) -> list[tuple]:  # type: ignore[override]
+        return super().fetchall()
+
+    async def __aenter__(self) -> 'FakeAsyncCursor':
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+
+class FakeConnection:
+    server_version = '8.0.36'
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor()
+
+    def ping(self, *args: Any) -> None:
+        pass
+
+    def begin(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeAsyncConnection(FakeConnection):
+    def cursor(self) -> FakeAsyncCursor:  # type: ignore[override]
+        return FakeAsyncCursor()
+
+
+async def fake_acquire(self: MysqlPoolBackend) -> FakeAsyncConnection:
+    return FakeAsyncConnection()
+
+
+def offline_get(*args: Any, **kwargs: Any) -> httpx.Response:
+    raise httpx.ConnectError('Network is disabled in tests')
+
+
+def prepare() -> None:
+    """
+    在导入 src 之前调用: 准备工作目录和默认配置, 替换数据库连接和网络请求
+    """
+    shutil.copytree(ROOT / 'data', WORKDIR / 'data')
+    (WORKDIR / 'data' / 'pool_info.json').write_text(json.dumps(POOL_INFO, ensure_ascii=False), encoding='utf-8')
+    os.chdir(WORKDIR)
+    sys.path.insert(0, str(ROOT))
+
+    httpx.get = offline_get
+    peewee.MySQLDatabase._connect = lambda self: FakeConnection()
+    MysqlPoolBackend.acquire = fake_acquire
+    MysqlPoolBackend.release = lambda self, connection: None
+
+    try:
+        import src.config
+    except SystemExit:  # 没有 config.json 时写入默认配置后退出, 再导入一次
+        for name in [name for name in sys.modules if name.startswith('src')]:
+            del sys.modules[name]
+        import src.config
+    src.config.conf.mysql.database = 'arknights_test'  # 默认配置没有数据库名, peewee 会认为数据库还没有初始化
+
+
+prepare()
+
+
+@pytest.fixture
+def fake_db() -> Iterator[FakeDatabase]:
+    fake_database.tables.clear()
+    yield fake_database
+    fake_database.tables.clear()
+
+
+@pytest.fixture
+def track_queries() -> Iterator[Any]:
+    """
+    统计测试中(包括 TestClient 的请求中)执行的 SQL, 用法: assert track_queries.count <= 3, track_queries.summary()
+    """
+    from src.api.query_counter import track_queries
+
+    with track_queries() as stats:
+        yield stats
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus: int) -> None:
+    os.chdir(ROOT)
+    shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from src.api.databases import OperatorSearchRecord, OSROperator, DICTIONARY_MISSING_ID, operator_names, pool_names
+
+
+def test_unknown_filter_value_matches_nothing():
+    pool_names.add([(1, 'LIMITED_TEST_1')])
+    _, params = OperatorSearchRecord.select().where(OperatorSearchRecord.pool_id.in_(['LIMITED_TEST_1', '不存在的卡池'])).sql()
+    assert params == [1, DICTIONARY_MISSING_ID]
+    _, params = OperatorSearchRecord.select().where(OperatorSearchRecord.pool_id == '不存在的卡池').sql()
+    assert params == [DICTIONARY_MISSING_ID]
+
+
+def test_unregistered_value_is_not_written():
+    with pytest.raises(KeyError):
+        OSROperator.insert(record=1, index=0, name='没有注册的干员', rarity=6, is_new=False).sql()
+
+
+def test_value_added_by_other_process_is_reloaded(fake_db):
+    fake_db.insert('operator', id=operator_names.max_id + 1, name='其他进程新增的干员', rarity=6)
+    fake_db.insert('osroperator', id=1, record_id=1, index=0, name=operator_names.max_id + 1, rarity=6, is_new=True, is_up=None)
+
+    async def run() -> list[OSROperator]:
+        return list(await OSROperator.select().aio_execute())
+
+    operators = asyncio.run(run())
+    assert [operator.name for operator in operators] == ['其他进程新增的干员']
@@ -0,0 +1,56 @@
+import io
+import json
+
+import pytest
+
+from src.api.json_stream import JsonStreamReader
+
+
+class SplitFile(io.RawIOBase):
+    """
+    按指定的位置把数据切成块返回, 模拟块边界落在任意位置
+    """
+
+    def __init__(self, data: bytes, *splits: int) -> None:
+        bounds = [0, *splits, len(data)]
+        self.chunks = [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    def read(self, size: int = -1) -> bytes:
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+DOCUMENTS = [
+    {'1556668800': {'p': '常驻标准寻访', 'c': [['干员', 5, 0]]}, 'value': 98064.047125, 'n': -12.5e-3, 'big': 6.02E+23, 'i': 1234567},
+    [1.5, -0.0, 3e10, 12, {'x': 7.25}],
+    {'a': 1e5, 'b': 98064, 'c': -7}
+]
+
+
+def read_document(reader: JsonStreamReader, value: object) -> object:
+    if isinstance(value, dict):
+        return {key: read_document(reader, value[key]) for key in reader.iter_object()}
+    return reader.read_value()
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_numbers_split_at_every_position(document: object) -> None:
+    data = json.dumps(document, ensure_ascii=False).encode()
+    for split in range(1, len(data)):
+        reader = JsonStreamReader(SplitFile(data, split))  # type: ignore[arg-type]
+        assert read_document(reader, document) == document, split
+        assert reader.at_end()
+
+
+def test_top_level_number_at_every_split() -> None:
+    for text in ('98064.047', '-1.5e-7', '6E+23', '120'):
+        data = text.encode()
+        for split in range(1, len(data)):
+            assert JsonStreamReader(SplitFile(data, split)).read_value() == json.loads(text)  # type: ignore[arg-type]
+
+
+def test_small_chunks() -> None:
+    document = {str(i): {'v': i * 1.0001, 'e': i * 1e-9} for i in range(200)}
+    data = json.dumps(document).encode()
+    for chunk_size in range(1, 12):
+        reader = JsonStreamReader(io.BytesIO(data), chunk_size=chunk_size)
+        assert read_document(reader, document) == document
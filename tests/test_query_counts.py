@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from src.app import app
+from src.api.users import UserInDB, UserConfig, get_current_user
+from src.api.databases import operator_names, pool_names
+
+USER_ID = 1
+ACCOUNT_UID = '10000001'
+RECORDS = 30  # 每个接口的查询数都不能随记录数增长
+
+
+@pytest.fixture
+def client(fake_db):
+    fake_db.insert('dbuser', id=USER_ID, username='tester', email='tester@example.com', hashed_password='', user_config=json.dumps(UserConfig().model_dump_json()), disabled=False)
+    fake_db.insert('account', id=1, uid=ACCOUNT_UID, owner_id=USER_ID, nickname='tester', token='', channel='OFFICIAL', available=True, next_update_at=0, last_update_at=0)
+    fake_db.insert('operator', id=1, name='测试干员', rarity=6)
+    fake_db.insert('gachapool', id=1, name='LIMITED_TEST_1')
+    operator_names.add([(1, '测试干员')])
+    pool_names.add([(1, 'LIMITED_TEST_1')])
+    for record_id in range(1, RECORDS + 1):
+        fake_db.insert('operatorsearchrecord', id=record_id, account_id=1, pool_id=1, real_pool=1, time=1700000000 + record_id * 60)
+        for index in range(10):
+            fake_db.insert('osroperator', id=record_id * 10 + index, record_id=record_id, index=index, name=1, rarity=6 if index == 0 else 3, is_new=False, is_up=index == 0)
+        fake_db.insert('payrecord', id=record_id, order_id=str(record_id), name='源石', account_id=1, pay_time=1700000000 + record_id, platform='iOS', amount=600)
+        fake_db.insert('diamondrecord', id=record_id, account_id=1, operation='购买', platform='iOS', operate_time=1700000000 + record_id, before=record_id, after=record_id + 1)
+
+    user = UserInDB(id=USER_ID, username='tester', email='tester@example.com', hashed_password='', disabled=False, user_config=UserConfig())
+    app.dependency_overrides[get_current_user] = lambda: user
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize('path, params, max_queries', [
+    ('/api/accounts/data/osr_info', {}, 3),
+    ('/api/accounts/data/osr_pool_info', {'pool': 'LIMITED_TEST_1'}, 3),
+    ('/api/accounts/data/pay_record_info', {}, 2),
+    ('/api/accounts/data/diamond_info', {}, 2)
+])
+def test_account_data_max_queries(client, track_queries, path, params, max_queries):
+    response = client.post(path, params=params, json={'uid': ACCOUNT_UID})
+    assert response.status_code == 200, response.text
+    assert track_queries.count <= max_queries, track_queries.summary()
@@ -0,0 +1,25 @@
+import asyncio
+
+from benchmark.statistics_lag import generate_columns, measure_lag
+from src.api.statistics import statistics_executor
+from src.api.statistics_compute import summarize_site_statistics
+
+MAX_LAG = 0.1  # 秒, 在事件循环中直接聚合这么多记录需要几百毫秒
+
+
+def test_site_statistics_in_executor_keeps_event_loop_responsive():
+    columns = generate_columns(300000, 300)
+
+    async def run() -> tuple[tuple[dict, dict], list[float]]:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(statistics_executor, int)  # 预热进程, spawn 启动时需要导入模块
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_lag(stop))
+        await asyncio.sleep(0.05)
+        result = await loop.run_in_executor(statistics_executor, summarize_site_statistics, *columns)
+        stop.set()
+        return result, await lag_task
+
+    result, lags = asyncio.run(run())
+    assert result == summarize_site_statistics(*columns)
+    assert max(lags) < MAX_LAG, f'Event loop blocked for {max(lags) * 1000:.1f}ms'
@@ -6,7 +6,7 @@ from datetime import datetime
 from peewee import CharField, BooleanField, ForeignKeyField, IntegerField, DateTimeField, AutoField
 from peewee_async import AioModel
 
-from src.api.databases import ReconnectAsyncPooledMySQLDatabase, AccountChannel, Platform
+from src.api.databases import ReconnectAsyncPooledMySQLDatabase, AccountChannel, Platform, operator_names, pool_names
 from src.api.databases import Account as NewAccount, OperatorSearchRecord as NewOperatorSearchRecord, OSROperator as NewOSROperator
 from src.api.databases import DiamondRecord as NewDiamondRecord, PayRecord as NewPayRecord, GiftRecord as NewGiftRecord
 from src.api.arknights_data_analysis import ArknightsDataAnalysis
@@ -120,6 +120,11 @@ async def move():
         else:
             pool_id = PoolInfo.get_pool_id_by_info(real_pool, old_osr.time)  # noqa
 
+        operators = await OSROperator.select().where(OSROperator.record == old_osr).aio_execute()
+        # 卡池和干员名称保存为字典表的 id, 写入之前需要注册
+        await pool_names.aio_register({value: {} for value in (real_pool, pool_id) if value})
+        await operator_names.aio_register({operator.name: {'rarity': operator.rarity} for operator in operators})
+
         new_osr = await NewOperatorSearchRecord.aio_create(
             account=account,
             time=old_osr.time,
@@ -130,7 +135,6 @@ async def move():
         pool_info = PoolInfo.get_pool_info(pool_id)
         is_up_pool = 'up_char_info' in pool_info
 
-        operators = await OSROperator.select().where(OSROperator.record == old_osr).aio_execute()
         for operator in operators:
             await NewOSROperator.aio_create(
                 name=operator.name,